@@ -9,12 +9,10 @@ Warehouse Movement Service
 - Предоставление API для работы с данными
 """
 
-import logging
-
-from app.config import settings
+from app.logging_config import setup_logging
 from app.main import (  # noqa: F401
     app,
     create_db,
 )
 
-logging.basicConfig(level=logging.DEBUG if settings.DEBUG else logging.INFO)
+setup_logging()
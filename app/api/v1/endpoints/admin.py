@@ -7,6 +7,12 @@ from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.config import settings
 from app.db.session import get_session_dependency
+from app.services.id_registry import (
+    warehouse_registry,
+    product_registry,
+    processed_event_registry,
+)
+from app.services.redis import cache_stats as get_cache_stats
 
 router = APIRouter(include_in_schema=False)
 
@@ -37,3 +43,15 @@ async def readiness(
 ) -> OkAnswer:
     (await session.execute(text("SELECT 1;"))).scalars()
     return "OK"
+
+
+@router.get("/cache_stats", include_in_schema=False)
+async def cache_stats() -> dict:
+    return {
+        "id_registry": {
+            "warehouses": warehouse_registry.stats(),
+            "products": product_registry.stats(),
+            "processed_events": processed_event_registry.stats(),
+        },
+        **get_cache_stats(),
+    }
@@ -0,0 +1,156 @@
+from datetime import date
+from typing import Optional
+from uuid import UUID
+
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy import BigInteger, and_, cast, func, select, true
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.api.v1.schemas import ProductAnalytics, RouteAnalytics
+from app.db.models import MovementRollup
+from app.db.session import get_session_dependency
+from app.services.rollups import estimate_quantile
+
+router = APIRouter()
+
+
+# Время в пути и недостача по маршрутам
+@router.get(
+    "/routes",
+    response_model=list[RouteAnalytics],
+    summary="Статистика перемещений по маршрутам",
+)
+async def routes_analytics(
+    since: Optional[date] = Query(None, description="С этого дня прибытия"),
+    until: Optional[date] = Query(None, description="По этот день прибытия"),
+    source_warehouse_id: Optional[UUID] = Query(None, description="Склад-отправитель"),
+    destination_warehouse_id: Optional[UUID] = Query(
+        None, description="Склад-получатель"
+    ),
+    product_id: Optional[UUID] = Query(None, description="ID товара"),
+    session: AsyncSession = Depends(get_session_dependency),
+):
+    stmt = _rollups(since, until)
+    if source_warehouse_id is not None:
+        stmt = stmt.where(MovementRollup.source_warehouse_id == source_warehouse_id)
+    if destination_warehouse_id is not None:
+        stmt = stmt.where(
+            MovementRollup.destination_warehouse_id == destination_warehouse_id
+        )
+    if product_id is not None:
+        stmt = stmt.where(MovementRollup.product_id == product_id)
+    return await _aggregate(
+        session, stmt, ("source_warehouse_id", "destination_warehouse_id")
+    )
+
+
+# Время в пути и недостача по товарам
+@router.get(
+    "/products",
+    response_model=list[ProductAnalytics],
+    summary="Статистика перемещений по товарам",
+)
+async def products_analytics(
+    since: Optional[date] = Query(None, description="С этого дня прибытия"),
+    until: Optional[date] = Query(None, description="По этот день прибытия"),
+    product_id: Optional[UUID] = Query(None, description="ID товара"),
+    session: AsyncSession = Depends(get_session_dependency),
+):
+    stmt = _rollups(since, until)
+    if product_id is not None:
+        stmt = stmt.where(MovementRollup.product_id == product_id)
+    return await _aggregate(session, stmt, ("product_id",))
+
+
+def _rollups(since: Optional[date], until: Optional[date]):
+    stmt = select(
+        MovementRollup.source_warehouse_id,
+        MovementRollup.destination_warehouse_id,
+        MovementRollup.product_id,
+        MovementRollup.movements_count,
+        MovementRollup.transit_seconds_sum,
+        MovementRollup.transit_seconds_min,
+        MovementRollup.transit_seconds_max,
+        MovementRollup.quantity_diff_sum,
+        MovementRollup.transit_histogram,
+    )
+    if since is not None:
+        stmt = stmt.where(MovementRollup.day >= since)
+    if until is not None:
+        stmt = stmt.where(MovementRollup.day <= until)
+    return stmt
+
+
+async def _aggregate(
+    session: AsyncSession, stmt, group_by: tuple[str, ...]
+) -> list[dict]:
+    """
+    Объединяет дневные агрегаты в группы на стороне БД: приложение получает
+    по строке на группу, а не по строке на день. Гистограммы складываются
+    поэлементно: корзины разворачиваются unnest и суммируются по номеру
+    """
+    rollups = stmt.cte("rollups")
+    keys = [rollups.c[name] for name in group_by]
+    totals = (
+        select(
+            *keys,
+            # sum(bigint) — numeric: без приведения приходит Decimal
+            cast(func.sum(rollups.c.movements_count), BigInteger).label(
+                "movements_count"
+            ),
+            func.sum(rollups.c.transit_seconds_sum).label("transit_seconds_sum"),
+            func.min(rollups.c.transit_seconds_min).label("transit_seconds_min"),
+            func.max(rollups.c.transit_seconds_max).label("transit_seconds_max"),
+            cast(func.sum(rollups.c.quantity_diff_sum), BigInteger).label(
+                "quantity_diff_sum"
+            ),
+        )
+        .group_by(*keys)
+        .subquery("totals")
+    )
+    buckets = (
+        func.unnest(rollups.c.transit_histogram)
+        .table_valued("hits", with_ordinality="bucket")
+        .render_derived("buckets")
+    )
+    bucket_sums = (
+        select(*keys, buckets.c.bucket, func.sum(buckets.c.hits).label("hits"))
+        .select_from(rollups)
+        .join(buckets, true())
+        .group_by(*keys, buckets.c.bucket)
+        .subquery("bucket_sums")
+    )
+    histograms = (
+        select(
+            *(bucket_sums.c[name] for name in group_by),
+            func.array_agg(
+                aggregate_order_by(bucket_sums.c.hits, bucket_sums.c.bucket)
+            ).label("transit_histogram"),
+        )
+        .group_by(*(bucket_sums.c[name] for name in group_by))
+        .subquery("histograms")
+    )
+    query = (
+        select(totals, histograms.c.transit_histogram)
+        .join(
+            histograms,
+            and_(*(totals.c[name] == histograms.c[name] for name in group_by)),
+        )
+        .order_by(
+            totals.c.movements_count.desc(),
+            *(totals.c[name] for name in group_by),
+        )
+    )
+
+    result = []
+    for row in await session.execute(query):
+        group = dict(row._mapping)
+        histogram = group.pop("transit_histogram")
+        group["transit_seconds_avg"] = (
+            group.pop("transit_seconds_sum") / group["movements_count"]
+        )
+        for q in (50, 90, 99):
+            group[f"transit_seconds_p{q}"] = estimate_quantile(histogram, q / 100)
+        result.append(group)
+    return result
@@ -1,9 +1,25 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from typing import AsyncIterator
+
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from pydantic import ValidationError
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.api.v1.schemas import KafkaWebhookRequest, KafkaResponse
-from app.services.kafka_processor import process_movement_event
+from app.api.v1.schemas import (
+    KafkaFullMessage,
+    KafkaWebhookRequest,
+    KafkaResponse,
+    KafkaBatchItemResult,
+    KafkaBatchResponse,
+)
+from app.config import settings
+from app.services.kafka_processor import (
+    DuplicateEventError,
+    apply_movement_events,
+    process_movement_event,
+)
 from app.db.session import get_session_dependency
+from app.services.redis import CacheBatch, cache_batch, get_cache_batch_dependency
 import logging
+import json
 from datetime import datetime
 
 router = APIRouter()
@@ -35,7 +51,7 @@ def validate_and_prepare_event_data(message_data):
             "event": message_data.event.value,
         }
     except Exception as e:
-        logger.error(f"Validation error: {str(e)}")
+        # Логирует обработчик webhook'а — вместе с контекстом сообщения
         raise ValueError(f"Invalid event data: {str(e)}")
 
 
@@ -50,7 +66,9 @@ def validate_and_prepare_event_data(message_data):
     },
 )
 async def kafka_webhook(
-    request: KafkaWebhookRequest, db: AsyncSession = Depends(get_session_dependency)
+    request: KafkaWebhookRequest,
+    cache: CacheBatch = Depends(get_cache_batch_dependency),
+    db: AsyncSession = Depends(get_session_dependency),
 ) -> KafkaResponse:
     """
     Обрабатывает входящие сообщения о перемещениях товаров.
@@ -71,13 +89,18 @@ async def kafka_webhook(
             else f"WH-{str(request.data.warehouse_id)[:4]}"
         )
         event_data["warehouse_code"] = warehouse_code
+        event_data["message_id"] = str(request.id) if request.id else None
 
-        # Обработка события
-        await process_movement_event(db, event_data)
+        # Обработка события (повтор уже примененного события — не ошибка)
+        try:
+            await process_movement_event(db, event_data)
+            processing_status = "processed"
+        except DuplicateEventError:
+            processing_status = "duplicate"
 
         # Формируем успешный ответ
         return KafkaResponse(
-            status="processed",
+            status=processing_status,
             message_id=request.id,
             movement_id=request.data.movement_id,
             details={
@@ -89,11 +112,158 @@ async def kafka_webhook(
         )
 
     except ValueError as e:
-        logger.warning(f"Validation error: {str(e)}")
+        logger.warning("Webhook event rejected: %s", e, extra=_message_context(request))
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
-    except Exception as e:
-        logger.error(f"Processing failed: {str(e)}", exc_info=True)
+    except Exception:
+        logger.error(
+            "Webhook processing failed", exc_info=True, extra=_message_context(request)
+        )
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Internal server error",
         )
+
+
+def _message_context(request: KafkaWebhookRequest) -> dict:
+    """Поля сообщения для extra= структурированного лога"""
+    return {
+        "message_id": str(request.id) if request.id else None,
+        "movement_id": str(request.data.movement_id),
+        "event_type": request.data.event.value,
+        "warehouse_id": str(request.data.warehouse_id),
+        "product_id": str(request.data.product_id),
+    }
+
+
+@router.post(
+    "/webhook:batch",
+    response_model=KafkaBatchResponse,
+    response_model_exclude_none=True,
+    summary="Пакетный обработчик Kafka-сообщений",
+    responses={
+        200: {"description": "Статус каждого сообщения пачки"},
+        400: {"description": "Тело не является JSON-массивом или NDJSON"},
+    },
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {
+                    "schema": {
+                        "type": "array",
+                        "items": {"$ref": "#/components/schemas/KafkaFullMessage"},
+                    }
+                },
+                "application/x-ndjson": {
+                    "schema": {"type": "string", "description": "Сообщение на строку"}
+                },
+            },
+        }
+    },
+)
+async def kafka_webhook_batch(
+    request: Request, db: AsyncSession = Depends(get_session_dependency)
+) -> KafkaBatchResponse:
+    """
+    Обрабатывает пачку сообщений: JSON-массив или NDJSON (читается потоком).
+
+    Сообщения применяются частями по WEBHOOK_BATCH_CHUNK_SIZE, каждая часть —
+    в своей транзакции. Невалидные и отклоненные сообщения не мешают
+    применению остальных; статус возвращается для каждого сообщения.
+    """
+    results: list[KafkaBatchItemResult] = []
+    chunk: list[tuple[int, KafkaFullMessage]] = []
+
+    async for index, item in _iter_batch_items(request):
+        try:
+            message = KafkaFullMessage.model_validate(
+                json.loads(item) if isinstance(item, bytes) else item
+            )
+        except (ValueError, ValidationError) as e:
+            results.append(
+                KafkaBatchItemResult(index=index, status="invalid", error=str(e))
+            )
+            continue
+        chunk.append((index, message))
+        if len(chunk) >= settings.WEBHOOK_BATCH_CHUNK_SIZE:
+            results.extend(await _apply_chunk(db, chunk))
+            chunk = []
+    if chunk:
+        results.extend(await _apply_chunk(db, chunk))
+
+    results.sort(key=lambda result: result.index)
+    processed = sum(result.status == "processed" for result in results)
+    duplicates = sum(result.status == "duplicate" for result in results)
+    return KafkaBatchResponse(
+        processed=processed,
+        duplicates=duplicates,
+        failed=len(results) - processed - duplicates,
+        results=results,
+    )
+
+
+async def _iter_batch_items(request: Request) -> AsyncIterator[tuple[int, object]]:
+    """Сообщения тела запроса: строки NDJSON (bytes) или элементы JSON-массива"""
+    if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+        index = 0
+        buffer = b""
+        async for data in request.stream():
+            *lines, buffer = (buffer + data).split(b"\n")
+            for line in lines:
+                if line.strip():
+                    yield index, line
+                    index += 1
+        if buffer.strip():
+            yield index, buffer
+        return
+
+    try:
+        items = json.loads(await request.body())
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    if not isinstance(items, list):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Expected a JSON array of messages",
+        )
+    for index, item in enumerate(items):
+        yield index, item
+
+
+async def _apply_chunk(
+    db: AsyncSession, chunk: list[tuple[int, KafkaFullMessage]]
+) -> list[KafkaBatchItemResult]:
+    """Применяет часть пачки одной транзакцией"""
+    try:
+        async with cache_batch():
+            event_results = await apply_movement_events(
+                db, [message.to_event_data() for _, message in chunk]
+            )
+            await db.commit()
+    except Exception as e:
+        logger.error(
+            "Webhook batch chunk failed",
+            exc_info=True,
+            extra={"first_index": chunk[0][0], "size": len(chunk)},
+        )
+        await db.rollback()
+        return [
+            KafkaBatchItemResult(
+                index=index, status="rejected", message_id=message.id, error=str(e)
+            )
+            for index, message in chunk
+        ]
+
+    return [
+        KafkaBatchItemResult(
+            index=index,
+            status=(
+                "processed"
+                if result.ok
+                else "duplicate" if result.duplicate else "rejected"
+            ),
+            message_id=message.id,
+            error=result.error,
+        )
+        for (index, message), result in zip(chunk, event_results)
+    ]
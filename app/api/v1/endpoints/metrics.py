@@ -0,0 +1,10 @@
+from fastapi import APIRouter, Response
+
+from app.metrics import CONTENT_TYPE, render_metrics
+
+router = APIRouter(include_in_schema=False)
+
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics() -> Response:
+    return Response(render_metrics(), media_type=CONTENT_TYPE)
@@ -1,19 +1,138 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+import base64
+import binascii
+from datetime import datetime
+from enum import Enum
+from functools import partial
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, tuple_
 from uuid import UUID
 
 from app.db.session import get_session_dependency
-from app.db.models import Movement
+from app.db.models import Movement, MovementStatus
 from app.api.v1.schemas import (
     MovementResponse,
     MovementDurationResponse,
+    MovementPage,
 )
-from app.services.redis import get_cache, get_movement_cache_key, set_cache
+from app.api.v1.schemas.movement import MOVEMENT_LIST_FIELDS
+from app.services.cache_loader import get_or_load
+from app.services.redis import get_movement_cache_key, set_cache
 
 router = APIRouter()
 
 
+# Список перемещений с фильтрами
+@router.get(
+    "",
+    response_model=MovementPage,
+    summary="Получить историю перемещений",
+    responses={
+        400: {"description": "Неизвестное поле или некорректный курсор"},
+        200: {"description": "Страница перемещений", "model": MovementPage},
+    },
+)
+async def list_movements(
+    product_id: Optional[UUID] = Query(None, description="ID товара"),
+    source_warehouse_id: Optional[UUID] = Query(None, description="Склад-отправитель"),
+    destination_warehouse_id: Optional[UUID] = Query(
+        None, description="Склад-получатель"
+    ),
+    movement_status: Optional[MovementStatus] = Query(
+        None, alias="status", description="Статус перемещения"
+    ),
+    since: Optional[datetime] = Query(
+        None, description="Не раньше этого момента (по recorded_at)"
+    ),
+    until: Optional[datetime] = Query(
+        None, description="Раньше этого момента (по recorded_at)"
+    ),
+    fields: Optional[str] = Query(
+        None,
+        description="Поля через запятую (по умолчанию — все)",
+        examples=["id,product_id,quantity,status"],
+    ),
+    after: Optional[str] = Query(None, description="Курсор из next_cursor"),
+    limit: int = Query(100, ge=1, le=1000, description="Размер страницы"),
+    session: AsyncSession = Depends(get_session_dependency),
+):
+    projection = _parse_fields(fields)
+
+    # Выбираются только нужные колонки; (recorded_at, id) — ключ пагинации.
+    # Фильтр по recorded_at отсекает лишние секции таблицы
+    columns = dict.fromkeys(["recorded_at", "id", *projection])
+    stmt = select(*[getattr(Movement, name) for name in columns]).order_by(
+        Movement.recorded_at.desc(), Movement.id.desc()
+    )
+    if product_id is not None:
+        stmt = stmt.where(Movement.product_id == product_id)
+    if source_warehouse_id is not None:
+        stmt = stmt.where(Movement.source_warehouse_id == source_warehouse_id)
+    if destination_warehouse_id is not None:
+        stmt = stmt.where(Movement.destination_warehouse_id == destination_warehouse_id)
+    if movement_status is not None:
+        stmt = stmt.where(Movement.status == movement_status)
+    if since is not None:
+        stmt = stmt.where(Movement.recorded_at >= since)
+    if until is not None:
+        stmt = stmt.where(Movement.recorded_at < until)
+    if after is not None:
+        recorded_at, movement_id = _decode_cursor(after)
+        # Сравнение строк не отсекает секции — дублируем границу по recorded_at
+        stmt = stmt.where(
+            Movement.recorded_at <= recorded_at,
+            tuple_(Movement.recorded_at, Movement.id) < (recorded_at, movement_id),
+        )
+
+    rows = (await session.execute(stmt.limit(limit + 1))).all()
+    items = [
+        {name: _to_json_value(row._mapping[name]) for name in projection}
+        for row in rows[:limit]
+    ]
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = _encode_cursor(last.recorded_at, last.id)
+    return {"items": items, "next_cursor": next_cursor}
+
+
+def _parse_fields(fields: Optional[str]) -> list[str]:
+    if not fields:
+        return list(MOVEMENT_LIST_FIELDS)
+    projection = list(dict.fromkeys(name.strip() for name in fields.split(",")))
+    unknown = [name for name in projection if name not in MOVEMENT_LIST_FIELDS]
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown fields: {', '.join(unknown)}",
+        )
+    return projection
+
+
+def _encode_cursor(recorded_at: datetime, movement_id: str) -> str:
+    raw = f"{recorded_at.isoformat()}|{movement_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> tuple[datetime, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        recorded_at, movement_id = raw.split("|")
+        return datetime.fromisoformat(recorded_at), str(UUID(movement_id))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor"
+        )
+
+
+def _to_json_value(value):
+    if isinstance(value, Enum):
+        return value.value
+    return value
+
+
 # Получить информацию о перемещении
 @router.get(
     "/{movement_id}",
@@ -28,24 +147,31 @@ async def get_movement(
     movement_id: UUID,
     session: AsyncSession = Depends(get_session_dependency),
 ):
-    cache_key = get_movement_cache_key(movement_id)
-    cached_data = await get_cache(cache_key)
-    if cached_data is not None:
-        return MovementResponse.model_validate(cached_data)
+    cached_json = await get_or_load(
+        get_movement_cache_key(movement_id),
+        partial(_load_movement, movement_id),
+        session,
+    )
+    if cached_json is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Movement not found",
+        )
+    # Ответ API уже сериализован: отдаем байты без повторной валидации
+    return Response(cached_json, media_type="application/json")
 
+
+async def _load_movement(movement_id: UUID, session: AsyncSession) -> Optional[dict]:
+    """Загружает перемещение из БД и кладет ответ в кэш"""
     stmt = select(Movement).where(Movement.id == movement_id)
     result = await session.execute(stmt)
     movement = result.scalar_one_or_none()
-
     if not movement:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Movement not found",
-        )
+        return None
     # Преобразуем в схему перед кэшированием и возвратом
-    response_model = MovementResponse.model_validate(movement)
-    await set_cache(cache_key, response_model.model_dump(mode="json"))
-    return response_model
+    response = MovementResponse.model_validate(movement).model_dump(mode="json")
+    await set_cache(get_movement_cache_key(movement_id), response)
+    return response
 
 
 @router.get(
@@ -1,4 +1,10 @@
-from fastapi import APIRouter, Depends
+import json
+from datetime import datetime
+from functools import partial
+from typing import AsyncIterator, Literal, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy import select, and_
 from sqlalchemy.ext.asyncio import AsyncSession
 
@@ -6,11 +12,85 @@ from app.db import StockItem
 from app.db.session import get_session_dependency
 from uuid import UUID
 
-from app.api.v1.schemas.stock import ProductStockResponse
-from app.services.redis import get_stock_cache_key, get_cache
+from app.api.v1.schemas.stock import (
+    ProductStockResponse,
+    ProductStockBatchRequest,
+    StockBatchRequest,
+    ProductQuantity,
+    ProductStockPage,
+)
+from app.services.stock import get_stock_quantities
+from app.services.stock_ledger import StockHistoryUnavailable, get_stock_as_of
+from app.services.cache_loader import get_or_load
+from app.services.redis import get_stock_cache_key, set_cache_if_newer
 
 router = APIRouter()
 
+# Строк на один fetch серверного курсора при NDJSON-выгрузке
+STREAM_YIELD_PER = 1000
+
+
+# Получить все остатки склада
+@router.get(
+    "/{warehouse_id}/products",
+    response_model=ProductStockPage,
+    summary="Получить остатки всех товаров на складе",
+    responses={
+        200: {
+            "description": "Страница остатков (или NDJSON-поток при format=ndjson)",
+            "model": ProductStockPage,
+            "content": {"application/x-ndjson": {}},
+        },
+    },
+)
+async def list_products_stock(
+    warehouse_id: UUID,
+    after: Optional[UUID] = Query(None, description="product_id, после которого читать"),
+    limit: int = Query(100, ge=1, le=1000, description="Размер страницы"),
+    format: Literal["json", "ndjson"] = Query("json", description="Формат ответа"),
+    session: AsyncSession = Depends(get_session_dependency),
+):
+    # Keyset-пагинация по уникальному индексу (warehouse_id, product_id)
+    stmt = (
+        select(StockItem.product_id, StockItem.quantity)
+        .where(StockItem.warehouse_id == warehouse_id)
+        .order_by(StockItem.product_id)
+    )
+    if after is not None:
+        stmt = stmt.where(StockItem.product_id > after)
+
+    if format == "ndjson":
+        return StreamingResponse(
+            _stream_stock(session, stmt), media_type="application/x-ndjson"
+        )
+
+    rows = (await session.execute(stmt.limit(limit + 1))).all()
+    items = [
+        {"product_id": product_id, "quantity": quantity}
+        for product_id, quantity in rows[:limit]
+    ]
+    next_cursor = items[-1]["product_id"] if len(rows) > limit else None
+    return {"items": items, "next_cursor": next_cursor}
+
+
+async def _stream_stock(session: AsyncSession, stmt) -> AsyncIterator[str]:
+    """
+    Выгрузка остатков через серверный курсор: память не зависит от размера склада.
+    Зависимость закрывает сессию до отправки ответа, поэтому поток использует
+    ее заново и сам закрывает по завершении.
+    """
+    try:
+        result = await session.stream(
+            stmt.execution_options(yield_per=STREAM_YIELD_PER)
+        )
+        async for rows in result.partitions():
+            yield "".join(
+                json.dumps({"product_id": product_id, "quantity": quantity}) + "\n"
+                for product_id, quantity in rows
+            )
+    finally:
+        await session.close()
+
 
 # Получить количество товара на складе
 @router.get(
@@ -19,32 +99,103 @@ router = APIRouter()
     summary="Получить остаток товара на складе",
     responses={
         200: {"description": "Успешный ответ", "model": ProductStockResponse},
+        404: {"description": "История остатка на этот момент недоступна"},
     },
 )
 async def get_product_stock(
     warehouse_id: UUID,
     product_id: UUID,
+    as_of: Optional[datetime] = Query(None, description="Остаток на момент времени"),
     session: AsyncSession = Depends(get_session_dependency),
 ):
-    cache_key = get_stock_cache_key(warehouse_id, product_id)
-    cached_data = await get_cache(cache_key)
-    if cached_data is not None:
-        # Pydantic сам провалидирует dict из кэша
-        return ProductStockResponse(**cached_data)  # Возвращаем из кэша
+    if as_of is not None:
+        # Исторические остатки не кэшируются: читаются из снимка и журнала
+        try:
+            quantity = await get_stock_as_of(session, warehouse_id, product_id, as_of)
+        except StockHistoryUnavailable as e:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+        return {
+            "warehouse_id": str(warehouse_id),
+            "product_id": str(product_id),
+            "quantity": quantity,
+        }
 
-    stmt = select(StockItem).where(
+    cached_json = await get_or_load(
+        get_stock_cache_key(warehouse_id, product_id),
+        partial(_load_product_stock, warehouse_id, product_id),
+        session,
+    )
+    # Ответ API уже сериализован: отдаем байты без повторной валидации
+    return Response(cached_json, media_type="application/json")
+
+
+async def _load_product_stock(
+    warehouse_id: UUID, product_id: UUID, session: AsyncSession
+) -> dict:
+    """Загружает остаток из БД и кладет его в кэш (с версией строки)"""
+    stmt = select(StockItem.quantity, StockItem.version).where(
         and_(
             StockItem.warehouse_id == warehouse_id,
             StockItem.product_id == product_id,
         )
     )
     result = await session.execute(stmt)
-    stock_item = result.scalar_one_or_none()
-
-    quantity = stock_item.quantity if stock_item else 0
+    quantity, version = result.one_or_none() or (0, 0)
 
-    return {
-        "warehouse_id": warehouse_id,
-        "product_id": product_id,
+    response = {
+        "warehouse_id": str(warehouse_id),
+        "product_id": str(product_id),
         "quantity": quantity,
     }
+    # Read-through: не перезаписываем значение, уже обновленное writer'ом
+    await set_cache_if_newer(
+        get_stock_cache_key(warehouse_id, product_id), response, version
+    )
+    return response
+
+
+# Получить остатки пачки товаров на складе
+@router.post(
+    "/{warehouse_id}/products:batch",
+    response_model=list[ProductQuantity],
+    summary="Получить остатки пачки товаров на складе",
+    responses={
+        200: {"description": "Успешный ответ", "model": list[ProductQuantity]},
+    },
+)
+async def get_products_stock_batch(
+    warehouse_id: UUID,
+    request: ProductStockBatchRequest,
+    session: AsyncSession = Depends(get_session_dependency),
+):
+    pairs = [(warehouse_id, product_id) for product_id in request.product_ids]
+    quantities = await get_stock_quantities(session, pairs)
+    return [
+        {"product_id": product_id, "quantity": quantities[(warehouse_id, product_id)]}
+        for product_id in dict.fromkeys(request.product_ids)
+    ]
+
+
+# Получить остатки пачки пар склад/товар
+@router.post(
+    "/products:batch",
+    response_model=list[ProductStockResponse],
+    summary="Получить остатки пачки товаров на разных складах",
+    responses={
+        200: {"description": "Успешный ответ", "model": list[ProductStockResponse]},
+    },
+)
+async def get_stock_batch(
+    request: StockBatchRequest,
+    session: AsyncSession = Depends(get_session_dependency),
+):
+    pairs = [(item.warehouse_id, item.product_id) for item in request.items]
+    quantities = await get_stock_quantities(session, pairs)
+    return [
+        {
+            "warehouse_id": warehouse_id,
+            "product_id": product_id,
+            "quantity": quantities[(warehouse_id, product_id)],
+        }
+        for warehouse_id, product_id in dict.fromkeys(pairs)
+    ]
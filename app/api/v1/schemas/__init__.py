@@ -1,20 +1,39 @@
-from .stock import ProductStockResponse
-from .movement import MovementResponse, MovementDurationResponse
+from .stock import (
+    ProductStockResponse,
+    ProductStockBatchRequest,
+    StockBatchRequest,
+    StockKey,
+    ProductQuantity,
+    ProductStockPage,
+)
+from .movement import MovementResponse, MovementDurationResponse, MovementPage
+from .analytics import TransitStats, RouteAnalytics, ProductAnalytics
 from .kafka import (
     KafkaMessageData,
     KafkaFullMessage,
     KafkaWebhookRequest,
     KafkaResponse,
+    KafkaBatchItemResult,
+    KafkaBatchResponse,
 )
 
 __all__ = [
     "ProductStockResponse",
+    "ProductStockBatchRequest",
+    "StockBatchRequest",
+    "StockKey",
+    "ProductQuantity",
+    "ProductStockPage",
     "MovementResponse",
     "MovementDurationResponse",
-    "MovementResponse",
-    "MovementDurationResponse",
+    "MovementPage",
+    "TransitStats",
+    "RouteAnalytics",
+    "ProductAnalytics",
     "KafkaMessageData",
     "KafkaFullMessage",
     "KafkaWebhookRequest",
     "KafkaResponse",
+    "KafkaBatchItemResult",
+    "KafkaBatchResponse",
 ]
@@ -0,0 +1,27 @@
+from pydantic import BaseModel, Field
+from uuid import UUID
+from typing import Optional
+
+
+class TransitStats(BaseModel):
+    movements_count: int = Field(..., examples=[120], description="Завершено перемещений")
+    transit_seconds_avg: float = Field(..., examples=[86400.0])
+    transit_seconds_min: float = Field(..., examples=[3600.0])
+    transit_seconds_max: float = Field(..., examples=[259200.0])
+    transit_seconds_p50: Optional[float] = Field(
+        None, examples=[80000.0], description="Оценка по гистограмме (±9%)"
+    )
+    transit_seconds_p90: Optional[float] = Field(None, examples=[170000.0])
+    transit_seconds_p99: Optional[float] = Field(None, examples=[250000.0])
+    quantity_diff_sum: int = Field(
+        ..., examples=[14], description="Суммарная недостача (усушка)"
+    )
+
+
+class RouteAnalytics(TransitStats):
+    source_warehouse_id: UUID = Field(..., description="ID исходного склада")
+    destination_warehouse_id: UUID = Field(..., description="ID склада назначения")
+
+
+class ProductAnalytics(TransitStats):
+    product_id: UUID = Field(..., description="ID товара")
@@ -52,6 +52,15 @@ class KafkaFullMessage(BaseModel):
     destination: Optional[str] = Field(default=None, description="Назначение сообщения")
     data: KafkaMessageData = Field(..., description="Данные перемещения")
 
+    def to_event_data(self) -> dict:
+        """Событие для process_movement_event(s); код склада берется из source"""
+        event_data = self.data.model_dump(mode="json")
+        if self.id:
+            event_data["message_id"] = str(self.id)
+        if self.source:
+            event_data["warehouse_code"] = self.source
+        return event_data
+
 
 class KafkaWebhookRequest(KafkaFullMessage):
     """Схема для вебхук-запроса (имитация Kafka)"""
@@ -66,3 +75,25 @@ class KafkaResponse(BaseModel):
     message_id: UUID = Field(..., description="ID обработанного сообщения")
     movement_id: UUID = Field(..., description="ID перемещения")
     details: dict = Field(None, description="Дополнительные детали")
+
+
+class KafkaBatchItemResult(BaseModel):
+    """Результат обработки одного сообщения пачки"""
+
+    index: int = Field(..., description="Порядковый номер сообщения в запросе")
+    status: str = Field(
+        ...,
+        examples=["processed"],
+        description="processed | duplicate | rejected | invalid",
+    )
+    message_id: Optional[UUID] = Field(None, description="ID сообщения")
+    error: Optional[str] = Field(None, description="Причина отказа")
+
+
+class KafkaBatchResponse(BaseModel):
+    """Схема ответа пакетного вебхука"""
+
+    processed: int = Field(..., description="Применено сообщений")
+    duplicates: int = Field(0, description="Повторов уже примененных сообщений")
+    failed: int = Field(..., description="Отклонено или не разобрано сообщений")
+    results: list[KafkaBatchItemResult] = Field(..., description="Статусы по порядку")
@@ -1,7 +1,7 @@
 from pydantic import BaseModel, Field, computed_field
 from datetime import datetime
 from uuid import UUID
-from typing import Optional
+from typing import Any, Optional
 
 
 class MovementResponse(BaseModel):
@@ -58,3 +58,29 @@ class MovementDurationResponse(BaseModel):
 
     class Config:
         from_attributes = True
+
+
+# Поля, доступные для проекции в списке перемещений (fields=...)
+MOVEMENT_LIST_FIELDS = (
+    "id",
+    "kafka_movement_id",
+    "product_id",
+    "quantity",
+    "source_warehouse_id",
+    "destination_warehouse_id",
+    "departure_time",
+    "arrival_time",
+    "recorded_at",
+    "status",
+    "quantity_diff",
+)
+
+
+class MovementPage(BaseModel):
+    items: list[dict[str, Any]] = Field(
+        ...,
+        description="Перемещения, от новых к старым; только запрошенные поля",
+    )
+    next_cursor: Optional[str] = Field(
+        None, description="Значение after для следующей страницы (None — конец)"
+    )
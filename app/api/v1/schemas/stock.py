@@ -1,4 +1,5 @@
 from pydantic import BaseModel, Field
+from typing import Optional
 from uuid import UUID
 
 
@@ -9,3 +10,39 @@ class ProductStockResponse(BaseModel):
 
     class Config:
         from_attributes = True
+
+
+# Максимум позиций в одном пакетном запросе остатков
+STOCK_BATCH_MAX_ITEMS = 1000
+
+
+class ProductStockBatchRequest(BaseModel):
+    product_ids: list[UUID] = Field(
+        ..., min_length=1, max_length=STOCK_BATCH_MAX_ITEMS, description="ID товаров"
+    )
+
+
+class StockKey(BaseModel):
+    warehouse_id: UUID = Field(..., description="ID склада")
+    product_id: UUID = Field(..., description="ID товара")
+
+
+class StockBatchRequest(BaseModel):
+    items: list[StockKey] = Field(
+        ...,
+        min_length=1,
+        max_length=STOCK_BATCH_MAX_ITEMS,
+        description="Пары склад/товар",
+    )
+
+
+class ProductQuantity(BaseModel):
+    product_id: UUID = Field(..., examples=["3fa85f64-5717-4562-b3fc-2c963f66afa6"])
+    quantity: int = Field(..., examples=[42], description="Текущее количество товара")
+
+
+class ProductStockPage(BaseModel):
+    items: list[ProductQuantity] = Field(..., description="Остатки, по product_id")
+    next_cursor: Optional[UUID] = Field(
+        None, description="Значение after для следующей страницы (None — конец)"
+    )
@@ -9,20 +9,152 @@ class Settings(BaseSettings):
     POSTGRES_DB: str = Field(..., alias="postgres_db")
     POSTGRES_USER: str = Field(..., alias="postgres_user")
     POSTGRES_PASSWORD: str = Field(..., alias="postgres_password")
-    ECHO_SQL: bool = Field(default=True, alias="echo_sql")
+    # Лог каждого SQL без времени выполнения — только для локальной отладки;
+    # для поиска N+1 и медленных запросов — SQL_PROFILING
+    ECHO_SQL: bool = Field(default=False, alias="echo_sql")
     IS_AUTOTEST: bool = Field(default=False, alias="is_autotest")
 
+    # Логирование: формат (text | json), очередь записей для фонового потока
+    # (0 — писать синхронно) и доля успешных (INFO и ниже) сообщений по
+    # логгерам: "app.services.kafka_processor=0.01,..."
+    LOG_FORMAT: str = Field(default="text", alias="log_format")
+    LOG_QUEUE_SIZE: int = Field(default=10_000, alias="log_queue_size")
+    LOG_SAMPLE_RATES: str = Field(default="", alias="log_sample_rates")
+
+    # Профиль запросов к БД по HTTP-запросам и пачкам consumer'а: заголовки
+    # X-DB-Queries / Server-Timing и выборочный лог (медленные — всегда)
+    SQL_PROFILING: bool = Field(default=False, alias="sql_profiling")
+    SQL_PROFILE_SAMPLE_RATE: float = Field(
+        default=0.01, alias="sql_profile_sample_rate"
+    )
+    SQL_PROFILE_SLOW_MS: float = Field(default=500.0, alias="sql_profile_slow_ms")
+    SQL_PROFILE_SLOWEST: int = Field(default=3, alias="sql_profile_slowest")
+
     # Kafka settings
     APP_MODE: str = "webhook_only"  # Режим работы (kafka | webhook_only)
     KAFKA_BOOTSTRAP_SERVERS: str = Field(..., alias="kafka_bootstrap_servers")
     KAFKA_TOPIC: str = Field(..., alias="kafka_topic")
     KAFKA_GROUP_ID: str = Field(..., alias="kafka_group_id")
+    # Режим обработки (single | batch | parallel)
+    KAFKA_CONSUMER_MODE: str = Field(default="batch", alias="kafka_consumer_mode")
+    KAFKA_BATCH_MAX_RECORDS: int = Field(default=500, alias="kafka_batch_max_records")
+    KAFKA_BATCH_LINGER_MS: int = Field(default=100, alias="kafka_batch_linger_ms")
+    KAFKA_BATCH_MAX_BYTES: int = Field(
+        default=16 * 1024 * 1024, alias="kafka_batch_max_bytes"
+    )
+    # Пул воркеров режима parallel (не больше pool_size движка БД)
+    KAFKA_WORKERS: int = Field(default=8, alias="kafka_workers")
+    KAFKA_WORKER_QUEUE_SIZE: int = Field(default=1000, alias="kafka_worker_queue_size")
+    # Транзакция пачки повторяется не больше N раз; затем записи применяются
+    # по одной, а все еще падающие пропускаются с ошибкой в логе
+    KAFKA_MAX_RETRIES: int = Field(default=10, alias="kafka_max_retries")
+    # Backpressure: чтение партиций приостанавливается, когда записей в
+    # обработке (parallel) не меньше KAFKA_MAX_IN_FLIGHT, пул соединений
+    # занят на KAFKA_PAUSE_POOL_USAGE или сглаженное время транзакции
+    # consumer'а не меньше KAFKA_PAUSE_DB_LATENCY_MS
+    KAFKA_MAX_IN_FLIGHT: int = Field(default=4000, alias="kafka_max_in_flight")
+    KAFKA_PAUSE_POOL_USAGE: float = Field(default=0.9, alias="kafka_pause_pool_usage")
+    KAFKA_PAUSE_DB_LATENCY_MS: float = Field(
+        default=2000.0, alias="kafka_pause_db_latency_ms"
+    )
+    # При высокой задержке — одна пробная пачка на такой интервал
+    KAFKA_PAUSE_COOLDOWN_MS: int = Field(default=5000, alias="kafka_pause_cooldown_ms")
+    # Остановка: время на дообработку взятых записей и commit offset'ов
+    KAFKA_SHUTDOWN_TIMEOUT_SECONDS: float = Field(
+        default=20.0, alias="kafka_shutdown_timeout_seconds"
+    )
+
+    # Пакетный вебхук: сообщений на одну транзакцию
+    WEBHOOK_BATCH_CHUNK_SIZE: int = Field(default=500, alias="webhook_batch_chunk_size")
 
     # Redis
     REDIS_HOST: str = Field(default="localhost", alias="redis_host")
     REDIS_PORT: int = Field(default=6379, alias="redis_port")
     REDIS_DB: int = Field(default=0, alias="redis_db")
+    REDIS_MAX_CONNECTIONS: int = Field(default=64, alias="redis_max_connections")
+    # Ожидание свободного соединения пула, секунды
+    REDIS_POOL_TIMEOUT: float = Field(default=1.0, alias="redis_pool_timeout")
+    REDIS_SOCKET_TIMEOUT: float = Field(default=0.5, alias="redis_socket_timeout")
+    REDIS_SOCKET_CONNECT_TIMEOUT: float = Field(
+        default=1.0, alias="redis_socket_connect_timeout"
+    )
+    REDIS_HEALTH_CHECK_INTERVAL: int = Field(
+        default=30, alias="redis_health_check_interval"
+    )
     CACHE_TTL_SECONDS: int = Field(default=300, alias="cache_ttl_seconds")
+    # Формат значений кэша (json | orjson | msgpack)
+    CACHE_CODEC: str = Field(default="orjson", alias="cache_codec")
+    # Доля случайной добавки к TTL записей кэша
+    CACHE_TTL_JITTER: float = Field(default=0.1, alias="cache_ttl_jitter")
+    # Схлопывание промахов (off | local | redis — еще и между подами)
+    CACHE_SINGLE_FLIGHT: str = Field(default="local", alias="cache_single_flight")
+    CACHE_LOCK_TTL_MS: int = Field(default=2000, alias="cache_lock_ttl_ms")
+    CACHE_LOCK_POLL_MS: int = Field(default=25, alias="cache_lock_poll_ms")
+    # За сколько секунд до истечения ключ обновляется в фоне (0 — выключено)
+    CACHE_REFRESH_AHEAD_SECONDS: int = Field(
+        default=30, alias="cache_refresh_ahead_seconds"
+    )
+    # Запись остатков в кэш после COMMIT (иначе — только инвалидация)
+    STOCK_CACHE_WRITE_THROUGH: bool = Field(
+        default=True, alias="stock_cache_write_through"
+    )
+
+    # In-process кэш (L1) перед Redis, согласуется через pub/sub
+    NEAR_CACHE_ENABLED: bool = Field(default=False, alias="near_cache_enabled")
+    NEAR_CACHE_MAX_ENTRIES: int = Field(default=10_000, alias="near_cache_max_entries")
+    NEAR_CACHE_MAX_BYTES: int = Field(
+        default=32 * 1024 * 1024, alias="near_cache_max_bytes"
+    )
+    NEAR_CACHE_TTL_SECONDS: float = Field(default=5.0, alias="near_cache_ttl_seconds")
+    NEAR_CACHE_CHANNEL: str = Field(
+        default="cache:invalidate", alias="near_cache_channel"
+    )
+
+    # In-process реестр известных ID складов и товаров
+    ID_REGISTRY_MAX_SIZE: int = Field(default=100_000, alias="id_registry_max_size")
+    ID_REGISTRY_TTL_SECONDS: int = Field(default=3600, alias="id_registry_ttl_seconds")
+    # Недавно примененные события: повторы отсекаются без запроса к БД
+    PROCESSED_EVENTS_CACHE_SIZE: int = Field(
+        default=200_000, alias="processed_events_cache_size"
+    )
+    PROCESSED_EVENTS_CACHE_TTL_SECONDS: int = Field(
+        default=3600, alias="processed_events_cache_ttl_seconds"
+    )
+    # Общий для подов (и переживающий рестарт) маркер примененного события
+    # в Redis: повторное чтение топика не ходит в БД за каждым событием.
+    # 0 — без маркеров
+    PROCESSED_EVENTS_MARKER_TTL_SECONDS: int = Field(
+        default=7 * 24 * 3600, alias="processed_events_marker_ttl_seconds"
+    )
+    # Ключи старше N дней удаляются фоновым обслуживанием; срок должен быть
+    # больше хранения топика и окна повторов webhook'ов. 0 — не удалять
+    PROCESSED_EVENTS_RETENTION_DAYS: int = Field(
+        default=30, alias="processed_events_retention_days"
+    )
+
+    # Снимок остатка пишется каждые N версий: запрос на момент времени
+    # читает снимок и не больше N-1 записей журнала
+    STOCK_SNAPSHOT_INTERVAL: int = Field(default=100, alias="stock_snapshot_interval")
+
+    # Помесячные секции movements: создаются заранее, старые выгружаются
+    # в архив (gzip CSV) и удаляются; 0 месяцев хранения — не архивировать
+    MOVEMENTS_PARTITIONS_AHEAD: int = Field(
+        default=3, alias="movements_partitions_ahead"
+    )
+    MOVEMENTS_RETENTION_MONTHS: int = Field(
+        default=0, alias="movements_retention_months"
+    )
+    MOVEMENTS_ARCHIVE_DIR: str = Field(
+        default="/var/lib/warehouse/archive", alias="movements_archive_dir"
+    )
+    PARTITION_MAINTENANCE_INTERVAL_SECONDS: int = Field(
+        default=3600, alias="partition_maintenance_interval_seconds"
+    )
+    # Приемка ждет парную отгрузку N дней; после этого обслуживание снимает
+    # флаг, и поздняя отгрузка заводит новое перемещение. 0 — ждать всегда
+    MOVEMENT_PAIRING_WINDOW_DAYS: int = Field(
+        default=7, alias="movement_pairing_window_days"
+    )
 
     # App settings
     APP_HOST: str = Field(default="0.0.0.0", alias="app_host")
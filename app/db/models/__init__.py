@@ -2,5 +2,18 @@ from .warehouse import Warehouse
 from .product import Product
 from .stock_item import StockItem
 from .movement import Movement, MovementStatus
+from .processed_event import ProcessedEvent
+from .movement_rollup import MovementRollup
+from .stock_ledger import StockLedgerEntry, StockSnapshot
 
-__all__ = ["Warehouse", "Product", "StockItem", "Movement", "MovementStatus"]
+__all__ = [
+    "Warehouse",
+    "Product",
+    "StockItem",
+    "Movement",
+    "MovementStatus",
+    "ProcessedEvent",
+    "MovementRollup",
+    "StockLedgerEntry",
+    "StockSnapshot",
+]
@@ -1,5 +1,18 @@
 from datetime import datetime
-from sqlalchemy import UUID, DateTime, Integer, ForeignKey, CheckConstraint, Index, Enum
+from sqlalchemy import (
+    DDL,
+    UUID,
+    Boolean,
+    DateTime,
+    Integer,
+    ForeignKey,
+    CheckConstraint,
+    Index,
+    Enum,
+    event,
+    func,
+    text,
+)
 from sqlalchemy.orm import mapped_column, Mapped
 from enum import Enum as PyEnum
 import uuid
@@ -21,10 +34,33 @@ class Movement(Base):
             "source_warehouse_id IS NOT NULL OR destination_warehouse_id IS NOT NULL",
             name="ck_movement_warehouse_presence",
         ),
-        Index("ix_movement_kafka_id", "kafka_movement_id"),
-        Index("ix_movement_product", "product_id"),
-        Index("ix_movement_status", "status"),
-        {"comment": "История перемещений товаров между складами"},
+        # Индексы под реальные запросы: каждый лишний индекс замедляет вставку.
+        # Список перемещений: фильтр + keyset по (recorded_at, id)
+        Index("ix_movement_recorded", "recorded_at", "id"),
+        Index("ix_movement_product", "product_id", "recorded_at", "id"),
+        Index("ix_movement_source", "source_warehouse_id", "recorded_at", "id"),
+        Index(
+            "ix_movement_destination", "destination_warehouse_id", "recorded_at", "id"
+        ),
+        # Непарные половины перемещений: индексы остаются маленькими,
+        # сколько бы завершенных перемещений ни накопилось в таблице
+        Index(
+            "ix_movement_in_transit",
+            "kafka_movement_id",
+            postgresql_where=text("status = 'IN_TRANSIT'"),
+        ),
+        # Приемки без отгрузки: флаг снимается при паре или по истечении
+        # MOVEMENT_PAIRING_WINDOW_DAYS, прямые поставки в индексе не копятся
+        Index(
+            "ix_movement_awaiting_departure",
+            "kafka_movement_id",
+            postgresql_where=text("awaiting_departure"),
+        ),
+        {
+            "comment": "История перемещений товаров между складами",
+            # Помесячные секции создает и архивирует app.services.partitions
+            "postgresql_partition_by": "RANGE (recorded_at)",
+        },
     )
 
     id: Mapped[str] = mapped_column(
@@ -34,38 +70,61 @@ class Movement(Base):
         comment="Внутренний ID записи",
     )
 
+    # Ключ секционирования: время первого полученного события перемещения.
+    # Не меняется, когда приходит вторая половина, поэтому строка не
+    # переезжает между секциями
+    recorded_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        primary_key=True,
+        default=func.now(),
+        server_default=func.now(),
+        comment="Время первого события перемещения (ключ секционирования)",
+    )
+
     kafka_movement_id: Mapped[str] = mapped_column(
         UUID(as_uuid=False), nullable=False, comment="ID перемещения из Kafka"
     )
 
     source_warehouse_id: Mapped[str | None] = mapped_column(
-        UUID(as_uuid=False), ForeignKey("warehouses.id"), index=True
+        UUID(as_uuid=False), ForeignKey("warehouses.id")
     )
 
     destination_warehouse_id: Mapped[str | None] = mapped_column(
-        UUID(as_uuid=False), ForeignKey("warehouses.id"), index=True
+        UUID(as_uuid=False), ForeignKey("warehouses.id")
     )
 
     product_id: Mapped[str] = mapped_column(
-        UUID(as_uuid=False), ForeignKey("products.id"), nullable=False, index=True
+        UUID(as_uuid=False), ForeignKey("products.id"), nullable=False
     )
 
     quantity: Mapped[int] = mapped_column(
         Integer, nullable=False, comment="Количество товара"
     )
 
-    departure_time: Mapped[datetime | None] = mapped_column(
-        DateTime(timezone=True), index=True
-    )
+    departure_time: Mapped[datetime | None] = mapped_column(DateTime(timezone=True))
 
-    arrival_time: Mapped[datetime | None] = mapped_column(
-        DateTime(timezone=True), index=True
-    )
+    arrival_time: Mapped[datetime | None] = mapped_column(DateTime(timezone=True))
 
     status: Mapped[MovementStatus] = mapped_column(
-        Enum(MovementStatus), default=MovementStatus.PENDING, nullable=False, index=True
+        Enum(MovementStatus), default=MovementStatus.PENDING, nullable=False
     )
 
     quantity_diff: Mapped[int | None] = mapped_column(
         Integer, comment="Разница между отправленным и полученным количеством"
     )
+
+    awaiting_departure: Mapped[bool] = mapped_column(
+        Boolean,
+        nullable=False,
+        default=False,
+        server_default=text("false"),
+        comment="Приемка ждет парную отгрузку",
+    )
+
+
+# Секция по умолчанию принимает строки вне созданных месячных секций
+event.listen(
+    Movement.__table__,
+    "after_create",
+    DDL("CREATE TABLE movements_default PARTITION OF movements DEFAULT"),
+)
@@ -0,0 +1,54 @@
+from datetime import date
+from sqlalchemy import UUID, BigInteger, Date, Double, Index, Integer
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.orm import mapped_column, Mapped
+from app.db.base import Base
+
+
+class MovementRollup(Base):
+    __tablename__ = "movement_rollups"
+    __table_args__ = (
+        # Первичный ключ начинается с day: фильтрам аналитики по складу
+        # или товару нужны свои индексы
+        Index("ix_movement_rollup_source", "source_warehouse_id", "day"),
+        Index("ix_movement_rollup_destination", "destination_warehouse_id", "day"),
+        Index("ix_movement_rollup_product", "product_id", "day"),
+        {
+            "comment": (
+                "Агрегаты завершенных перемещений по маршруту, товару и дню "
+                "(обновляются при обработке событий)"
+            )
+        },
+    )
+
+    day: Mapped[date] = mapped_column(
+        Date, primary_key=True, comment="День прибытия (UTC)"
+    )
+
+    source_warehouse_id: Mapped[str] = mapped_column(
+        UUID(as_uuid=False), primary_key=True
+    )
+
+    destination_warehouse_id: Mapped[str] = mapped_column(
+        UUID(as_uuid=False), primary_key=True
+    )
+
+    product_id: Mapped[str] = mapped_column(UUID(as_uuid=False), primary_key=True)
+
+    movements_count: Mapped[int] = mapped_column(BigInteger, nullable=False)
+
+    transit_seconds_sum: Mapped[float] = mapped_column(Double, nullable=False)
+
+    transit_seconds_min: Mapped[float] = mapped_column(Double, nullable=False)
+
+    transit_seconds_max: Mapped[float] = mapped_column(Double, nullable=False)
+
+    quantity_diff_sum: Mapped[int] = mapped_column(
+        BigInteger, nullable=False, comment="Суммарная недостача (усушка)"
+    )
+
+    transit_histogram: Mapped[list[int]] = mapped_column(
+        ARRAY(Integer),
+        nullable=False,
+        comment="Логарифмическая гистограмма времени в пути (app.services.rollups)",
+    )
@@ -0,0 +1,29 @@
+from datetime import datetime
+from sqlalchemy import UUID, DateTime, Index, String, func
+from sqlalchemy.orm import mapped_column, Mapped
+from app.db.base import Base
+
+
+class ProcessedEvent(Base):
+    __tablename__ = "processed_events"
+    __table_args__ = (
+        # Очистка по сроку хранения (PROCESSED_EVENTS_RETENTION_DAYS)
+        Index("ix_processed_events_processed_at", "processed_at"),
+        {"comment": "Ключи идемпотентности примененных событий перемещения"},
+    )
+
+    movement_id: Mapped[str] = mapped_column(
+        UUID(as_uuid=False), primary_key=True, comment="ID перемещения из Kafka"
+    )
+
+    event_type: Mapped[str] = mapped_column(
+        String(16), primary_key=True, comment="Тип события: arrival или departure"
+    )
+
+    message_id: Mapped[str | None] = mapped_column(
+        UUID(as_uuid=False), comment="ID CloudEvent-сообщения"
+    )
+
+    processed_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), nullable=False, server_default=func.now()
+    )
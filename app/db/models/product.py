@@ -1,4 +1,4 @@
-from sqlalchemy import UUID, Index
+from sqlalchemy import UUID
 from sqlalchemy.orm import mapped_column, Mapped
 import uuid
 from app.db.base import Base
@@ -7,7 +7,6 @@ from app.db.base import Base
 class Product(Base):
     __tablename__ = "products"
     __table_args__ = (
-        Index("ix_product_id", "id", unique=True),
         {"comment": "Справочник товаров (основной идентификатор из Kafka)"},
     )
 
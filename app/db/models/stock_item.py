@@ -1,4 +1,4 @@
-from sqlalchemy import UUID, Integer, ForeignKey, CheckConstraint, Index
+from sqlalchemy import UUID, BigInteger, Integer, ForeignKey, CheckConstraint, Index
 from sqlalchemy.orm import mapped_column, Mapped
 import uuid
 from app.db.base import Base
@@ -34,3 +34,10 @@ class StockItem(Base):
     quantity: Mapped[int] = mapped_column(
         Integer, nullable=False, server_default="0", comment="Текущее количество (>= 0)"
     )
+
+    version: Mapped[int] = mapped_column(
+        BigInteger,
+        nullable=False,
+        server_default="0",
+        comment="Версия остатка (растет при каждом изменении)",
+    )
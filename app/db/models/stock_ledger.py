@@ -0,0 +1,52 @@
+from datetime import datetime
+from sqlalchemy import UUID, BigInteger, DateTime, Integer, text
+from sqlalchemy.orm import mapped_column, Mapped
+from app.db.base import Base
+
+
+class StockLedgerEntry(Base):
+    __tablename__ = "stock_ledger"
+    __table_args__ = (
+        {"comment": "Журнал изменений остатков (только добавление)"},
+    )
+
+    warehouse_id: Mapped[str] = mapped_column(UUID(as_uuid=False), primary_key=True)
+
+    product_id: Mapped[str] = mapped_column(UUID(as_uuid=False), primary_key=True)
+
+    version: Mapped[int] = mapped_column(
+        BigInteger, primary_key=True, comment="Версия строки остатка после изменения"
+    )
+
+    delta: Mapped[int] = mapped_column(
+        Integer, nullable=False, comment="Изменение количества"
+    )
+
+    # clock_timestamp(), а не now(): время записи под блокировкой строки
+    # остатка монотонно по версиям, время начала транзакции — нет
+    applied_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        nullable=False,
+        server_default=text("clock_timestamp()"),
+    )
+
+
+class StockSnapshot(Base):
+    __tablename__ = "stock_snapshots"
+    __table_args__ = (
+        {"comment": "Снимки остатков: каждая STOCK_SNAPSHOT_INTERVAL-я версия"},
+    )
+
+    warehouse_id: Mapped[str] = mapped_column(UUID(as_uuid=False), primary_key=True)
+
+    product_id: Mapped[str] = mapped_column(UUID(as_uuid=False), primary_key=True)
+
+    version: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+
+    quantity: Mapped[int] = mapped_column(Integer, nullable=False)
+
+    taken_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        nullable=False,
+        server_default=text("clock_timestamp()"),
+    )
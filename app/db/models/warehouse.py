@@ -4,6 +4,8 @@ import uuid
 import re
 from app.db.base import Base
 
+WAREHOUSE_CODE_RE = re.compile(r"^WH-\d{4}$")
+
 
 class Warehouse(Base):
     __tablename__ = "warehouses"
@@ -26,6 +28,6 @@ class Warehouse(Base):
 
     @validates("code")
     def validate_code(self, key, code):
-        if not re.match(r"^WH-\d{4}$", code):
+        if not WAREHOUSE_CODE_RE.match(code):
             raise ValueError("Код склада должен быть в формате WH-XXXX")
         return code
@@ -0,0 +1,168 @@
+import heapq
+import logging
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from app.config import settings
+
+logger = logging.getLogger("warehouse-service:sql-profile")
+
+# Профиль текущей единицы работы (HTTP-запрос, пачка consumer'а). Контекст
+# asyncio-задачи доступен и в greenlet'ах SQLAlchemy, где вызываются события
+_current_profile: ContextVar[Optional["SqlProfile"]] = ContextVar(
+    "sql_profile", default=None
+)
+
+
+class SqlProfile:
+    """Запросы к БД одной единицы работы: число, суммарное время, самые долгие"""
+
+    __slots__ = ("name", "queries", "seconds", "statements", "_slowest", "started")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.queries = 0
+        self.seconds = 0.0
+        # Повторы одного и того же SQL — признак N+1
+        self.statements: dict[str, int] = {}
+        self._slowest: list[tuple[float, int, str]] = []
+        self.started = time.perf_counter()
+
+    def record(self, statement: str, seconds: float):
+        self.queries += 1
+        self.seconds += seconds
+        self.statements[statement] = self.statements.get(statement, 0) + 1
+        item = (seconds, self.queries, statement)
+        if len(self._slowest) < settings.SQL_PROFILE_SLOWEST:
+            heapq.heappush(self._slowest, item)
+        elif seconds > self._slowest[0][0]:
+            heapq.heapreplace(self._slowest, item)
+
+    def slowest(self) -> list[tuple[float, str]]:
+        ordered = sorted(self._slowest, reverse=True)
+        return [(seconds, sql) for seconds, _, sql in ordered]
+
+    def server_timing(self) -> str:
+        return f'db;dur={self.seconds * 1000:.2f};desc="{self.queries} queries"'
+
+    def as_dict(self) -> dict:
+        repeated_sql, repeats = max(
+            self.statements.items(), key=lambda item: item[1], default=(None, 0)
+        )
+        return {
+            "name": self.name,
+            "queries": self.queries,
+            "db_ms": round(self.seconds * 1000, 2),
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 2),
+            "distinct_statements": len(self.statements),
+            "most_repeated": {"count": repeats, "statement": _shorten(repeated_sql)},
+            "slowest": [
+                {"ms": round(seconds * 1000, 2), "statement": _shorten(sql)}
+                for seconds, sql in self.slowest()
+            ],
+        }
+
+
+def install_sql_profiler(engine: AsyncEngine):
+    """
+    Подключает обработчики событий курсора. Без SQL_PROFILING обработчики
+    не регистрируются вовсе, и запросы выполняются без дополнительной работы.
+    """
+    if not settings.SQL_PROFILING:
+        return
+    event.listen(engine.sync_engine, "before_cursor_execute", _before_execute)
+    event.listen(engine.sync_engine, "after_cursor_execute", _after_execute)
+
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    context._profile_started = time.perf_counter()
+
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _current_profile.get()
+    if profile is not None:
+        profile.record(statement, time.perf_counter() - context._profile_started)
+
+
+@contextmanager
+def profile_sql(name: str) -> Iterator[Optional[SqlProfile]]:
+    """
+    Собирает профиль запросов блока; выборка (и медленные — всегда) пишется
+    в лог. Без SQL_PROFILING возвращает None.
+    """
+    if not settings.SQL_PROFILING:
+        yield None
+        return
+    profile = SqlProfile(name)
+    token = _current_profile.set(profile)
+    try:
+        yield profile
+    finally:
+        _current_profile.reset(token)
+        _log_profile(profile)
+
+
+def _log_profile(profile: SqlProfile):
+    slow = profile.seconds * 1000 >= settings.SQL_PROFILE_SLOW_MS
+    if not slow and random.random() >= settings.SQL_PROFILE_SAMPLE_RATE:
+        return
+    logger.info(
+        "SQL profile %s: %d queries, %.2f ms",
+        profile.name,
+        profile.queries,
+        profile.seconds * 1000,
+        extra={"sql_profile": profile.as_dict()},
+    )
+
+
+def _shorten(statement: Optional[str], limit: int = 500) -> Optional[str]:
+    if statement is None:
+        return None
+    statement = " ".join(statement.split())
+    return statement if len(statement) <= limit else statement[:limit] + "..."
+
+
+class SqlProfilerMiddleware:
+    """
+    ASGI middleware: профиль запросов каждого HTTP-запроса в заголовках
+    ответа (X-DB-Queries, X-DB-Time-Ms, Server-Timing). Заголовки уходят
+    с началом ответа: запросы потоковой выгрузки после него в них не попадут.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.SQL_PROFILING:
+            await self.app(scope, receive, send)
+            return
+
+        with profile_sql(f"{scope['method']} {scope['path']}") as profile:
+
+            async def send_with_profile(message):
+                if message["type"] == "http.response.start":
+                    db_ms = f"{profile.seconds * 1000:.2f}"
+                    message = {
+                        **message,
+                        "headers": [
+                            *message.get("headers", []),
+                            (b"x-db-queries", str(profile.queries).encode()),
+                            (b"x-db-time-ms", db_ms.encode()),
+                            (b"server-timing", profile.server_timing().encode()),
+                        ],
+                    }
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_profile)
+            finally:
+                # В лог — шаблон маршрута, если роутер его нашел
+                route = getattr(scope.get("route"), "path", None)
+                if route:
+                    profile.name = f"{scope['method']} {route}"
@@ -1,29 +1,75 @@
 import logging
+import time
 from asyncio import current_task
 from contextlib import asynccontextmanager
+from typing import Callable
 from urllib.parse import urlparse, urlunparse
 
-from sqlalchemy import NullPool, text
+from sqlalchemy import AsyncAdaptedQueuePool, NullPool, event, text
 from sqlalchemy.ext.asyncio import (
     AsyncSession,
     create_async_engine,
     async_sessionmaker,
     async_scoped_session,
 )
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, SessionTransaction, sessionmaker
 
 from app.config import settings
+from app.db.profiler import install_sql_profiler
+from app.metrics import DB_POOL_CHECKOUT_SECONDS, Gauge
 
 logger = logging.getLogger("warehouse-service:db")
 
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """Пул, замеряющий ожидание соединения (включая открытие нового)"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_CHECKOUT_SECONDS.observe(time.perf_counter() - started)
+
+
+POOL_SIZE = 20
+MAX_OVERFLOW = 10
+
 # Конфигурация движка
 engine = create_async_engine(
     settings.database_url,
     echo=settings.ECHO_SQL,
-    poolclass=NullPool if settings.IS_AUTOTEST else None,
+    poolclass=NullPool if settings.IS_AUTOTEST else InstrumentedQueuePool,
     pool_pre_ping=True,
-    pool_size=20,
-    max_overflow=10,
+    pool_size=POOL_SIZE,
+    max_overflow=MAX_OVERFLOW,
+)
+install_sql_profiler(engine)
+
+
+def _pool_connections() -> dict[tuple, int]:
+    pool = engine.pool
+    if not isinstance(pool, AsyncAdaptedQueuePool):
+        return {}
+    return {
+        ("in_use",): pool.checkedout(),
+        ("idle",): pool.checkedin(),
+        ("overflow",): max(0, pool.overflow()),
+    }
+
+
+def pool_usage() -> float:
+    """Доля занятых соединений пула с учетом overflow (0 — без пула)"""
+    if not isinstance(engine.pool, AsyncAdaptedQueuePool):
+        return 0.0
+    return engine.pool.checkedout() / (POOL_SIZE + MAX_OVERFLOW)
+
+
+DB_POOL_CONNECTIONS = Gauge(
+    "warehouse_db_pool_connections",
+    "Соединения пула SQLAlchemy по состояниям",
+    ["state"],
+    collect=_pool_connections,
 )
 
 # Базовый sessionmaker для всех типов сессий
@@ -33,6 +79,50 @@ base_session_factory = async_sessionmaker(
 
 SessionLocal = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
 
+_AFTER_COMMIT_KEY = "after_commit_callbacks"
+
+
+def after_commit(session: AsyncSession | Session, callback: Callable[[], None]):
+    """
+    Регистрирует callback, выполняемый после COMMIT корневой транзакции.
+    Если транзакция (или SAVEPOINT, в котором callback зарегистрирован)
+    откатывается, callback отбрасывается.
+    """
+    if isinstance(session, AsyncSession):
+        session = session.sync_session
+    savepoint = session.get_nested_transaction()
+    session.info.setdefault(_AFTER_COMMIT_KEY, []).append((savepoint, callback))
+
+
+@event.listens_for(Session, "after_commit")
+def _run_after_commit(session: Session):
+    # Освобождение SAVEPOINT тоже вызывает after_commit — ждем корневой COMMIT
+    if session.in_nested_transaction():
+        return
+    for _, callback in session.info.pop(_AFTER_COMMIT_KEY, []):
+        try:
+            callback()
+        except Exception as e:
+            logger.warning("After-commit callback failed: %s", e, exc_info=True)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_after_commit(session: Session, previous_transaction: SessionTransaction):
+    if not previous_transaction.nested:
+        session.info.pop(_AFTER_COMMIT_KEY, None)
+        return
+
+    def rolled_back(savepoint):
+        while savepoint is not None:
+            if savepoint is previous_transaction:
+                return True
+            savepoint = savepoint.parent
+        return False
+
+    callbacks = session.info.get(_AFTER_COMMIT_KEY)
+    if callbacks:
+        callbacks[:] = [item for item in callbacks if not rolled_back(item[0])]
+
 
 @asynccontextmanager
 async def get_session():
@@ -46,8 +136,9 @@ async def get_session():
             yield session
             await session.commit()
         except Exception as e:
+            # Ошибка уходит вызывающему коду — он и логирует ее с контекстом
             await session.rollback()
-            logger.error(f"API session rollback: {str(e)}", exc_info=True)
+            logger.debug("API session rollback: %s", e)
             raise
         finally:
             await session.close()
@@ -68,9 +159,7 @@ async def get_scoped_session():
                 await session.commit()
             except Exception as e:
                 await session.rollback()
-                logger.error(
-                    f"Background task session rollback: {str(e)}", exc_info=True
-                )
+                logger.debug("Background task session rollback: %s", e)
                 raise
     finally:
         await scoped_factory.remove()
@@ -114,7 +203,7 @@ async def get_session_dependency() -> AsyncSession:
         await session.commit()
     except Exception as e:
         await session.rollback()
-        logger.error(f"API session rollback: {str(e)}", exc_info=True)
+        logger.debug("API session rollback: %s", e)
         raise
     finally:
         await session.close()
@@ -0,0 +1,139 @@
+import atexit
+import logging
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+import orjson
+
+from app.config import settings
+from app.metrics import LOG_RECORDS_DROPPED
+
+# Стандартные атрибуты LogRecord: все остальное пришло через extra=
+_RECORD_ATTRS = frozenset(vars(logging.makeLogRecord({}))) | {
+    "message",
+    "asctime",
+    "taskName",
+}
+
+_listener: Optional[QueueListener] = None
+
+
+def _context(record: logging.LogRecord) -> dict:
+    return {
+        key: value for key, value in vars(record).items() if key not in _RECORD_ATTRS
+    }
+
+
+class JsonFormatter(logging.Formatter):
+    """Запись — одна JSON-строка; поля из extra= попадают в нее как есть"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(
+                timespec="milliseconds"
+            ),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **_context(record),
+        }
+        if record.exc_info:
+            payload["exception"] = self.formatException(record.exc_info)
+        return orjson.dumps(payload, default=str).decode()
+
+
+class TextFormatter(logging.Formatter):
+    """Обычный текстовый формат; поля из extra= дописываются как key=value"""
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        message = super().formatMessage(record)
+        context = _context(record)
+        if not context:
+            return message
+        return message + " " + " ".join(f"{k}={v}" for k, v in context.items())
+
+
+class SuccessSampler(logging.Filter):
+    """Пропускает долю rate записей уровня INFO и ниже; WARNING и выше — все"""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno > logging.INFO or random.random() < self.rate
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    """
+    Кладет запись в очередь без форматирования: сообщение собирается в потоке
+    QueueListener'а. Поэтому в аргументах логирования передаются неизменяемые
+    значения. При переполненной очереди запись отбрасывается, а не ждет.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+
+def parse_sample_rates(value: str) -> dict[str, float]:
+    """'logger=0.01,other=0.1' -> {'logger': 0.01, 'other': 0.1}"""
+    rates = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, rate = item.partition("=")
+        rates[name.strip()] = float(rate)
+    return rates
+
+
+def setup_logging():
+    """
+    Настраивает корневой логгер: формат (LOG_FORMAT), выборку успешных
+    сообщений по логгерам (LOG_SAMPLE_RATES) и запись через очередь
+    (LOG_QUEUE_SIZE > 0) — event loop не ждет ввода-вывода логов.
+    """
+    global _listener
+    if settings.LOG_FORMAT == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = TextFormatter("%(asctime)s %(levelname)s %(name)s: %(message)s")
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(formatter)
+
+    root = logging.getLogger()
+    root.setLevel(logging.DEBUG if settings.DEBUG else logging.INFO)
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+
+    stop_logging()
+    if settings.LOG_QUEUE_SIZE > 0:
+        log_queue = queue.Queue(maxsize=settings.LOG_QUEUE_SIZE)
+        root.addHandler(_NonBlockingQueueHandler(log_queue))
+        _listener = QueueListener(log_queue, handler)
+        _listener.start()
+    else:
+        root.addHandler(handler)
+
+    for name, rate in parse_sample_rates(settings.LOG_SAMPLE_RATES).items():
+        logger = logging.getLogger(name)
+        for existing in logger.filters[:]:
+            if isinstance(existing, SuccessSampler):
+                logger.removeFilter(existing)
+        logger.addFilter(SuccessSampler(rate))
+
+
+@atexit.register
+def stop_logging():
+    """Дописывает оставшиеся в очереди записи и останавливает поток записи"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
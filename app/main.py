@@ -4,11 +4,21 @@ from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 
-from app.api.v1.endpoints import movements, stock, kafka_webhook, admin
+from app.api.v1.endpoints import (
+    movements,
+    stock,
+    kafka_webhook,
+    admin,
+    analytics,
+    metrics,
+)
+from app.db.profiler import SqlProfilerMiddleware
 from app.db.session import create_db_async
 from app.config import settings
-from app.services.kafka_consumer import run_consumer
-from app.services.redis import get_redis_client, redis_client
+from app.metrics import HttpMetricsMiddleware
+from app.services.kafka_consumer import KafkaConsumer
+from app.services.partitions import run_partition_maintenance
+from app.services.redis import cache_client, run_invalidation_listener
 
 logger = logging.getLogger(__name__)
 
@@ -17,25 +27,27 @@ logger = logging.getLogger(__name__)
 async def lifespan(app: FastAPI):
     """Управление жизненным циклом приложения"""
 
-    await get_redis_client()
+    await cache_client.connect()
+    invalidation_task = asyncio.create_task(run_invalidation_listener())
+    partitions_task = asyncio.create_task(run_partition_maintenance())
 
-    consumer_task = None
+    consumer = None
     if settings.APP_MODE == "kafka":
-        consumer_task = asyncio.create_task(run_consumer())
+        consumer = KafkaConsumer()
+        consumer.start()
         logger.info("Kafka consumer started")
 
     yield
 
-    if settings.APP_MODE == "kafka":
-        consumer_task.cancel()
-        try:
-            await consumer_task
-        except asyncio.CancelledError:
-            logger.info("Kafka consumer stopped")
+    if consumer is not None:
+        # Дорабатываем взятые записи и коммитим offset'ы до остановки кэша
+        await consumer.shutdown()
+        logger.info("Kafka consumer stopped")
 
-    if redis_client:
-        await redis_client.close()
-        logger.info("Redis connection closed.")
+    invalidation_task.cancel()
+    partitions_task.cancel()
+    await asyncio.gather(invalidation_task, partitions_task, return_exceptions=True)
+    await cache_client.close()
 
 
 app = FastAPI(
@@ -46,6 +58,10 @@ app.include_router(movements.router, prefix="/api/v1/movements", tags=["movement
 app.include_router(stock.router, prefix="/api/v1/warehouse", tags=["warehouse"])
 app.include_router(kafka_webhook.router, prefix="/api/v1/kafka", tags=["Kafka Webhook"])
 app.include_router(admin.router, prefix="/api/v1/admin", tags=["admin"])
+app.include_router(analytics.router, prefix="/api/v1/analytics", tags=["analytics"])
+app.include_router(metrics.router, tags=["metrics"])
+app.add_middleware(SqlProfilerMiddleware)
+app.add_middleware(HttpMetricsMiddleware)
 
 
 def create_db():
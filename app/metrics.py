@@ -0,0 +1,269 @@
+import math
+import time
+from bisect import bisect_left
+from typing import Callable, Iterable, Optional
+
+# Метрики в текстовом формате Prometheus (0.0.4). Обновления выполняются
+# в потоке event loop, поэтому обходятся без блокировок: счетчик — одно
+# сложение, гистограмма — bisect по границам и два сложения. Дочерние
+# метрики с известными заранее метками стоит получить через labels() один
+# раз и хранить, чтобы не создавать кортеж меток на каждое обновление.
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+SIZE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class _HistogramValue:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # Последняя корзина — +Inf
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        collect: Optional[Callable[[], dict[tuple, float]]] = None,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # collect — значения вычисляются при выгрузке: {метки: значение}
+        self.collect = collect
+        self._children: dict[tuple, object] = {}
+        registry.append(self)
+
+    def labels(self, *values):
+        values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name}: expected labels {self.labelnames}")
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        return _Value()
+
+    def _samples(self) -> Iterable[tuple[str, tuple, tuple, float]]:
+        """(имя, имена меток, значения меток, значение)"""
+        if self.collect:
+            for values, value in self.collect().items():
+                yield self.name, self.labelnames, values, value
+            return
+        for values, child in self._children.items():
+            yield self.name, self.labelnames, values, child.value
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for name, labelnames, values, value in self._samples():
+            lines.append(f"{name}{_format_labels(labelnames, values)} {value!r}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0):
+        """Счетчик без меток"""
+        self.labels().inc(amount)
+
+    @property
+    def value(self) -> float:
+        return self.labels().value
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def _samples(self):
+        bucket_labelnames = self.labelnames + ("le",)
+        for values, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), child.counts):
+                cumulative += count
+                le = "+Inf" if bound == math.inf else repr(float(bound))
+                yield (
+                    f"{self.name}_bucket",
+                    bucket_labelnames,
+                    values + (le,),
+                    cumulative,
+                )
+            yield f"{self.name}_sum", self.labelnames, values, child.sum
+            yield f"{self.name}_count", self.labelnames, values, cumulative
+
+
+registry: list[_Metric] = []
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def _format_labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        f'{name}="{_escape(value)}"' for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+# Обработка событий
+EVENT_PROCESSING_SECONDS = Histogram(
+    "warehouse_event_processing_seconds",
+    "Время обработки события (в пачке — доля времени пачки)",
+    ["event_type"],
+)
+
+# Kafka consumer
+CONSUMER_BATCH_SIZE = Histogram(
+    "warehouse_consumer_batch_size",
+    "Записей в пачке, прочитанной из Kafka",
+    buckets=SIZE_BUCKETS,
+)
+CONSUMER_LAG = Gauge(
+    "warehouse_consumer_lag",
+    "Отставание от конца партиции после чтения, записей",
+    ["topic", "partition"],
+)
+CONSUMER_PAUSED = Gauge(
+    "warehouse_consumer_paused",
+    "1 — чтение партиций приостановлено из-за перегрузки БД или очередей",
+)
+
+# Кэш
+CACHE_REQUESTS = Counter(
+    "warehouse_cache_requests_total",
+    "Обращения к кэшу по уровням и результатам",
+    ["level", "result"],
+)
+
+# Пул соединений с БД
+DB_POOL_CHECKOUT_SECONDS = Histogram(
+    "warehouse_db_pool_checkout_seconds",
+    "Ожидание соединения из пула SQLAlchemy",
+)
+
+# Логирование
+LOG_RECORDS_DROPPED = Counter(
+    "warehouse_log_records_dropped_total",
+    "Записей лога, отброшенных из-за переполненной очереди",
+)
+
+# HTTP
+HTTP_REQUEST_SECONDS = Histogram(
+    "warehouse_http_request_seconds",
+    "Время обработки HTTP-запроса по маршрутам",
+    ["method", "route", "status"],
+)
+
+
+class HttpMetricsMiddleware:
+    """
+    ASGI middleware: время запроса по шаблону маршрута (а не по пути,
+    чтобы ID в пути не размножали ряды) и классу статуса ответа.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # Роутер FastAPI кладет найденный маршрут в scope запроса
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            HTTP_REQUEST_SECONDS.labels(
+                scope["method"], route, f"{status // 100}xx"
+            ).observe(time.perf_counter() - started)
+
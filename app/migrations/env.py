@@ -11,6 +11,7 @@ from sqlalchemy.ext.asyncio import AsyncEngine
 from app.db import Base
 from app.db import Warehouse  # noqa
 from app.config import settings
+from app.services.partitions import DEFAULT_PARTITION, PARTITION_NAME_RE
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
@@ -36,6 +37,16 @@ target_metadata = Base.metadata
 # ... etc.
 
 
+def include_object(object, name, type_, reflected, compare_to):
+    """
+    Секции movements создает и удаляет app.services.partitions, в моделях их
+    нет: без фильтра autogenerate предлагает удалить их вместе с индексами
+    """
+    if type_ == "table" and reflected and compare_to is None:
+        return not (name == DEFAULT_PARTITION or PARTITION_NAME_RE.match(name))
+    return True
+
+
 def run_migrations_offline() -> None:
     """Run migrations in 'offline' mode.
 
@@ -54,6 +65,7 @@ def run_migrations_offline() -> None:
         target_metadata=target_metadata,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
+        include_object=include_object,
     )
 
     with context.begin_transaction():
@@ -65,6 +77,7 @@ def do_run_migrations(connection: Connection) -> None:
         connection=connection,
         target_metadata=target_metadata,
         compare_type=True,
+        include_object=include_object,
     )
 
     with context.begin_transaction():
@@ -0,0 +1,38 @@
+"""stock item version
+
+Revision ID: 0003_stock_item_version
+Revises: 0002_update_all_models
+Create Date: 2026-10-18 10:05:12.418203
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0003_stock_item_version"
+down_revision: Union[str, None] = "0002_update_all_models"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column(
+        "stock_items",
+        sa.Column(
+            "version",
+            sa.BigInteger(),
+            nullable=False,
+            server_default="0",
+            comment="Версия остатка (растет при каждом изменении)",
+        ),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column("stock_items", "version")
@@ -0,0 +1,57 @@
+"""processed events
+
+Revision ID: 0004_processed_events
+Revises: 0003_stock_item_version
+Create Date: 2026-10-18 12:41:37.905114
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0004_processed_events"
+down_revision: Union[str, None] = "0003_stock_item_version"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "processed_events",
+        sa.Column(
+            "movement_id",
+            sa.UUID(as_uuid=False),
+            nullable=False,
+            comment="ID перемещения из Kafka",
+        ),
+        sa.Column(
+            "event_type",
+            sa.String(length=16),
+            nullable=False,
+            comment="Тип события: arrival или departure",
+        ),
+        sa.Column(
+            "message_id",
+            sa.UUID(as_uuid=False),
+            nullable=True,
+            comment="ID CloudEvent-сообщения",
+        ),
+        sa.Column(
+            "processed_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        sa.PrimaryKeyConstraint("movement_id", "event_type"),
+        comment="Ключи идемпотентности примененных событий перемещения",
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("processed_events")
@@ -0,0 +1,43 @@
+"""movement pending match indexes
+
+Revision ID: 0005_movement_pending_match
+Revises: 0004_processed_events
+Create Date: 2026-10-18 13:20:04.518227
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0005_movement_pending_match"
+down_revision: Union[str, None] = "0004_processed_events"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(
+        "ix_movement_in_transit",
+        "movements",
+        ["kafka_movement_id"],
+        unique=False,
+        postgresql_where=sa.text("status = 'IN_TRANSIT'"),
+    )
+    op.create_index(
+        "ix_movement_awaiting_departure",
+        "movements",
+        ["kafka_movement_id"],
+        unique=False,
+        postgresql_where=sa.text("source_warehouse_id IS NULL"),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_movement_awaiting_departure", table_name="movements")
+    op.drop_index("ix_movement_in_transit", table_name="movements")
@@ -0,0 +1,95 @@
+"""movement indexes for real access patterns
+
+Revision ID: 0006_movement_indexes
+Revises: 0005_movement_pending_match
+Create Date: 2026-10-18 14:02:51.730914
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0006_movement_indexes"
+down_revision: Union[str, None] = "0005_movement_pending_match"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Одноколоночные индексы, которые не покрывают ни один запрос сервиса
+# или дублируют друг друга (ix_movement_status / ix_movements_status и т.п.)
+OBSOLETE_MOVEMENT_INDEXES = {
+    "ix_movement_kafka_id": ["kafka_movement_id"],
+    "ix_movement_status": ["status"],
+    "ix_movements_status": ["status"],
+    "ix_movements_product_id": ["product_id"],
+    "ix_movements_source_warehouse_id": ["source_warehouse_id"],
+    "ix_movements_destination_warehouse_id": ["destination_warehouse_id"],
+    "ix_movements_departure_time": ["departure_time"],
+    "ix_movements_arrival_time": ["arrival_time"],
+}
+
+COMPOSITE_MOVEMENT_INDEXES = {
+    "ix_movement_source_departure": ["source_warehouse_id", "departure_time"],
+    "ix_movement_destination_arrival": ["destination_warehouse_id", "arrival_time"],
+}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # CONCURRENTLY не блокирует запись в большую таблицу, но не работает
+    # внутри транзакции
+    with op.get_context().autocommit_block():
+        for name, columns in COMPOSITE_MOVEMENT_INDEXES.items():
+            op.create_index(
+                name,
+                "movements",
+                columns,
+                unique=False,
+                postgresql_concurrently=True,
+                if_not_exists=True,
+            )
+        for name in OBSOLETE_MOVEMENT_INDEXES:
+            op.drop_index(
+                name,
+                table_name="movements",
+                postgresql_concurrently=True,
+                if_exists=True,
+            )
+        # Дубликат индекса первичного ключа products_pkey
+        op.drop_index(
+            "ix_product_id",
+            table_name="products",
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_product_id",
+            "products",
+            ["id"],
+            unique=True,
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        for name, columns in OBSOLETE_MOVEMENT_INDEXES.items():
+            op.create_index(
+                name,
+                "movements",
+                columns,
+                unique=False,
+                postgresql_concurrently=True,
+                if_not_exists=True,
+            )
+        for name in COMPOSITE_MOVEMENT_INDEXES:
+            op.drop_index(
+                name,
+                table_name="movements",
+                postgresql_concurrently=True,
+                if_exists=True,
+            )
@@ -0,0 +1,191 @@
+"""partition movements by month
+
+Revision ID: 0007_partition_movements
+Revises: 0006_movement_indexes
+Create Date: 2026-10-18 15:11:43.206518
+
+"""
+
+from datetime import datetime, timezone
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0007_partition_movements"
+down_revision: Union[str, None] = "0006_movement_indexes"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Секции на сколько месяцев вперед создаются сразу (дальше — фоновая задача)
+PARTITIONS_AHEAD = 3
+
+COLUMNS = (
+    "id, kafka_movement_id, source_warehouse_id, destination_warehouse_id, "
+    "product_id, quantity, departure_time, arrival_time, status, quantity_diff"
+)
+
+INDEXES = [
+    ("ix_movement_product", ["product_id"], None),
+    ("ix_movement_source_departure", ["source_warehouse_id", "departure_time"], None),
+    (
+        "ix_movement_destination_arrival",
+        ["destination_warehouse_id", "arrival_time"],
+        None,
+    ),
+    ("ix_movement_in_transit", ["kafka_movement_id"], "status = 'IN_TRANSIT'"),
+    (
+        "ix_movement_awaiting_departure",
+        ["kafka_movement_id"],
+        "source_warehouse_id IS NULL",
+    ),
+]
+
+
+def _add_months(month: datetime, months: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def _movement_columns() -> list[sa.Column]:
+    return [
+        sa.Column(
+            "id",
+            sa.UUID(as_uuid=False),
+            nullable=False,
+            comment="Внутренний ID записи",
+        ),
+        sa.Column(
+            "kafka_movement_id",
+            sa.UUID(as_uuid=False),
+            nullable=False,
+            comment="ID перемещения из Kafka",
+        ),
+        sa.Column("source_warehouse_id", sa.UUID(as_uuid=False), nullable=True),
+        sa.Column("destination_warehouse_id", sa.UUID(as_uuid=False), nullable=True),
+        sa.Column("product_id", sa.UUID(as_uuid=False), nullable=False),
+        sa.Column(
+            "quantity", sa.Integer(), nullable=False, comment="Количество товара"
+        ),
+        sa.Column("departure_time", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("arrival_time", sa.DateTime(timezone=True), nullable=True),
+        sa.Column(
+            "status",
+            postgresql.ENUM(name="movementstatus", create_type=False),
+            nullable=False,
+            server_default="PENDING",
+        ),
+        sa.Column(
+            "quantity_diff",
+            sa.Integer(),
+            nullable=True,
+            comment="Разница между отправленным и полученным количеством",
+        ),
+    ]
+
+
+def _movement_constraints() -> list:
+    return [
+        sa.CheckConstraint("quantity > 0", name="ck_movement_quantity_positive"),
+        sa.CheckConstraint(
+            "source_warehouse_id IS NOT NULL OR destination_warehouse_id IS NOT NULL",
+            name="ck_movement_warehouse_presence",
+        ),
+        sa.ForeignKeyConstraint(["source_warehouse_id"], ["warehouses.id"]),
+        sa.ForeignKeyConstraint(["destination_warehouse_id"], ["warehouses.id"]),
+        sa.ForeignKeyConstraint(["product_id"], ["products.id"]),
+    ]
+
+
+def _create_indexes():
+    for name, columns, where in INDEXES:
+        op.create_index(
+            name,
+            "movements",
+            columns,
+            unique=False,
+            postgresql_where=sa.text(where) if where else None,
+        )
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Имена индексов и первичного ключа уникальны в схеме: освобождаем их
+    op.rename_table("movements", "movements_legacy")
+    op.execute(
+        "ALTER TABLE movements_legacy "
+        "RENAME CONSTRAINT movements_pkey TO movements_legacy_pkey"
+    )
+    for name, _, _ in INDEXES:
+        op.drop_index(name, table_name="movements_legacy")
+
+    op.create_table(
+        "movements",
+        *_movement_columns(),
+        sa.Column(
+            "recorded_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=False,
+            comment="Время первого события перемещения (ключ секционирования)",
+        ),
+        sa.PrimaryKeyConstraint("id", "recorded_at"),
+        *_movement_constraints(),
+        comment="История перемещений товаров между складами",
+        postgresql_partition_by="RANGE (recorded_at)",
+    )
+    op.execute("CREATE TABLE movements_default PARTITION OF movements DEFAULT")
+
+    # Месячные секции: от самой старой записи до PARTITIONS_AHEAD месяцев вперед
+    now = datetime.now(timezone.utc)
+    current = datetime(now.year, now.month, 1, tzinfo=timezone.utc)
+    oldest = op.get_bind().scalar(
+        sa.text(
+            "SELECT min(coalesce(departure_time, arrival_time)) FROM movements_legacy"
+        )
+    )
+    month = current
+    if oldest is not None:
+        oldest = oldest.astimezone(timezone.utc)
+        month = min(
+            current, datetime(oldest.year, oldest.month, 1, tzinfo=timezone.utc)
+        )
+    while month <= _add_months(current, PARTITIONS_AHEAD):
+        upper = _add_months(month, 1)
+        op.execute(
+            f"CREATE TABLE movements_p{month:%Y%m} PARTITION OF movements "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{upper.isoformat()}')"
+        )
+        month = upper
+
+    op.execute(
+        f"INSERT INTO movements ({COLUMNS}, recorded_at) "
+        f"SELECT {COLUMNS}, coalesce(departure_time, arrival_time, now()) "
+        "FROM movements_legacy"
+    )
+    op.drop_table("movements_legacy")
+    _create_indexes()
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.create_table(
+        "movements_plain",
+        *_movement_columns(),
+        sa.PrimaryKeyConstraint("id", name="movements_plain_pkey"),
+        *_movement_constraints(),
+        comment="История перемещений товаров между складами",
+    )
+    op.execute(
+        f"INSERT INTO movements_plain ({COLUMNS}) SELECT {COLUMNS} FROM movements"
+    )
+    # Удаление секционированной таблицы удаляет и все ее секции
+    op.drop_table("movements")
+    op.rename_table("movements_plain", "movements")
+    op.execute(
+        "ALTER TABLE movements RENAME CONSTRAINT movements_plain_pkey TO movements_pkey"
+    )
+    _create_indexes()
@@ -0,0 +1,49 @@
+"""movement keyset indexes
+
+Revision ID: 0008_movement_keyset_indexes
+Revises: 0007_partition_movements
+Create Date: 2026-10-18 16:04:27.851390
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0008_movement_keyset_indexes"
+down_revision: Union[str, None] = "0007_partition_movements"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Список перемещений сортируется по (recorded_at, id) после фильтра
+KEYSET_INDEXES = {
+    "ix_movement_recorded": ["recorded_at", "id"],
+    "ix_movement_product": ["product_id", "recorded_at", "id"],
+    "ix_movement_source": ["source_warehouse_id", "recorded_at", "id"],
+    "ix_movement_destination": ["destination_warehouse_id", "recorded_at", "id"],
+}
+
+PREVIOUS_INDEXES = {
+    "ix_movement_product": ["product_id"],
+    "ix_movement_source_departure": ["source_warehouse_id", "departure_time"],
+    "ix_movement_destination_arrival": ["destination_warehouse_id", "arrival_time"],
+}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Индекс секционированной таблицы нельзя строить CONCURRENTLY
+    for name in PREVIOUS_INDEXES:
+        op.drop_index(name, table_name="movements")
+    for name, columns in KEYSET_INDEXES.items():
+        op.create_index(name, "movements", columns, unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for name in KEYSET_INDEXES:
+        op.drop_index(name, table_name="movements")
+    for name, columns in PREVIOUS_INDEXES.items():
+        op.create_index(name, "movements", columns, unique=False)
@@ -0,0 +1,121 @@
+"""movement rollups
+
+Revision ID: 0009_movement_rollups
+Revises: 0008_movement_keyset_indexes
+Create Date: 2026-10-18 17:22:09.114835
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0009_movement_rollups"
+down_revision: Union[str, None] = "0008_movement_keyset_indexes"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Должно совпадать с app.services.rollups
+HISTOGRAM_BUCKETS = 96
+BUCKETS_PER_OCTAVE = 4
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "movement_rollups",
+        sa.Column("day", sa.Date(), nullable=False, comment="День прибытия (UTC)"),
+        sa.Column("source_warehouse_id", sa.UUID(as_uuid=False), nullable=False),
+        sa.Column("destination_warehouse_id", sa.UUID(as_uuid=False), nullable=False),
+        sa.Column("product_id", sa.UUID(as_uuid=False), nullable=False),
+        sa.Column("movements_count", sa.BigInteger(), nullable=False),
+        sa.Column("transit_seconds_sum", sa.Double(), nullable=False),
+        sa.Column("transit_seconds_min", sa.Double(), nullable=False),
+        sa.Column("transit_seconds_max", sa.Double(), nullable=False),
+        sa.Column(
+            "quantity_diff_sum",
+            sa.BigInteger(),
+            nullable=False,
+            comment="Суммарная недостача (усушка)",
+        ),
+        sa.Column(
+            "transit_histogram",
+            postgresql.ARRAY(sa.Integer()),
+            nullable=False,
+            comment="Логарифмическая гистограмма времени в пути (app.services.rollups)",
+        ),
+        sa.PrimaryKeyConstraint(
+            "day", "source_warehouse_id", "destination_warehouse_id", "product_id"
+        ),
+        comment=(
+            "Агрегаты завершенных перемещений по маршруту, товару и дню "
+            "(обновляются при обработке событий)"
+        ),
+    )
+
+    # Заполнение по уже завершенным перемещениям: один проход по таблице
+    op.execute(
+        f"""
+        WITH completed AS (
+            SELECT
+                (arrival_time AT TIME ZONE 'UTC')::date AS day,
+                source_warehouse_id,
+                destination_warehouse_id,
+                product_id,
+                abs(extract(epoch FROM arrival_time - departure_time))::float8
+                    AS seconds,
+                coalesce(quantity_diff, 0) AS quantity_diff
+            FROM movements
+            WHERE departure_time IS NOT NULL
+              AND arrival_time IS NOT NULL
+              AND source_warehouse_id IS NOT NULL
+              AND destination_warehouse_id IS NOT NULL
+        ),
+        keys AS (
+            SELECT
+                day, source_warehouse_id, destination_warehouse_id, product_id,
+                count(*) AS movements_count,
+                sum(seconds) AS transit_seconds_sum,
+                min(seconds) AS transit_seconds_min,
+                max(seconds) AS transit_seconds_max,
+                sum(quantity_diff) AS quantity_diff_sum
+            FROM completed
+            GROUP BY 1, 2, 3, 4
+        ),
+        buckets AS (
+            SELECT
+                day, source_warehouse_id, destination_warehouse_id, product_id,
+                CASE WHEN seconds < 1 THEN 0 ELSE least(
+                    {HISTOGRAM_BUCKETS - 1},
+                    floor(log(2, seconds::numeric) * {BUCKETS_PER_OCTAVE})::int
+                ) END AS bucket,
+                count(*)::int AS hits
+            FROM completed
+            GROUP BY 1, 2, 3, 4, 5
+        )
+        INSERT INTO movement_rollups
+        SELECT
+            k.day, k.source_warehouse_id, k.destination_warehouse_id, k.product_id,
+            k.movements_count, k.transit_seconds_sum, k.transit_seconds_min,
+            k.transit_seconds_max, k.quantity_diff_sum,
+            array_agg(coalesce(b.hits, 0) ORDER BY i)
+        FROM keys k
+        CROSS JOIN generate_series(0, {HISTOGRAM_BUCKETS - 1}) AS i
+        LEFT JOIN buckets b
+            ON b.day = k.day
+            AND b.source_warehouse_id = k.source_warehouse_id
+            AND b.destination_warehouse_id = k.destination_warehouse_id
+            AND b.product_id = k.product_id
+            AND b.bucket = i
+        GROUP BY 1, 2, 3, 4, 5, 6, 7, 8, 9
+        """
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("movement_rollups")
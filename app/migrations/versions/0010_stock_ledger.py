@@ -0,0 +1,71 @@
+"""stock ledger and snapshots
+
+Revision ID: 0010_stock_ledger
+Revises: 0009_movement_rollups
+Create Date: 2026-10-18 18:04:51.372940
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0010_stock_ledger"
+down_revision: Union[str, None] = "0009_movement_rollups"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "stock_ledger",
+        sa.Column("warehouse_id", sa.UUID(as_uuid=False), nullable=False),
+        sa.Column("product_id", sa.UUID(as_uuid=False), nullable=False),
+        sa.Column(
+            "version",
+            sa.BigInteger(),
+            nullable=False,
+            comment="Версия строки остатка после изменения",
+        ),
+        sa.Column(
+            "delta", sa.Integer(), nullable=False, comment="Изменение количества"
+        ),
+        sa.Column(
+            "applied_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("clock_timestamp()"),
+            nullable=False,
+        ),
+        sa.PrimaryKeyConstraint("warehouse_id", "product_id", "version"),
+        comment="Журнал изменений остатков (только добавление)",
+    )
+    op.create_table(
+        "stock_snapshots",
+        sa.Column("warehouse_id", sa.UUID(as_uuid=False), nullable=False),
+        sa.Column("product_id", sa.UUID(as_uuid=False), nullable=False),
+        sa.Column("version", sa.BigInteger(), nullable=False),
+        sa.Column("quantity", sa.Integer(), nullable=False),
+        sa.Column(
+            "taken_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("clock_timestamp()"),
+            nullable=False,
+        ),
+        sa.PrimaryKeyConstraint("warehouse_id", "product_id", "version"),
+        comment="Снимки остатков: каждая STOCK_SNAPSHOT_INTERVAL-я версия",
+    )
+    # Начальные снимки: история существующих остатков начинается с миграции
+    op.execute(
+        "INSERT INTO stock_snapshots (warehouse_id, product_id, version, quantity) "
+        "SELECT warehouse_id, product_id, version, quantity FROM stock_items"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("stock_snapshots")
+    op.drop_table("stock_ledger")
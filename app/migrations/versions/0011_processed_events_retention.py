@@ -0,0 +1,30 @@
+"""processed events retention index
+
+Revision ID: 0011_processed_events_retention
+Revises: 0010_stock_ledger
+Create Date: 2026-10-18 19:12:40.218734
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0011_processed_events_retention"
+down_revision: Union[str, None] = "0010_stock_ledger"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(
+        "ix_processed_events_processed_at", "processed_events", ["processed_at"]
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_processed_events_processed_at", table_name="processed_events")
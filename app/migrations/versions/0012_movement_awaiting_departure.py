@@ -0,0 +1,64 @@
+"""movement awaiting departure flag
+
+Revision ID: 0012_movement_awaiting_departure
+Revises: 0011_processed_events_retention
+Create Date: 2026-10-18 20:41:07.512306
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0012_movement_awaiting_departure"
+down_revision: Union[str, None] = "0011_processed_events_retention"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Окно ожидания отгрузки для уже записанных приемок
+# (MOVEMENT_PAIRING_WINDOW_DAYS по умолчанию)
+PAIRING_WINDOW_DAYS = 7
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Колонка родителя добавляется во все секции
+    op.add_column(
+        "movements",
+        sa.Column(
+            "awaiting_departure",
+            sa.Boolean(),
+            nullable=False,
+            server_default=sa.text("false"),
+            comment="Приемка ждет парную отгрузку",
+        ),
+    )
+    op.execute(
+        "UPDATE movements SET awaiting_departure = true "
+        "WHERE source_warehouse_id IS NULL AND recorded_at >= "
+        f"now() - interval '{PAIRING_WINDOW_DAYS} days'"
+    )
+    op.drop_index("ix_movement_awaiting_departure", table_name="movements")
+    op.create_index(
+        "ix_movement_awaiting_departure",
+        "movements",
+        ["kafka_movement_id"],
+        unique=False,
+        postgresql_where=sa.text("awaiting_departure"),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_movement_awaiting_departure", table_name="movements")
+    op.create_index(
+        "ix_movement_awaiting_departure",
+        "movements",
+        ["kafka_movement_id"],
+        unique=False,
+        postgresql_where=sa.text("source_warehouse_id IS NULL"),
+    )
+    op.drop_column("movements", "awaiting_departure")
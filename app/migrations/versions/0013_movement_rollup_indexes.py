@@ -0,0 +1,51 @@
+"""movement rollup filter indexes
+
+Revision ID: 0013_movement_rollup_indexes
+Revises: 0012_movement_awaiting_departure
+Create Date: 2026-10-18 21:26:53.904172
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "0013_movement_rollup_indexes"
+down_revision: Union[str, None] = "0012_movement_awaiting_departure"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Фильтры аналитики по складу или товару с диапазоном дней
+ROLLUP_INDEXES = {
+    "ix_movement_rollup_source": ["source_warehouse_id", "day"],
+    "ix_movement_rollup_destination": ["destination_warehouse_id", "day"],
+    "ix_movement_rollup_product": ["product_id", "day"],
+}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.get_context().autocommit_block():
+        for name, columns in ROLLUP_INDEXES.items():
+            op.create_index(
+                name,
+                "movement_rollups",
+                columns,
+                unique=False,
+                postgresql_concurrently=True,
+                if_not_exists=True,
+            )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        for name in ROLLUP_INDEXES:
+            op.drop_index(
+                name,
+                table_name="movement_rollups",
+                postgresql_concurrently=True,
+                if_exists=True,
+            )
@@ -0,0 +1,153 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.db.session import get_session
+from app.services.redis import (
+    acquire_lock,
+    codec,
+    get_cache_json,
+    get_cache_json_with_ttl,
+    get_lock_cache_key,
+    release_lock,
+)
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Загрузчик значения из БД; сам пишет его в кэш и возвращает (None — не найдено)
+Loader = Callable[[AsyncSession], Awaitable[Optional[Any]]]
+
+
+class SingleFlight:
+    """
+    Схлопывание конкурентных вызовов: пока ключ загружается, остальные
+    вызовы с тем же ключом ждут результат (или исключение) первого.
+    """
+
+    def __init__(self):
+        self._calls: dict[Hashable, asyncio.Future] = {}
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        while (future := self._calls.get(key)) is not None:
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise  # отменили нас самих
+                # Отменен лидер — загрузку берет на себя один из ожидающих
+
+        future = asyncio.get_running_loop().create_future()
+        # Исключение без ожидающих не должно попадать в лог как "never retrieved"
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._calls[key] = future
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._calls[key]
+
+
+single_flight = SingleFlight()
+_refresh_tasks: set[asyncio.Task] = set()
+
+
+async def get_or_load(
+    key: str, loader: Loader, session: AsyncSession
+) -> Optional[bytes]:
+    """
+    Значение ключа в виде JSON: из кэша или через loader.
+
+    Конкурентные промахи одного ключа выполняют loader один раз
+    (в режиме redis — один раз на все поды). Ключ, которому осталось жить
+    меньше CACHE_REFRESH_AHEAD_SECONDS, отдается как есть и обновляется в фоне.
+    """
+    if settings.CACHE_SINGLE_FLIGHT == "off":
+        cached = await get_cache_json(key)
+        if cached is not None:
+            return cached
+        return _to_json(await loader(session))
+
+    cached, pttl = await get_cache_json_with_ttl(key)
+    if cached is not None:
+        if pttl is not None and 0 <= pttl < settings.CACHE_REFRESH_AHEAD_SECONDS * 1000:
+            _schedule_refresh(key, loader)
+        return cached
+    return await single_flight.do(key, lambda: _load(key, loader, session))
+
+
+async def _load(key: str, loader: Loader, session: AsyncSession) -> Optional[bytes]:
+    if settings.CACHE_SINGLE_FLIGHT != "redis":
+        return _to_json(await loader(session))
+
+    lock_key = get_lock_cache_key(key)
+    token = await acquire_lock(lock_key, settings.CACHE_LOCK_TTL_MS)
+    if token is None:
+        # Ключ загружает другой под: ждем его запись, но не дольше TTL блокировки
+        cached = await _wait_for_cache(key)
+        if cached is not None:
+            return cached
+        return _to_json(await loader(session))
+    try:
+        return _to_json(await loader(session))
+    finally:
+        await release_lock(lock_key, token)
+
+
+async def _wait_for_cache(key: str) -> Optional[bytes]:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.CACHE_LOCK_TTL_MS / 1000
+    while loop.time() < deadline:
+        await asyncio.sleep(settings.CACHE_LOCK_POLL_MS / 1000)
+        cached = await get_cache_json(key)
+        if cached is not None:
+            return cached
+    return None
+
+
+def _schedule_refresh(key: str, loader: Loader):
+    """Фоновое обновление ключа (stale-while-revalidate) в собственной сессии"""
+    # Отдельный ключ: промах не должен получить пустой результат обновления
+    flight_key = ("refresh", key)
+    if single_flight.in_flight(flight_key):
+        return
+    task = asyncio.create_task(
+        single_flight.do(flight_key, lambda: _refresh(key, loader))
+    )
+    _refresh_tasks.add(task)
+    task.add_done_callback(_refresh_tasks.discard)
+
+
+async def _refresh(key: str, loader: Loader) -> Optional[bytes]:
+    lock_key = get_lock_cache_key(key)
+    token = None
+    if settings.CACHE_SINGLE_FLIGHT == "redis":
+        token = await acquire_lock(lock_key, settings.CACHE_LOCK_TTL_MS)
+        if token is None:
+            return None  # Обновляет другой под
+    try:
+        async with get_session() as session:
+            return _to_json(await loader(session))
+    except Exception as e:
+        logger.warning("Background cache refresh failed for key %s: %s", key, e)
+        return None
+    finally:
+        if token is not None:
+            await release_lock(lock_key, token)
+
+
+def _to_json(value: Any) -> Optional[bytes]:
+    return None if value is None else codec.to_json(codec.encode(value))
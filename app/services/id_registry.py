@@ -0,0 +1,67 @@
+import time
+from collections import OrderedDict
+
+from app.config import settings
+
+
+class IdRegistry:
+    """
+    In-process реестр ID, существование которых в БД уже подтверждено.
+
+    Ограничен по размеру (LRU) и по времени жизни записи (TTL), чтобы
+    удаленные в обход сервиса сущности не оставались в реестре навсегда.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, float] = OrderedDict()
+
+    def known(self, entity_id) -> bool:
+        """Проверяет ID без обращения к БД (учитывается в hit/miss)"""
+        key = str(entity_id)
+        expires_at = self._entries.get(key)
+        if expires_at is None or expires_at < time.monotonic():
+            if expires_at is not None:
+                del self._entries[key]
+            self.misses += 1
+            return False
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return True
+
+    def add(self, *entity_ids):
+        """Запоминает ID, вытесняя самые давно использованные"""
+        expires_at = time.monotonic() + self.ttl_seconds
+        for entity_id in entity_ids:
+            key = str(entity_id)
+            self._entries[key] = expires_at
+            self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = self.misses = 0
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else None,
+        }
+
+
+warehouse_registry = IdRegistry(
+    settings.ID_REGISTRY_MAX_SIZE, settings.ID_REGISTRY_TTL_SECONDS
+)
+product_registry = IdRegistry(
+    settings.ID_REGISTRY_MAX_SIZE, settings.ID_REGISTRY_TTL_SECONDS
+)
+processed_event_registry = IdRegistry(
+    settings.PROCESSED_EVENTS_CACHE_SIZE, settings.PROCESSED_EVENTS_CACHE_TTL_SECONDS
+)
@@ -1,54 +1,585 @@
-from aiokafka import AIOKafkaConsumer
-from app.db.session import get_scoped_session
-from app.api.v1.schemas import KafkaMessageData
-from app.services.kafka_processor import process_movement_event
+import asyncio
+import time
+from collections import deque
+from typing import Optional
+
+from aiokafka import (
+    AIOKafkaConsumer,
+    ConsumerRebalanceListener,
+    ConsumerRecord,
+    TopicPartition,
+)
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.profiler import profile_sql
+from app.db.session import get_scoped_session, pool_usage
+from app.metrics import CONSUMER_BATCH_SIZE, CONSUMER_LAG, CONSUMER_PAUSED
+from app.api.v1.schemas import KafkaMessageData, KafkaFullMessage
+from app.services.kafka_processor import (
+    POISON_ERRORS,
+    DuplicateEventError,
+    apply_movement_events,
+    process_movement_event,
+)
+from app.services.redis import cache_batch
 from app.config import settings
 import logging
 import json
 
 logger = logging.getLogger(__name__)
 
+# Пауза перед повторным чтением после сбоя транзакции
+RETRY_BACKOFF_SECONDS = 1.0
+# Чтение возобновляется, когда нагрузка опустится ниже этой доли порогов
+RESUME_RATIO = 0.5
+# Вес новой транзакции в сглаженном (EWMA) времени транзакций
+LATENCY_SMOOTHING = 0.3
+
+
+class PartitionOffsetTracker:
+    """
+    Учет offset'ов партиции, обрабатываемых не по порядку.
+
+    Watermark — offset, который можно коммитить: все записи до него
+    (включительно предшественники) уже обработаны.
+    """
+
+    def __init__(self):
+        self._pending: deque[int] = deque()
+        self._done: set[int] = set()
+        self._drained = asyncio.Event()
+        self._drained.set()
+        self.watermark: Optional[int] = None
+        self.committed: Optional[int] = None
+        # Партицию отозвали: ее записи из очередей воркеров не применяются
+        self.revoked = False
+
+    def track(self, offset: int):
+        """Регистрирует запись, отданную в обработку (offset'ы по возрастанию)"""
+        self._pending.append(offset)
+        self._drained.clear()
+
+    def done(self, offset: int):
+        """Отмечает запись обработанной и сдвигает watermark"""
+        self._done.add(offset)
+        while self._pending and self._pending[0] in self._done:
+            finished = self._pending.popleft()
+            self._done.discard(finished)
+            self.watermark = finished + 1
+        if not self._pending:
+            self._drained.set()
+
+    async def wait_drained(self):
+        """Ждет, пока все отданные в обработку записи будут обработаны"""
+        await self._drained.wait()
+
+    def abandon(self):
+        """Воркеры остановлены: оставшиеся записи обработаны не будут"""
+        self.revoked = True
+        self._drained.set()
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._pending)
+
+
+class Backpressure:
+    """
+    Решение о приостановке чтения партиций по записям в обработке, занятости
+    пула соединений и сглаженному времени транзакций consumer'а.
+
+    Приостановленное чтение возобновляется с гистерезисом — когда нагрузка
+    ниже RESUME_RATIO от порогов. Время транзакций без новых транзакций
+    не меняется, поэтому при высоком времени чтение возобновляется пробно
+    раз в KAFKA_PAUSE_COOLDOWN_MS: одна пачка, и снова пауза, пока БД
+    не ускорится.
+    """
+
+    def __init__(self):
+        self.latency = 0.0
+        self.paused_at: Optional[float] = None
+
+    @property
+    def paused(self) -> bool:
+        return self.paused_at is not None
+
+    def observe(self, seconds: float):
+        """Учитывает время очередной транзакции"""
+        if self.latency:
+            self.latency += LATENCY_SMOOTHING * (seconds - self.latency)
+        else:
+            self.latency = seconds
+
+    def check(self, in_flight: int, pool_usage: float, now: float) -> Optional[str]:
+        """Причина держать чтение приостановленным или None"""
+        ratio = RESUME_RATIO if self.paused else 1.0
+        if in_flight >= settings.KAFKA_MAX_IN_FLIGHT * ratio:
+            reason = "in_flight"
+        elif pool_usage >= settings.KAFKA_PAUSE_POOL_USAGE * ratio:
+            reason = "pool_usage"
+        elif self.latency * 1000 >= settings.KAFKA_PAUSE_DB_LATENCY_MS * ratio and (
+            not self.paused
+            or (now - self.paused_at) * 1000 < settings.KAFKA_PAUSE_COOLDOWN_MS
+        ):
+            reason = "db_latency"
+        else:
+            reason = None
+
+        if reason is None:
+            self.paused_at = None
+        elif not self.paused:
+            self.paused_at = now
+        return reason
+
+
+class _RebalanceListener(ConsumerRebalanceListener):
+    """Коммитит watermark'и отзываемых партиций до передачи их другому поду"""
+
+    def __init__(self, consumer: "KafkaConsumer"):
+        self._consumer = consumer
+
+    async def on_partitions_revoked(self, revoked):
+        await self._consumer._on_partitions_revoked(revoked)
+
+    async def on_partitions_assigned(self, assigned):
+        pass
+
 
 class KafkaConsumer:
     """Фоновый потребитель Kafka-сообщений о перемещениях"""
 
-    def __init__(self):
+    def __init__(self, mode: str = settings.KAFKA_CONSUMER_MODE):
+        self.mode = mode
+        self.trackers: dict[TopicPartition, PartitionOffsetTracker] = {}
+        self.backpressure = Backpressure()
+        self._stopping = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        # Подряд неудачных попыток текущей пачки (режим batch)
+        self._batch_failures = 0
+        # Неудачные попытки сообщения по партициям: (offset, попыток) (single)
+        self._message_failures: dict[TopicPartition, tuple[int, int]] = {}
         self.consumer = AIOKafkaConsumer(
-            settings.KAFKA_TOPIC,
             bootstrap_servers=settings.KAFKA_BOOTSTRAP_SERVERS,
             group_id="warehouse-service-group",
             auto_offset_reset="earliest",
             enable_auto_commit=False,  # Ручное подтверждение после обработки
+            max_poll_records=settings.KAFKA_BATCH_MAX_RECORDS,
+            fetch_max_bytes=settings.KAFKA_BATCH_MAX_BYTES,
         )
+        self.consumer.subscribe(
+            [settings.KAFKA_TOPIC], listener=_RebalanceListener(self)
+        )
+
+    def start(self):
+        """Запускает цикл обработки фоновой задачей"""
+        self._task = asyncio.create_task(self.consume())
+
+    async def shutdown(self, timeout: float = settings.KAFKA_SHUTDOWN_TIMEOUT_SECONDS):
+        """
+        Останавливает чтение, дожидается обработки уже взятых записей и
+        коммитит их offset'ы. Если за timeout не успели — незавершенные
+        транзакции прерываются (откатываются), offset'ы завершенных
+        все равно коммитятся, а consumer покидает группу.
+        """
+        self._stopping.set()
+        try:
+            await asyncio.wait_for(self._task, timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Kafka consumer did not drain in %.0f s, aborted", timeout)
+        except Exception:
+            logger.error("Kafka consumer failed", exc_info=True)
 
     async def consume(self):
-        """Основной цикл обработки сообщений"""
+        """Основной цикл обработки сообщений (до вызова shutdown)"""
         await self.consumer.start()
         try:
-            async for msg in self.consumer:
-                try:
-                    message = self._parse_message(msg.value)
-                    async with get_scoped_session() as db:
-                        await process_movement_event(db, message)
-                        await db.commit()
-                        await self.consumer.commit()
-                except ValueError as e:
-                    logger.warning(f"Invalid message: {str(e)}")
-                except Exception as e:
-                    logger.error(f"Processing failed: {str(e)}", exc_info=True)
+            if self.mode == "batch":
+                await self._consume_batches()
+            elif self.mode == "parallel":
+                await self._consume_parallel()
+            else:
+                await self._consume_single()
         finally:
             await self.consumer.stop()
 
-    def _parse_message(self, raw_msg: bytes) -> KafkaMessageData:
-        """Парсинг и валидация сырого сообщения"""
+    async def _consume_single(self):
+        """Поштучная обработка: транзакция и commit offset'а на каждое сообщение"""
+        while not self._stopping.is_set():
+            batch = await self._poll_batch()
+            for records in batch.values():
+                for msg in records:
+                    # Непрочитанный остаток пачки перечитает следующий владелец
+                    if self._stopping.is_set():
+                        return
+                    # Остаток партиции перечитается с offset'а сбойного сообщения
+                    if not await self._process_message(msg):
+                        break
+
+    async def _process_message(self, msg: ConsumerRecord) -> bool:
+        """
+        Применяет одно сообщение своей транзакцией и коммитит его offset.
+        Невалидные сообщения пропускаются; при сбое транзакции партиция
+        возвращается к сообщению и возвращается False — оно будет повторено.
+        После KAFKA_MAX_RETRIES сбоев подряд сообщение пропускается
+        """
+        tp = TopicPartition(msg.topic, msg.partition)
+        position = {
+            "topic": msg.topic,
+            "partition": msg.partition,
+            "offset": msg.offset,
+        }
+        try:
+            message = self._parse_message(msg.value)
+            started = time.perf_counter()
+            with profile_sql("kafka message"):
+                async with cache_batch(), get_scoped_session() as db:
+                    await process_movement_event(db, message)
+                    await db.commit()
+            self.backpressure.observe(time.perf_counter() - started)
+            await self.consumer.commit({tp: msg.offset + 1})
+        except DuplicateEventError:
+            logger.debug("Skipping duplicate message", extra=position)
+        except POISON_ERRORS as e:
+            logger.warning("Invalid message: %s", e, extra=position)
+        except Exception:
+            offset, attempts = self._message_failures.get(tp, (msg.offset, 0))
+            attempts = attempts + 1 if offset == msg.offset else 1
+            if attempts >= settings.KAFKA_MAX_RETRIES:
+                logger.error(
+                    "Dropping message after %d failed attempts",
+                    attempts,
+                    exc_info=True,
+                    extra=position,
+                )
+                self._message_failures.pop(tp, None)
+                await self.consumer.commit({tp: msg.offset + 1})
+                return True
+            self._message_failures[tp] = (msg.offset, attempts)
+            logger.error("Processing failed, retrying", exc_info=True, extra=position)
+            # Без seek следующий commit offset'а перешагнул бы это сообщение
+            self.consumer.seek(tp, msg.offset)
+            await asyncio.sleep(RETRY_BACKOFF_SECONDS)
+            return False
+        self._message_failures.pop(tp, None)
+        return True
+
+    async def _consume_batches(self):
+        """Пакетная обработка: одна транзакция и один commit offset'ов на пачку"""
+        while not self._stopping.is_set():
+            batch = await self._poll_batch()
+            if batch:
+                await self._process_batch(batch)
+
+    async def _consume_parallel(self):
+        """
+        Параллельная обработка пулом из KAFKA_WORKERS воркеров.
+
+        Запись попадает к воркеру по хешу (warehouse_id, product_id): события
+        одной пары склад/товар обрабатываются по порядку, независимые пары —
+        конкурентно. Offset'ы коммитятся только непрерывным префиксом.
+        При остановке воркеры дорабатывают очереди, затем коммитится
+        достигнутый watermark.
+        """
+        queues = [
+            asyncio.Queue(maxsize=settings.KAFKA_WORKER_QUEUE_SIZE)
+            for _ in range(settings.KAFKA_WORKERS)
+        ]
+        workers = [asyncio.create_task(self._worker(queue)) for queue in queues]
+        try:
+            while not self._stopping.is_set():
+                batch = await self._poll_batch()
+                for tp, records in batch.items():
+                    tracker = self.trackers.setdefault(tp, PartitionOffsetTracker())
+                    for record in records:
+                        # Партицию могли отозвать, пока ждали места в очереди
+                        if tracker.revoked:
+                            break
+                        tracker.track(record.offset)
+                        position = f"{record.topic}[{record.partition}]@{record.offset}"
+                        try:
+                            event_data = self._parse_message(record.value)
+                        except ValueError as e:
+                            logger.warning("Invalid message %s: %s", position, e)
+                            tracker.done(record.offset)
+                            continue
+                        key = (event_data["warehouse_id"], event_data["product_id"])
+                        queue = queues[hash(key) % len(queues)]
+                        await queue.put((tracker, record.offset, event_data, position))
+                await self._commit_watermarks()
+            await asyncio.gather(*(queue.join() for queue in queues))
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            for tracker in self.trackers.values():
+                tracker.abandon()
+            # И при прерывании по таймауту остановки: завершенное не перечитается
+            try:
+                await self._commit_watermarks()
+            except Exception as e:
+                logger.warning("Failed to commit offsets on shutdown: %s", e)
+
+    async def _worker(self, queue: asyncio.Queue):
+        """Воркер: забирает накопившиеся записи и применяет их одной транзакцией"""
+        while True:
+            items = [await queue.get()]
+            while len(items) < settings.KAFKA_BATCH_MAX_RECORDS and not queue.empty():
+                items.append(queue.get_nowait())
+
+            # Записи отозванных партиций теперь обрабатывает новый владелец
+            events = [event for tracker, _, event, _ in items if not tracker.revoked]
+            positions = [pos for tracker, _, _, pos in items if not tracker.revoked]
+            # Порядок внутри ключа важен: при сбое транзакции повторяем ту же
+            # пачку, после KAFKA_MAX_RETRIES сбоев — по одному событию
+            attempt = 0
+            while events:
+                started = time.perf_counter()
+                attempt += 1
+                try:
+                    with profile_sql(f"kafka worker batch of {len(events)}"):
+                        async with cache_batch(), get_scoped_session() as db:
+                            await self._apply_events(db, events, positions)
+                            await db.commit()
+                    break
+                except Exception:
+                    if attempt >= settings.KAFKA_MAX_RETRIES:
+                        logger.error(
+                            "Worker batch of %d failed %d times, "
+                            "applying records one by one",
+                            len(events),
+                            attempt,
+                            exc_info=True,
+                        )
+                        await self._apply_individually(events, positions)
+                        break
+                    logger.error(
+                        "Worker batch of %d failed (attempt %d), retrying",
+                        len(events),
+                        attempt,
+                        exc_info=True,
+                    )
+                    await asyncio.sleep(RETRY_BACKOFF_SECONDS)
+                finally:
+                    self.backpressure.observe(time.perf_counter() - started)
+
+            for tracker, offset, _, _ in items:
+                tracker.done(offset)
+                queue.task_done()
+
+    async def _commit_watermarks(self, partitions=None):
+        """Коммитит продвинувшиеся watermark'и партиций"""
+        offsets = {
+            tp: tracker.watermark
+            for tp, tracker in self.trackers.items()
+            if (partitions is None or tp in partitions)
+            and tracker.watermark is not None
+            and tracker.watermark != tracker.committed
+        }
+        if not offsets:
+            return
+        await self.consumer.commit(offsets)
+        for tp, offset in offsets.items():
+            self.trackers[tp].committed = offset
+
+    async def _on_partitions_revoked(self, revoked):
+        """
+        Перед ребалансом дожидается обработки записей отзываемых партиций,
+        уже отданных воркерам, фиксирует watermark'и и забывает партиции.
+        Новый владелец начнет с закоммиченного offset'а, поэтому записи,
+        не обработанные за KAFKA_SHUTDOWN_TIMEOUT_SECONDS, здесь пропускаются.
+        """
+        if self.mode != "parallel" or not revoked:
+            return
+        trackers = [self.trackers[tp] for tp in revoked if tp in self.trackers]
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(tracker.wait_drained() for tracker in trackers)),
+                settings.KAFKA_SHUTDOWN_TIMEOUT_SECONDS,
+            )
+        except asyncio.TimeoutError:
+            logger.warning(
+                "Revoked partitions not drained in %.0f s, dropping queued records",
+                settings.KAFKA_SHUTDOWN_TIMEOUT_SECONDS,
+            )
+        for tracker in trackers:
+            tracker.revoked = True
+        try:
+            await self._commit_watermarks(set(revoked))
+        except Exception as e:
+            logger.warning("Failed to commit offsets on revoke: %s", e)
+        for tp in revoked:
+            self.trackers.pop(tp, None)
+
+    async def _poll_batch(self) -> dict[TopicPartition, list[ConsumerRecord]]:
+        """Набирает пачку до KAFKA_BATCH_MAX_RECORDS записей / KAFKA_BATCH_MAX_BYTES
+        байт, ожидая не дольше KAFKA_BATCH_LINGER_MS. Из приостановленных
+        backpressure партиций записи не читаются, но опрос (и heartbeat
+        группы) продолжается"""
+        self._apply_backpressure()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.KAFKA_BATCH_LINGER_MS / 1000
+        batch: dict[TopicPartition, list[ConsumerRecord]] = {}
+        count = size = 0
+
+        while (
+            count < settings.KAFKA_BATCH_MAX_RECORDS
+            and size < settings.KAFKA_BATCH_MAX_BYTES
+        ):
+            remaining_ms = int((deadline - loop.time()) * 1000)
+            if remaining_ms <= 0:
+                break
+            fetched = await self.consumer.getmany(
+                timeout_ms=remaining_ms,
+                max_records=settings.KAFKA_BATCH_MAX_RECORDS - count,
+            )
+            for tp, records in fetched.items():
+                batch.setdefault(tp, []).extend(records)
+                count += len(records)
+                size += sum(len(record.value or b"") for record in records)
+
+        if count:
+            CONSUMER_BATCH_SIZE.observe(count)
+        for tp, records in batch.items():
+            self._record_lag(tp, records[-1].offset + 1)
+        return batch
+
+    def _apply_backpressure(self):
+        """Приостанавливает или возобновляет чтение назначенных партиций"""
+        in_flight = sum(tracker.in_flight for tracker in self.trackers.values())
+        was_paused = self.backpressure.paused
+        reason = self.backpressure.check(
+            in_flight, pool_usage(), asyncio.get_running_loop().time()
+        )
+        if reason is not None:
+            # Повторно — для партиций, назначенных после ребаланса
+            self.consumer.pause(*self.consumer.assignment())
+            if not was_paused:
+                logger.warning(
+                    "Pausing consumption: %s",
+                    reason,
+                    extra={
+                        "in_flight": in_flight,
+                        "db_latency_ms": round(self.backpressure.latency * 1000),
+                    },
+                )
+        elif was_paused:
+            self.consumer.resume(*self.consumer.paused())
+            logger.info("Resuming consumption")
+        CONSUMER_PAUSED.set(0 if reason is None else 1)
+
+    def _record_lag(self, tp: TopicPartition, next_offset: int):
+        """Отставание партиции: записей между прочитанным и концом партиции"""
+        # Партицию могли отозвать ребалансом, пока пачка набиралась
+        if tp not in self.consumer.assignment():
+            return
+        highwater = self.consumer.highwater(tp)
+        if highwater is not None:
+            CONSUMER_LAG.labels(tp.topic, tp.partition).set(highwater - next_offset)
+
+    async def _process_batch(self, batch: dict[TopicPartition, list[ConsumerRecord]]):
+        """
+        Применяет пачку в одной транзакции и коммитит максимальные offset'ы.
+        Все операции с кэшем за пачку уходят в Redis одним pipeline. При сбое
+        пачка перечитывается; после KAFKA_MAX_RETRIES сбоев подряд записи
+        применяются по одной (_apply_individually).
+        """
+        count = sum(len(records) for records in batch.values())
+        started = time.perf_counter()
         try:
-            data = json.loads(raw_msg.decode("utf-8"))
-            return KafkaMessageData(**data)
+            with profile_sql(f"kafka batch of {count}"):
+                async with cache_batch(), get_scoped_session() as db:
+                    await self._apply_batch(db, batch)
+                    await db.commit()
+        except Exception:
+            self._batch_failures += 1
+            if self._batch_failures < settings.KAFKA_MAX_RETRIES:
+                logger.error(
+                    "Batch of %d failed (attempt %d), rewinding",
+                    count,
+                    self._batch_failures,
+                    exc_info=True,
+                )
+                # Возвращаемся к началу пачки, чтобы перечитать её целиком
+                for tp, records in batch.items():
+                    self.consumer.seek(tp, records[0].offset)
+                await asyncio.sleep(RETRY_BACKOFF_SECONDS)
+                return
+            logger.error(
+                "Batch of %d failed %d times, applying records one by one",
+                count,
+                self._batch_failures,
+                exc_info=True,
+            )
+            await self._apply_individually(*self._batch_events(batch))
+        finally:
+            self.backpressure.observe(time.perf_counter() - started)
+
+        self._batch_failures = 0
+        await self.consumer.commit(
+            {tp: records[-1].offset + 1 for tp, records in batch.items()}
+        )
+
+    async def _apply_batch(
+        self, db: AsyncSession, batch: dict[TopicPartition, list[ConsumerRecord]]
+    ):
+        """Разбирает записи пачки и применяет их через пакетный обработчик"""
+        await self._apply_events(db, *self._batch_events(batch))
+
+    def _batch_events(
+        self, batch: dict[TopicPartition, list[ConsumerRecord]]
+    ) -> tuple[list[dict], list[str]]:
+        """События пачки и их позиции; невалидные записи пропускаются"""
+        events, positions = [], []
+        for records in batch.values():
+            for record in records:
+                position = f"{record.topic}[{record.partition}]@{record.offset}"
+                try:
+                    events.append(self._parse_message(record.value))
+                    positions.append(position)
+                except ValueError as e:
+                    logger.warning("Invalid message %s: %s", position, e)
+        return events, positions
+
+    async def _apply_individually(self, events: list[dict], positions: list[str]):
+        """
+        Последняя попытка после KAFKA_MAX_RETRIES сбоев: каждое событие своей
+        транзакцией. Событие, которое все еще падает, пропускается с ошибкой
+        в логе, чтобы не останавливать партицию навсегда
+        """
+        for event, position in zip(events, positions):
+            try:
+                async with cache_batch(), get_scoped_session() as db:
+                    await self._apply_events(db, [event], [position])
+                    await db.commit()
+            except Exception:
+                logger.error(
+                    "Dropping message %s after %d failed attempts",
+                    position,
+                    settings.KAFKA_MAX_RETRIES,
+                    exc_info=True,
+                )
+
+    async def _apply_events(
+        self, db: AsyncSession, events: list[dict], positions: list[str]
+    ):
+        """Применяет события; отклоненные пропускаются с записью в лог"""
+        results = await apply_movement_events(db, events)
+        for result, position in zip(results, positions):
+            if result.duplicate:
+                logger.debug("Skipping duplicate message %s", position)
+            elif not result.ok:
+                logger.warning("Skipping message %s: %s", position, result.error)
+
+    def _parse_message(self, raw_msg: bytes) -> dict:
+        """Парсинг и валидация сырого сообщения (CloudEvent или только data-часть)"""
+        try:
+            data = json.loads((raw_msg or b"").decode("utf-8"))
+            # null, числа, строки и массивы — тоже валидный JSON
+            if not isinstance(data, dict):
+                raise ValueError(f"Expected a JSON object, got {type(data).__name__}")
+            if "data" in data:
+                return KafkaFullMessage(**data).to_event_data()
+            return KafkaMessageData(**data).model_dump(mode="json")
         except (json.JSONDecodeError, ValueError) as e:
             raise ValueError(f"Invalid message format: {str(e)}")
 
-
-async def run_consumer():
-    """Запуск потребителя (вызывается при старте приложения)"""
-    consumer = KafkaConsumer()
-    await consumer.consume()
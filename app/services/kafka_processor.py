@@ -1,93 +1,470 @@
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Iterable, NamedTuple, Optional
+
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from app.db.models import Movement, StockItem, Warehouse, Product, MovementStatus
-from uuid import UUID
+from sqlalchemy import (
+    select,
+    update,
+    tuple_,
+    any_,
+    bindparam,
+    literal_column,
+    text,
+    true,
+    ARRAY,
+)
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from app.db.models import (
+    Movement,
+    StockItem,
+    Warehouse,
+    Product,
+    MovementStatus,
+    ProcessedEvent,
+)
+from app.db.models.warehouse import WAREHOUSE_CODE_RE
+from app.db.session import after_commit
+from uuid import UUID, uuid4
 import logging
-from datetime import datetime
-
+import time
+from datetime import datetime, timezone
+
+from app.config import settings
+from app.services.id_registry import (
+    warehouse_registry,
+    product_registry,
+    processed_event_registry,
+)
+from app.metrics import EVENT_PROCESSING_SECONDS
+from app.services.rollups import record_completed_movements
+from app.services.stock_ledger import StockChange, record_stock_changes
 from app.services.redis import (
+    existing_markers,
+    get_processed_event_cache_key,
     get_stock_cache_key,
     invalidate_cache,
     get_movement_cache_key,
+    schedule_cache_write_if_newer,
+    schedule_markers,
 )
 
 logger = logging.getLogger(__name__)
 
+# Гистограммы по типам событий; invalid — событие не разобрано
+_EVENT_SECONDS = {
+    event_type: EVENT_PROCESSING_SECONDS.labels(event_type)
+    for event_type in ("departure", "arrival", "invalid")
+}
+
+# Ошибки данных: событие отклоняется, остальная пачка применяется
+POISON_ERRORS = (ValueError, IntegrityError, DataError)
+
+
+# Предикаты частичных индексов непарных перемещений. Статус подставляется
+# литералом: с параметром обобщенный план prepared-запроса индекс не использует.
+# Флаг сравнивается с true: предикат индекса из IS TRUE не выводится
+IN_TRANSIT = Movement.status == literal_column("'IN_TRANSIT'")
+AWAITING_DEPARTURE = Movement.awaiting_departure == true()
+
+
+class DuplicateEventError(ValueError):
+    """Событие (movement_id, event) уже было применено"""
+
+
+class MovementEvent(NamedTuple):
+    """Провалидированное событие перемещения"""
+
+    movement_id: UUID
+    warehouse_id: UUID
+    product_id: UUID
+    quantity: int
+    timestamp: datetime
+    event_type: str
+    warehouse_code: str
+    message_id: Optional[UUID] = None
+
+    @property
+    def key(self) -> str:
+        """Ключ идемпотентности"""
+        return f"{self.movement_id}:{self.event_type}"
+
+
+@dataclass
+class MovementEventResult:
+    """Результат обработки одного события в пакетном режиме"""
+
+    movement: Optional[Movement] = None
+    error: Optional[str] = None
+    duplicate: bool = False
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
 
 async def process_movement_event(db: AsyncSession, event_data: dict) -> Movement:
     """Основной обработчик событий перемещения"""
+    started = time.perf_counter()
+    event_type = "invalid"
     try:
-        # Валидация и преобразование UUID
-        movement_id = _validate_uuid(event_data.get("movement_id"), "movement_id")
-        warehouse_id = _validate_uuid(event_data.get("warehouse_id"), "warehouse_id")
-        product_id = _validate_uuid(event_data.get("product_id"), "product_id")
-        quantity = _validate_quantity(event_data.get("quantity"))
-        timestamp = _validate_timestamp(event_data.get("timestamp"))
-        event_type = event_data.get("event")
-
-        # Получаем или создаем сущности
-        warehouse = await _get_or_create_warehouse(
-            db,
-            warehouse_id,
-            event_data.get("warehouse_code", f"WH-{str(warehouse_id)[:4]}"),
+        event = _parse_event(event_data)
+        if event.event_type not in ("departure", "arrival"):
+            raise ValueError(f"Unknown event type: {event.event_type}")
+        event_type = event.event_type
+
+        # Повтор отсекается до любых изменений
+        await _claim_event(db, event)
+
+        # Гарантируем наличие справочных сущностей
+        warehouse_id = await _ensure_warehouse(
+            db, event.warehouse_id, event.warehouse_code
         )
-        product = await _get_or_create_product(db, product_id)
+        product_id = await _ensure_product(db, event.product_id)
+        await _lock_movements(db, [event.movement_id])
 
         # Обработка события
-        if event_type == "departure":
+        if event.event_type == "departure":
             return await _process_departure(
-                db, movement_id, warehouse, product, quantity, timestamp
+                db,
+                event.movement_id,
+                warehouse_id,
+                product_id,
+                event.quantity,
+                event.timestamp,
+            )
+        return await _process_arrival(
+            db,
+            event.movement_id,
+            warehouse_id,
+            product_id,
+            event.quantity,
+            event.timestamp,
+        )
+    finally:
+        # Ошибки не логируются здесь: их с контекстом пишет вызывающий код
+        _EVENT_SECONDS[event_type].observe(time.perf_counter() - started)
+
+
+async def apply_movement_events(
+    db: AsyncSession, events: list[dict]
+) -> list[MovementEventResult]:
+    """
+    Применяет пачку событий, изолируя ошибки данных в SAVEPOINT'ах:
+    сначала пакетным обработчиком, при сбое записи — поштучно.
+    """
+    try:
+        async with db.begin_nested():
+            return await process_movement_events(db, events)
+    except POISON_ERRORS as e:
+        logger.warning("Bulk apply failed, processing one by one: %s", e)
+
+    results = []
+    for event_data in events:
+        try:
+            async with db.begin_nested():
+                movement = await process_movement_event(db, event_data)
+            results.append(MovementEventResult(movement=movement))
+        except DuplicateEventError as e:
+            results.append(MovementEventResult(error=str(e), duplicate=True))
+        except POISON_ERRORS as e:
+            results.append(MovementEventResult(error=str(e)))
+    return results
+
+
+async def process_movement_events(
+    db: AsyncSession, events: list[dict]
+) -> list[MovementEventResult]:
+    """
+    Пакетный обработчик событий перемещения.
+
+    Результат совпадает с последовательным вызовом process_movement_event для
+    каждого события, но число запросов к БД не зависит от размера пачки:
+    - склады и товары резолвятся одним SELECT и одним INSERT ... ON CONFLICT
+    - непарные половины перемещений ищутся по частичным индексам одним
+      запросом kafka_movement_id = ANY(...) для приемок и для отгрузок
+    - остатки блокируются одним SELECT ... FOR UPDATE, изменяются одним upsert
+
+    Отклоненные события (невалидные данные, нехватка остатка) не прерывают
+    пачку — ошибка возвращается в соответствующем MovementEventResult.
+    Время обработки делится поровну между событиями пачки.
+    """
+    started = time.perf_counter()
+    results = [MovementEventResult() for _ in events]
+    event_types = ["invalid"] * len(events)
+    accepted: list[tuple[int, MovementEvent]] = []
+    for index, event_data in enumerate(events):
+        try:
+            event = _parse_event(event_data)
+            if event.event_type not in ("departure", "arrival"):
+                raise ValueError(f"Unknown event type: {event.event_type}")
+            accepted.append((index, event))
+            event_types[index] = event.event_type
+        except ValueError as e:
+            results[index].error = str(e)
+
+    # 0. Идемпотентность: примененные ранее события не трогают остатки
+    accepted = await _skip_processed(db, accepted, results)
+
+    # 1. Справочники: склады и товары
+    warehouse_codes = {}
+    for _, event in accepted:
+        warehouse_codes.setdefault(str(event.warehouse_id), event.warehouse_code)
+    failed = await _ensure_warehouses(db, warehouse_codes)
+    failed.update(
+        await _ensure_products(db, {str(event.product_id) for _, event in accepted})
+    )
+    if failed:
+        for index, event in accepted:
+            error = failed.get(str(event.warehouse_id)) or failed.get(
+                str(event.product_id)
             )
-        elif event_type == "arrival":
-            return await _process_arrival(
-                db, movement_id, warehouse, product, quantity, timestamp
+            if error:
+                results[index].error = error
+        accepted = [(i, e) for i, e in accepted if results[i].ok]
+
+    # 2. Непарные половины: отгрузки, ожидающие приемки, и приемки,
+    # пришедшие раньше своей отгрузки
+    await _lock_movements(db, (event.movement_id for _, event in accepted))
+    in_transit: dict[str, list[Movement]] = defaultdict(list)
+    awaiting_departure: dict[str, list[Movement]] = defaultdict(list)
+    persisted_ids: set[str] = set()
+    arrival_ids = {
+        str(event.movement_id) for _, event in accepted if event.event_type == "arrival"
+    }
+    departure_ids = {
+        str(e.movement_id) for _, e in accepted if e.event_type == "departure"
+    }
+    if arrival_ids:
+        stmt = select(Movement).where(
+            _any(Movement.kafka_movement_id, arrival_ids) & IN_TRANSIT
+        )
+        for movement in (await db.scalars(stmt)).all():
+            in_transit[str(movement.kafka_movement_id)].append(movement)
+            persisted_ids.add(movement.id)
+    if departure_ids:
+        stmt = select(Movement).where(
+            _any(Movement.kafka_movement_id, departure_ids) & AWAITING_DEPARTURE
+        )
+        for movement in (await db.scalars(stmt)).all():
+            awaiting_departure[str(movement.kafka_movement_id)].append(movement)
+            persisted_ids.add(movement.id)
+
+    # 3. Текущие остатки (с блокировкой строк до конца транзакции)
+    pairs = {(str(e.warehouse_id), str(e.product_id)) for _, e in accepted}
+    balances: dict[tuple[str, str], int] = {}
+    versions: dict[tuple[str, str], int] = {}
+    if pairs:
+        stmt = (
+            select(
+                StockItem.warehouse_id,
+                StockItem.product_id,
+                StockItem.quantity,
+                StockItem.version,
             )
+            .where(tuple_(StockItem.warehouse_id, StockItem.product_id).in_(pairs))
+            .order_by(StockItem.warehouse_id, StockItem.product_id)
+            .with_for_update()
+        )
+        for warehouse_id, product_id, quantity, version in await db.execute(stmt):
+            balances[(str(warehouse_id), str(product_id))] = quantity
+            versions[(str(warehouse_id), str(product_id))] = version
+
+    # 4. Применяем события по порядку к состоянию в памяти
+    deltas: dict[tuple[str, str], int] = defaultdict(int)
+    updated_movements: list[Movement] = []
+    completed: list[Movement] = []
+    claimed: dict[str, MovementEvent] = {}
+    for index, event in accepted:
+        if event.key in claimed:
+            results[index].error = f"Duplicate event: {event.key}"
+            results[index].duplicate = True
+            continue
+        warehouse_id, product_id = str(event.warehouse_id), str(event.product_id)
+        pair = (warehouse_id, product_id)
+        kafka_id = str(event.movement_id)
+
+        if event.event_type == "departure":
+            available = balances.get(pair, 0)
+            if available < event.quantity:
+                results[index].error = (
+                    f"Insufficient stock. Product: {product_id}, "
+                    f"Available: {available}, Requested: {event.quantity}"
+                )
+                continue
+            candidates = awaiting_departure.get(kafka_id, [])
+            if len(candidates) > 1:
+                results[index].error = f"Multiple unmatched arrivals: {kafka_id}"
+                continue
+            if candidates:
+                movement = candidates[0]
+                if str(movement.destination_warehouse_id) == warehouse_id:
+                    results[index].error = (
+                        "Arrival warehouse must differ from departure warehouse"
+                    )
+                    continue
+                movement.source_warehouse_id = warehouse_id
+                movement.awaiting_departure = False
+                movement.departure_time = event.timestamp
+                movement.quantity_diff = event.quantity - movement.quantity
+                movement.quantity = event.quantity
+                del awaiting_departure[kafka_id]
+                completed.append(movement)
+                if movement.id in persisted_ids:
+                    updated_movements.append(movement)
+            else:
+                movement = Movement(
+                    id=str(uuid4()),
+                    kafka_movement_id=kafka_id,
+                    recorded_at=event.timestamp,
+                    source_warehouse_id=warehouse_id,
+                    product_id=product_id,
+                    quantity=event.quantity,
+                    departure_time=event.timestamp,
+                    status=MovementStatus.IN_TRANSIT,
+                    quantity_diff=None,
+                )
+                db.add(movement)
+                in_transit[kafka_id].append(movement)
+            balances[pair] = available - event.quantity
+            deltas[pair] -= event.quantity
         else:
-            raise ValueError(f"Unknown event type: {event_type}")
-    except Exception as e:
-        logger.error(f"Failed to process movement event: {str(e)}", exc_info=True)
-        raise
+            candidates = in_transit.get(kafka_id, [])
+            if len(candidates) > 1:
+                results[index].error = f"Multiple in-transit movements: {kafka_id}"
+                continue
+            if candidates:
+                movement = candidates[0]
+                if str(movement.source_warehouse_id) == warehouse_id:
+                    results[index].error = (
+                        "Arrival warehouse must differ from departure warehouse"
+                    )
+                    continue
+                movement.destination_warehouse_id = warehouse_id
+                movement.arrival_time = event.timestamp
+                movement.status = MovementStatus.COMPLETED
+                movement.quantity_diff = movement.quantity - event.quantity
+                del in_transit[kafka_id]
+                completed.append(movement)
+                if movement.id in persisted_ids:
+                    updated_movements.append(movement)
+            else:
+                movement = Movement(
+                    id=str(uuid4()),
+                    kafka_movement_id=kafka_id,
+                    recorded_at=event.timestamp,
+                    destination_warehouse_id=warehouse_id,
+                    product_id=product_id,
+                    quantity=event.quantity,
+                    arrival_time=event.timestamp,
+                    status=MovementStatus.COMPLETED,
+                    quantity_diff=0,
+                    awaiting_departure=True,
+                )
+                db.add(movement)
+                awaiting_departure[kafka_id].append(movement)
+            balances[pair] = balances.get(pair, 0) + event.quantity
+            deltas[pair] += event.quantity
+
+        results[index].movement = movement
+        claimed[event.key] = event
+
+    # 5. Запись: ключи идемпотентности, INSERT/UPDATE перемещений одним flush,
+    # агрегаты завершенных перемещений и остатки — каждые одним upsert
+    await _claim_events(db, list(claimed.values()))
+    await db.flush()
+    await record_completed_movements(db, completed)
+    stock = await _apply_stock_deltas(db, deltas, balances, versions)
+    await record_stock_changes(
+        db,
+        [
+            StockChange(*pair, deltas[pair], quantity, version)
+            for pair, (quantity, version) in sorted(stock.items())
+        ],
+    )
+
+    for (warehouse_id, product_id), (quantity, version) in stock.items():
+        await _sync_stock_cache(db, warehouse_id, product_id, quantity, version)
+    await invalidate_cache(*[get_movement_cache_key(m.id) for m in updated_movements])
+
+    # Сбой пачки не учитывается: события пройдут поштучно
+    # через process_movement_event и будут учтены там
+    if events:
+        share = (time.perf_counter() - started) / len(events)
+        for event_type in event_types:
+            _EVENT_SECONDS[event_type].observe(share)
+
+    processed = sum(1 for result in results if result.ok)
+    logger.info(
+        "Processed movement batch. Accepted: %d, Rejected: %d",
+        processed,
+        len(results) - processed,
+    )
+    return results
 
 
 async def _process_departure(
     db: AsyncSession,
     movement_id: UUID,
-    warehouse: Warehouse,
-    product: Product,
+    warehouse_id: str,
+    product_id: str,
     quantity: int,
     timestamp: datetime,
 ) -> Movement:
     """Обработка отгрузки товара"""
-    # Проверяем остатки
-    stock = await _get_stock_item(db, warehouse.id, product.id)
-    if stock.quantity < 0 or stock.quantity < quantity:
+    # Списываем остаток атомарно: UPDATE выполнится только при достаточном остатке
+    stock = await _decrease_stock(db, warehouse_id, product_id, quantity)
+    if stock is None:
+        available = await _get_stock_quantity(db, warehouse_id, product_id)
         raise ValueError(
-            f"Insufficient stock. Product: {product.id}, "
-            f"Available: {stock.quantity}, Requested: {quantity}"
+            f"Insufficient stock. Product: {product_id}, "
+            f"Available: {available}, Requested: {quantity}"
         )
 
-    # Создаем запись о перемещении
-    movement = Movement(
-        kafka_movement_id=movement_id,
-        source_warehouse_id=warehouse.id,
-        product_id=product.id,
-        quantity=quantity,
-        departure_time=timestamp,
-        status=MovementStatus.IN_TRANSIT,
-        quantity_diff=None,  # Для departure всегда NULL
+    # Приемка могла прийти раньше отгрузки: тогда дополняем ее запись
+    stmt = select(Movement).where(
+        (Movement.kafka_movement_id == movement_id) & AWAITING_DEPARTURE
     )
-    db.add(movement)
-
-    # Обновляем остатки
-    stock.quantity -= quantity
+    arrivals = (await db.scalars(stmt)).all()
+    if len(arrivals) > 1:
+        raise ValueError(f"Multiple unmatched arrivals: {movement_id}")
+
+    if arrivals:
+        movement = arrivals[0]
+        if str(movement.destination_warehouse_id) == str(warehouse_id):
+            raise ValueError("Arrival warehouse must differ from departure warehouse")
+        movement.source_warehouse_id = warehouse_id
+        movement.awaiting_departure = False
+        movement.departure_time = timestamp
+        movement.quantity_diff = quantity - movement.quantity
+        movement.quantity = quantity
+    else:
+        # Создаем запись о перемещении
+        movement = Movement(
+            kafka_movement_id=movement_id,
+            recorded_at=timestamp,
+            source_warehouse_id=warehouse_id,
+            product_id=product_id,
+            quantity=quantity,
+            departure_time=timestamp,
+            status=MovementStatus.IN_TRANSIT,
+            quantity_diff=None,  # Для departure всегда NULL
+        )
+        db.add(movement)
     await db.flush()
 
-    stock_cache_key = get_stock_cache_key(warehouse.id, product.id)
-    await invalidate_cache(stock_cache_key)
+    await record_stock_changes(
+        db, [StockChange(warehouse_id, product_id, -quantity, *stock)]
+    )
+    await _sync_stock_cache(db, warehouse_id, product_id, *stock)
+    if arrivals:
+        await record_completed_movements(db, [movement])
+        await invalidate_cache(get_movement_cache_key(movement.id))
 
     logger.info(
-        f"Processed departure. Movement: {movement_id}, "
-        f"Warehouse: {warehouse.id}, Quantity: {quantity}"
+        "Processed departure",
+        extra=_event_context(movement_id, warehouse_id, product_id, quantity),
     )
     return movement
 
@@ -95,118 +472,503 @@ async def _process_departure(
 async def _process_arrival(
     db: AsyncSession,
     movement_id: UUID,
-    warehouse: Warehouse,
-    product: Product,
+    warehouse_id: str,
+    product_id: str,
     quantity: int,
     timestamp: datetime,
 ) -> Movement:
     """Обработка поступления товара"""
     # 1. Находим соответствующую отгрузку (departure)
-    try:
-        stmt = select(Movement).where(
-            (Movement.kafka_movement_id == movement_id)
-            & (Movement.status == MovementStatus.IN_TRANSIT)
-        )
-        result = await db.execute(stmt)
-        departure_movement = result.scalar_one_or_none()
-
-        # 2. Рассчитываем расхождение (только если есть departure)
-        qty_diff = (departure_movement.quantity - quantity) if departure_movement else 0
-        movement_updated = False
-
-        # 3. Обновляем/создаем запись
-        if departure_movement:
-            # Проверяем, что arrival пришел на другой склад
-            if departure_movement.source_warehouse_id == warehouse.id:
-                raise ValueError(
-                    "Arrival warehouse must differ from departure warehouse"
-                )
-            # Обновляем существующую запись
-            departure_movement.destination_warehouse_id = warehouse.id
-            departure_movement.arrival_time = timestamp
-            departure_movement.status = MovementStatus.COMPLETED
-            departure_movement.quantity_diff = qty_diff  # Фиксация расхождения
-            movement = departure_movement  # 0 для прямых поставок
-            movement_updated = True
-        else:
-            # Создаем новую запись (если не было departure)
-            movement = Movement(
-                kafka_movement_id=movement_id,
-                destination_warehouse_id=warehouse.id,
-                product_id=product.id,
-                quantity=quantity,
-                arrival_time=timestamp,
-                status=MovementStatus.COMPLETED,
-                quantity_diff=0,
-            )
-            db.add(movement)
+    stmt = select(Movement).where(
+        (Movement.kafka_movement_id == movement_id) & IN_TRANSIT
+    )
+    result = await db.execute(stmt)
+    departure_movement = result.scalar_one_or_none()
+
+    # 2. Рассчитываем расхождение (только если есть departure)
+    qty_diff = (departure_movement.quantity - quantity) if departure_movement else 0
+    movement_updated = False
+
+    # 3. Обновляем/создаем запись
+    if departure_movement:
+        # Проверяем, что arrival пришел на другой склад
+        if str(departure_movement.source_warehouse_id) == str(warehouse_id):
+            raise ValueError("Arrival warehouse must differ from departure warehouse")
+        # Обновляем существующую запись
+        departure_movement.destination_warehouse_id = warehouse_id
+        departure_movement.arrival_time = timestamp
+        departure_movement.status = MovementStatus.COMPLETED
+        departure_movement.quantity_diff = qty_diff  # Фиксация расхождения
+        movement = departure_movement  # 0 для прямых поставок
+        movement_updated = True
+    else:
+        # Создаем новую запись (если не было departure): ее дополнит
+        # отгрузка, если она придет позже
+        movement = Movement(
+            kafka_movement_id=movement_id,
+            recorded_at=timestamp,
+            destination_warehouse_id=warehouse_id,
+            product_id=product_id,
+            quantity=quantity,
+            arrival_time=timestamp,
+            status=MovementStatus.COMPLETED,
+            quantity_diff=0,
+            awaiting_departure=True,
+        )
+        db.add(movement)
 
-        # Обновляем остатки
-        stock = await _get_stock_item(db, warehouse.id, product.id)
-        stock.quantity += quantity
-        await db.flush()
+    await db.flush()
+
+    # Обновляем остатки и их кэш
+    stock = await _increase_stock(db, warehouse_id, product_id, quantity)
+    await record_stock_changes(
+        db, [StockChange(warehouse_id, product_id, quantity, *stock)]
+    )
+    await _sync_stock_cache(db, warehouse_id, product_id, *stock)
 
-        # Инвалидация кэша остатков
-        stock_cache_key = get_stock_cache_key(warehouse.id, product.id)
-        keys_to_invalidate = [stock_cache_key]
+    # Если arrival обновил существующий movement, инвалидируем его кэш тоже
+    # Исходя из кода get_movement, API принимает movement.id (внутренний ID).
+    if movement_updated:
+        await record_completed_movements(db, [movement])
+        await invalidate_cache(get_movement_cache_key(movement.id))
 
-        # Если arrival обновил существующий movement, инвалидируем его кэш тоже
-        # Исходя из кода get_movement, API принимает movement.id (внутренний ID).
-        if movement_updated:
-            movement_cache_key = get_movement_cache_key(movement.id)
-            keys_to_invalidate.append(movement_cache_key)
+    logger.info(
+        "Processed arrival",
+        extra=_event_context(movement_id, warehouse_id, product_id, quantity),
+    )
+    return movement
 
-        await invalidate_cache(*keys_to_invalidate)
 
-        logger.info(
-            f"Processed arrival. Movement: {movement_id}, "
-            f"Warehouse: {warehouse.id}, Quantity: {quantity}"
+async def _decrease_stock(
+    db: AsyncSession, warehouse_id: UUID, product_id: UUID, quantity: int
+) -> Optional[tuple[int, int]]:
+    """
+    Списывает остаток одним условным UPDATE.
+    Возвращает (остаток, версия); None — остатка недостаточно.
+    """
+    stmt = (
+        update(StockItem)
+        .where(
+            (StockItem.warehouse_id == warehouse_id)
+            & (StockItem.product_id == product_id)
+            & (StockItem.quantity >= quantity)
+        )
+        .values(
+            quantity=StockItem.quantity - quantity, version=StockItem.version + 1
         )
-        return movement
-    except Exception as e:
-        logger.error(f"Arrival processing failed: {str(e)}", exc_info=True)
-        raise
+        .returning(StockItem.quantity, StockItem.version)
+        .execution_options(synchronize_session=False)
+    )
+    result = await db.execute(stmt)
+    row = result.one_or_none()
+    return tuple(row) if row else None
+
+
+async def _increase_stock(
+    db: AsyncSession, warehouse_id: UUID, product_id: UUID, quantity: int
+) -> tuple[int, int]:
+    """Пополняет остаток одним upsert; возвращает (остаток, версия)"""
+    stmt = pg_insert(StockItem).values(
+        id=str(uuid4()),
+        warehouse_id=warehouse_id,
+        product_id=product_id,
+        quantity=quantity,
+        version=1,
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[StockItem.warehouse_id, StockItem.product_id],
+        set_={
+            "quantity": StockItem.quantity + stmt.excluded.quantity,
+            "version": StockItem.version + 1,
+        },
+    ).returning(StockItem.quantity, StockItem.version)
+    result = await db.execute(stmt)
+    return tuple(result.one())
 
 
-async def _get_stock_item(
+async def _sync_stock_cache(
+    db: AsyncSession,
+    warehouse_id: UUID,
+    product_id: UUID,
+    quantity: int,
+    version: int,
+):
+    """
+    Синхронизирует кэш остатка с БД.
+    Write-through: после COMMIT в Redis пишется новое значение с версией,
+    устаревшая запись не перезапишет более новую. Иначе ключ удаляется.
+    """
+    key = get_stock_cache_key(warehouse_id, product_id)
+    if not settings.STOCK_CACHE_WRITE_THROUGH:
+        await invalidate_cache(key)
+        return
+    value = {
+        "warehouse_id": str(warehouse_id),
+        "product_id": str(product_id),
+        "quantity": quantity,
+    }
+    after_commit(db, lambda: schedule_cache_write_if_newer(key, value, version))
+
+
+async def _get_stock_quantity(
     db: AsyncSession, warehouse_id: UUID, product_id: UUID
-) -> StockItem:
-    """Получаем или создаем запись об остатках"""
-    stmt = select(StockItem).where(
+) -> int:
+    """Текущий остаток (только для диагностики отказа в списании)"""
+    stmt = select(StockItem.quantity).where(
         (StockItem.warehouse_id == warehouse_id) & (StockItem.product_id == product_id)
     )
     result = await db.execute(stmt)
-    stock = result.scalar_one_or_none()
+    return result.scalar_one_or_none() or 0
+
+
+async def _ensure_warehouse(db: AsyncSession, warehouse_id: UUID, code: str) -> str:
+    """Гарантирует наличие склада; известные ID не требуют обращения к БД"""
+    if warehouse_registry.known(warehouse_id):
+        return str(warehouse_id)
+    if code and WAREHOUSE_CODE_RE.match(code):
+        stmt = (
+            pg_insert(Warehouse)
+            .values(id=str(warehouse_id), code=code)
+            .on_conflict_do_nothing(index_elements=[Warehouse.id])
+        )
+        await db.execute(stmt)
+    elif await db.get(Warehouse, str(warehouse_id)) is None:
+        # Создать склад с таким кодом нельзя, существующий — используем
+        _validate_warehouse_code(code)
+    after_commit(db, lambda: warehouse_registry.add(warehouse_id))
+    return str(warehouse_id)
+
+
+async def _ensure_product(db: AsyncSession, product_id: UUID) -> str:
+    """Гарантирует наличие товара; известные ID не требуют обращения к БД"""
+    if product_registry.known(product_id):
+        return str(product_id)
+    stmt = (
+        pg_insert(Product)
+        .values(id=str(product_id))
+        .on_conflict_do_nothing(index_elements=[Product.id])
+    )
+    await db.execute(stmt)
+    after_commit(db, lambda: product_registry.add(product_id))
+    return str(product_id)
+
+
+async def _ensure_warehouses(db: AsyncSession, codes: dict[str, str]) -> dict[str, str]:
+    """Создает недостающие склады одним запросом; возвращает {id: ошибка}"""
+    codes = {
+        warehouse_id: code
+        for warehouse_id, code in codes.items()
+        if not warehouse_registry.known(warehouse_id)
+    }
+    if not codes:
+        return {}
+    existing = set(
+        (await db.scalars(select(Warehouse.id).where(_any(Warehouse.id, codes)))).all()
+    )
+    failed = {}
+    rows = []
+    for warehouse_id, code in codes.items():
+        if warehouse_id in existing:
+            continue
+        try:
+            _validate_warehouse_code(code)
+            rows.append({"id": warehouse_id, "code": code})
+        except ValueError as e:
+            failed[warehouse_id] = str(e)
+    if rows:
+        stmt = (
+            pg_insert(Warehouse)
+            .values(rows)
+            .on_conflict_do_nothing()
+            .returning(Warehouse.id)
+        )
+        created = set((await db.scalars(stmt)).all())
+        skipped = [row["id"] for row in rows if row["id"] not in created]
+        if skipped:
+            # Конфликт по id (создан параллельно) допустим, по коду — нет
+            stmt = select(Warehouse.id).where(_any(Warehouse.id, skipped))
+            concurrent = set((await db.scalars(stmt)).all())
+            for warehouse_id in skipped:
+                if warehouse_id not in concurrent:
+                    failed[warehouse_id] = (
+                        f"Warehouse code conflict: {codes[warehouse_id]}"
+                    )
+    ensured = [warehouse_id for warehouse_id in codes if warehouse_id not in failed]
+    after_commit(db, lambda: warehouse_registry.add(*ensured))
+    return failed
+
+
+async def _ensure_products(db: AsyncSession, product_ids: set[str]) -> dict[str, str]:
+    """Создает недостающие товары одним запросом; возвращает {id: ошибка}"""
+    product_ids = {
+        product_id
+        for product_id in product_ids
+        if not product_registry.known(product_id)
+    }
+    if not product_ids:
+        return {}
+    existing = set(
+        (await db.scalars(select(Product.id).where(_any(Product.id, product_ids)))).all()
+    )
+    missing = product_ids - existing
+    if missing:
+        stmt = (
+            pg_insert(Product)
+            .values([{"id": product_id} for product_id in missing])
+            .on_conflict_do_nothing()
+        )
+        await db.execute(stmt)
+    after_commit(db, lambda: product_registry.add(*product_ids))
+    return {}
+
+
+async def _lock_movements(db: AsyncSession, movement_ids: Iterable[UUID]):
+    """
+    Блокирует перемещения до конца транзакции (pg_advisory_xact_lock).
+
+    Половины одного перемещения применяются разными транзакциями (воркеры
+    режима parallel разводят их по складам, поды, webhook'и). Без блокировки
+    отгрузка и приемка не видят незакоммиченные строки друг друга, и обе
+    создают по новой записи. Ключи берутся по возрастанию — пачки не
+    блокируют друг друга взаимно.
+    """
+    keys = sorted({_movement_lock_key(movement_id) for movement_id in movement_ids})
+    if keys:
+        await db.execute(
+            text(
+                "SELECT pg_advisory_xact_lock(key) "
+                "FROM unnest(CAST(:keys AS bigint[])) AS key"
+            ),
+            {"keys": keys},
+        )
+
+
+def _movement_lock_key(movement_id: UUID) -> int:
+    """Ключ advisory-блокировки: первые 8 байт UUID перемещения как bigint"""
+    return int.from_bytes(UUID(str(movement_id)).bytes[:8], "big", signed=True)
 
-    if not stock:
-        stock = StockItem(warehouse_id=warehouse_id, product_id=product_id, quantity=0)
-        db.add(stock)
-        await db.flush()
 
+async def _claim_event(db: AsyncSession, event: MovementEvent):
+    """Записывает ключ идемпотентности события; повтор — DuplicateEventError"""
+    if await _known_processed([event.key]):
+        raise DuplicateEventError(f"Duplicate event: {event.key}")
+    stmt = (
+        pg_insert(ProcessedEvent)
+        .values(_processed_event_row(event))
+        .on_conflict_do_nothing()
+        .returning(ProcessedEvent.movement_id)
+    )
+    if (await db.execute(stmt)).first() is None:
+        # Конкурентная вставка дождалась COMMIT владельца ключа
+        _remember_processed(event.key)
+        raise DuplicateEventError(f"Duplicate event: {event.key}")
+    after_commit(db, lambda: _remember_processed(event.key))
+
+
+async def _skip_processed(
+    db: AsyncSession,
+    accepted: list[tuple[int, MovementEvent]],
+    results: list[MovementEventResult],
+) -> list[tuple[int, MovementEvent]]:
+    """Отмечает уже примененные события дубликатами одним SELECT"""
+    known = await _known_processed([event.key for _, event in accepted])
+    unknown = {
+        (str(event.movement_id), event.event_type)
+        for _, event in accepted
+        if event.key not in known
+    }
+    processed = set()
+    if unknown:
+        stmt = select(ProcessedEvent.movement_id, ProcessedEvent.event_type).where(
+            tuple_(ProcessedEvent.movement_id, ProcessedEvent.event_type).in_(unknown)
+        )
+        processed = {f"{m}:{e}" for m, e in await db.execute(stmt)}
+        _remember_processed(*processed)
+
+    remaining = []
+    for index, event in accepted:
+        key = (str(event.movement_id), event.event_type)
+        if key not in unknown or event.key in processed:
+            results[index].error = f"Duplicate event: {event.key}"
+            results[index].duplicate = True
+        else:
+            remaining.append((index, event))
+    return remaining
+
+
+async def _claim_events(db: AsyncSession, events: list[MovementEvent]):
+    """
+    Записывает ключи идемпотентности пачки одним INSERT.
+    Ключ, вставленный конкурентной транзакцией после проверки, прерывает пачку:
+    apply_movement_events повторит ее поштучно.
+    """
+    if not events:
+        return
+    stmt = (
+        pg_insert(ProcessedEvent)
+        .values([_processed_event_row(event) for event in events])
+        .on_conflict_do_nothing()
+        .returning(ProcessedEvent.movement_id)
+    )
+    inserted = len((await db.execute(stmt)).all())
+    if inserted != len(events):
+        raise DuplicateEventError(
+            f"Concurrent duplicate events in batch: {len(events) - inserted}"
+        )
+    keys = [event.key for event in events]
+    after_commit(db, lambda: _remember_processed(*keys))
+
+
+async def _known_processed(keys: list[str]) -> set[str]:
+    """
+    Ключи, примененные ранее, которые отсекаются без запроса к БД:
+    in-process LRU, затем общие для подов маркеры в Redis (одним MGET).
+    Отсутствие ключа здесь не значит, что событие новое — решает БД.
+    """
+    known = {key for key in keys if processed_event_registry.known(key)}
+    unknown = [key for key in keys if key not in known]
+    if unknown and settings.PROCESSED_EVENTS_MARKER_TTL_SECONDS > 0:
+        markers = await existing_markers(
+            [get_processed_event_cache_key(key) for key in unknown]
+        )
+        shared = {
+            key for key in unknown if get_processed_event_cache_key(key) in markers
+        }
+        processed_event_registry.add(*shared)
+        known |= shared
+    return known
+
+
+def _remember_processed(*keys: str):
+    """Запоминает примененные (закоммиченные) ключи в LRU и маркерах Redis"""
+    processed_event_registry.add(*keys)
+    if keys and settings.PROCESSED_EVENTS_MARKER_TTL_SECONDS > 0:
+        schedule_markers(
+            [get_processed_event_cache_key(key) for key in keys],
+            settings.PROCESSED_EVENTS_MARKER_TTL_SECONDS,
+        )
+
+
+def _processed_event_row(event: MovementEvent) -> dict:
+    return {
+        "movement_id": str(event.movement_id),
+        "event_type": event.event_type,
+        "message_id": str(event.message_id) if event.message_id else None,
+    }
+
+
+async def _apply_stock_deltas(
+    db: AsyncSession,
+    deltas: dict[tuple[str, str], int],
+    balances: dict[tuple[str, str], int],
+    versions: dict[tuple[str, str], int],
+) -> dict[tuple[str, str], tuple[int, int]]:
+    """
+    Применяет суммарные изменения остатков; возвращает {пара: (остаток, версия)}.
+
+    CHECK (quantity >= 0) проверяется для предлагаемой строки INSERT еще до
+    ON CONFLICT, поэтому существующие (заблокированные) строки обновляются
+    одним executemany UPDATE, а новые создаются одним INSERT ... ON CONFLICT.
+    """
+    stock = {}
+    updates = []
+    inserts = []
+    for (warehouse_id, product_id), delta in deltas.items():
+        if not delta:
+            continue
+        pair = (warehouse_id, product_id)
+        if pair in versions:
+            updates.append({"w": warehouse_id, "p": product_id, "delta": delta})
+            # Строка заблокирована SELECT ... FOR UPDATE: итог известен заранее
+            stock[pair] = (balances[pair], versions[pair] + 1)
+        else:
+            inserts.append(
+                {
+                    "id": str(uuid4()),
+                    "warehouse_id": warehouse_id,
+                    "product_id": product_id,
+                    "quantity": delta,
+                    "version": 1,
+                }
+            )
+
+    if updates:
+        stmt = (
+            update(StockItem)
+            .where(
+                (StockItem.warehouse_id == bindparam("w"))
+                & (StockItem.product_id == bindparam("p"))
+            )
+            .values(
+                quantity=StockItem.quantity + bindparam("delta"),
+                version=StockItem.version + 1,
+            )
+        )
+        connection = await db.connection()
+        await connection.execute(stmt, updates)
+
+    if inserts:
+        stmt = pg_insert(StockItem).values(inserts)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[StockItem.warehouse_id, StockItem.product_id],
+            set_={
+                "quantity": StockItem.quantity + stmt.excluded.quantity,
+                "version": StockItem.version + 1,
+            },
+        ).returning(
+            StockItem.warehouse_id,
+            StockItem.product_id,
+            StockItem.quantity,
+            StockItem.version,
+        )
+        for warehouse_id, product_id, quantity, version in await db.execute(stmt):
+            stock[(str(warehouse_id), str(product_id))] = (quantity, version)
     return stock
 
 
-async def _get_or_create_warehouse(
-    db: AsyncSession, warehouse_id: UUID, code: str = None
-) -> Warehouse:
-    """Получаем или создаем склад"""
-    warehouse = await db.get(Warehouse, warehouse_id)
-    if not warehouse:
-        code = code or f"WH-{str(warehouse_id)[:4]}"
-        warehouse = Warehouse(id=warehouse_id, code=code)
-        db.add(warehouse)
-        await db.flush()
-    return warehouse
+def _any(column, values):
+    """column = ANY(:values) — один параметр-массив вместо раскрытого IN (...)"""
+    return column == any_(bindparam(None, list(values), type_=ARRAY(column.type)))
+
+
+def _parse_event(event_data: dict) -> MovementEvent:
+    """Валидация и преобразование сырых данных события"""
+    warehouse_id = _validate_uuid(event_data.get("warehouse_id"), "warehouse_id")
+    return MovementEvent(
+        movement_id=_validate_uuid(event_data.get("movement_id"), "movement_id"),
+        warehouse_id=warehouse_id,
+        product_id=_validate_uuid(event_data.get("product_id"), "product_id"),
+        quantity=_validate_quantity(event_data.get("quantity")),
+        timestamp=_validate_timestamp(event_data.get("timestamp")),
+        event_type=event_data.get("event"),
+        warehouse_code=(
+            event_data.get("warehouse_code") or f"WH-{str(warehouse_id)[:4]}"
+        ),
+        message_id=(
+            _validate_uuid(event_data["message_id"], "message_id")
+            if event_data.get("message_id")
+            else None
+        ),
+    )
+
+
+def _event_context(
+    movement_id: UUID, warehouse_id: str, product_id: str, quantity: int
+) -> dict:
+    """Поля события для extra= структурированного лога"""
+    return {
+        "movement_id": str(movement_id),
+        "warehouse_id": str(warehouse_id),
+        "product_id": str(product_id),
+        "quantity": quantity,
+    }
 
 
-async def _get_or_create_product(db: AsyncSession, product_id: UUID) -> Product:
-    """Получаем или создаем товар"""
-    product = await db.get(Product, product_id)
-    if not product:
-        product = Product(id=product_id)
-        db.add(product)
-        await db.flush()
-    return product
+def _validate_warehouse_code(code: str) -> str:
+    """Валидация кода склада (та же проверка, что и в модели Warehouse)"""
+    if not code or not WAREHOUSE_CODE_RE.match(code):
+        raise ValueError("Код склада должен быть в формате WH-XXXX")
+    return code
 
 
 def _validate_uuid(value: str, field_name: str) -> UUID:
@@ -227,10 +989,15 @@ def _validate_quantity(value: int) -> int:
 
 
 def _validate_timestamp(value: str) -> datetime:
-    """Валидация временной метки"""
-    if isinstance(value, datetime):
-        return value
-    try:
-        return datetime.fromisoformat(value)
-    except (TypeError, ValueError) as e:
-        raise ValueError(f"Invalid timestamp format: {value}") from e
+    """
+    Валидация временной метки. Метка без часового пояса считается UTC, как и
+    в БД: иначе ее нельзя сравнить со значением, прочитанным из timestamptz
+    """
+    if not isinstance(value, datetime):
+        try:
+            value = datetime.fromisoformat(value)
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Invalid timestamp format: {value}") from e
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
@@ -0,0 +1,81 @@
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from app.config import settings
+
+
+class NearCache:
+    """
+    In-process кэш (L1) перед Redis.
+
+    Ограничен числом записей и суммарным размером (по длине сериализованного
+    значения), вытесняет по LRU. Короткий TTL ограничивает устаревание, если
+    сообщение об инвалидации от другого пода потерялось.
+    Значения отдаются как есть, без копирования: вызывающий не должен их менять.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.bytes = 0
+        self._entries: OrderedDict[str, tuple[Any, int, float]] = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None or entry[2] < time.monotonic():
+            if entry is not None:
+                self._pop(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key: str, value: Any, size: int):
+        """Запоминает значение; size — длина его сериализованного представления"""
+        self._pop(key)
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (value, size, time.monotonic() + self.ttl_seconds)
+        self.bytes += size
+        while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+            _, (_, evicted_size, _) = self._entries.popitem(last=False)
+            self.bytes -= evicted_size
+
+    def invalidate(self, *keys: str):
+        for key in keys:
+            self._pop(key)
+
+    def clear(self):
+        self._entries.clear()
+        self.bytes = 0
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else None,
+        }
+
+    def _pop(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+
+
+near_cache: Optional[NearCache] = (
+    NearCache(
+        settings.NEAR_CACHE_MAX_ENTRIES,
+        settings.NEAR_CACHE_MAX_BYTES,
+        settings.NEAR_CACHE_TTL_SECONDS,
+    )
+    if settings.NEAR_CACHE_ENABLED
+    else None
+)
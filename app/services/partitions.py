@@ -0,0 +1,281 @@
+import asyncio
+import gzip
+import logging
+import os
+import re
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from app.config import settings
+from app.db.session import engine
+
+logger = logging.getLogger(__name__)
+
+PARENT_TABLE = "movements"
+DEFAULT_PARTITION = "movements_default"
+PARTITION_NAME_RE = re.compile(r"^movements_p(\d{4})(\d{2})$")
+# Ключ pg_advisory_lock: обслуживание выполняет один под
+MAINTENANCE_LOCK_ID = 0x6D6F76656D656E74
+# Ключей идемпотентности за одну транзакцию очистки
+PRUNE_BATCH_SIZE = 10_000
+
+
+def month_start(moment: datetime) -> datetime:
+    moment = moment.astimezone(timezone.utc)
+    return datetime(moment.year, moment.month, 1, tzinfo=timezone.utc)
+
+
+def add_months(month: datetime, months: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def partition_name(month: datetime) -> str:
+    return f"movements_p{month:%Y%m}"
+
+
+async def list_partitions(conn: AsyncConnection) -> dict[str, datetime]:
+    """Месячные секции movements: {имя: начало месяца}"""
+    result = await conn.execute(
+        text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = CAST(:parent AS regclass)"
+        ),
+        {"parent": PARENT_TABLE},
+    )
+    partitions = {}
+    for (name,) in result:
+        match = PARTITION_NAME_RE.match(name)
+        if match:
+            year, month = map(int, match.groups())
+            partitions[name] = datetime(year, month, 1, tzinfo=timezone.utc)
+    return partitions
+
+
+async def create_partition(conn: AsyncConnection, month: datetime) -> str:
+    """
+    Создает секцию месяца. Строки этого месяца, уже попавшие в секцию по
+    умолчанию, переносятся в новую: иначе ATTACH завершится ошибкой.
+    """
+    name = partition_name(month)
+    lower, upper = month.isoformat(), add_months(month, 1).isoformat()
+    await conn.execute(
+        text(
+            f"CREATE TABLE {name} (LIKE {PARENT_TABLE} "
+            "INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+        )
+    )
+    await conn.execute(
+        text(
+            f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} "
+            "WHERE recorded_at >= :lower AND recorded_at < :upper RETURNING *) "
+            f"INSERT INTO {name} SELECT * FROM moved"
+        ),
+        {"lower": month, "upper": add_months(month, 1)},
+    )
+    await conn.execute(
+        text(
+            f"ALTER TABLE {PARENT_TABLE} ATTACH PARTITION {name} "
+            f"FOR VALUES FROM ('{lower}') TO ('{upper}')"
+        )
+    )
+    return name
+
+
+async def ensure_partitions(
+    conn: AsyncConnection, months_ahead: int, now: Optional[datetime] = None
+) -> list[str]:
+    """Создает недостающие секции текущего и months_ahead следующих месяцев"""
+    current = month_start(now or datetime.now(timezone.utc))
+    existing = await list_partitions(conn)
+    created = []
+    for offset in range(months_ahead + 1):
+        month = add_months(current, offset)
+        if partition_name(month) not in existing:
+            created.append(await create_partition(conn, month))
+    return created
+
+
+async def partition_default_rows(conn: AsyncConnection) -> list[str]:
+    """
+    Создает секции для месяцев, строки которых попали в секцию по умолчанию
+    (поздние и загруженные задним числом события), и переносит их туда:
+    иначе эти строки не архивируются по сроку хранения
+    """
+    result = await conn.execute(
+        text(
+            "SELECT DISTINCT date_trunc('month', recorded_at AT TIME ZONE 'UTC') "
+            f"FROM {DEFAULT_PARTITION}"
+        )
+    )
+    months = sorted(month.replace(tzinfo=timezone.utc) for (month,) in result)
+    existing = await list_partitions(conn)
+    return [
+        await create_partition(conn, month)
+        for month in months
+        if partition_name(month) not in existing
+    ]
+
+
+async def archive_partition(conn: AsyncConnection, name: str, archive_dir: str) -> str:
+    """
+    Выгружает секцию в gzip CSV и удаляет ее; возвращает путь к архиву.
+
+    Секция блокируется от записи на время выгрузки, поэтому архив совпадает
+    с удаленными строками. Эксклюзивная блокировка movements нужна только
+    для DETACH и держится до COMMIT вызывающего.
+
+    Месяц может архивироваться повторно (поздние строки после архивации),
+    поэтому в имени архива есть время выгрузки, а существующий файл никогда
+    не перезаписывается.
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    archived_at = datetime.now(timezone.utc)
+    path = os.path.join(archive_dir, f"{name}-{archived_at:%Y%m%dT%H%M%S%fZ}.csv.gz")
+    partial_path = f"{path}.part"
+
+    await conn.execute(text(f"LOCK TABLE {name} IN SHARE MODE"))
+    raw = await conn.get_raw_connection()
+    with gzip.open(partial_path, "wb") as archive:
+
+        async def write(chunk: bytes):
+            await asyncio.to_thread(archive.write, chunk)
+
+        await raw.driver_connection.copy_from_table(
+            name, output=write, format="csv", header=True
+        )
+    # link, в отличие от rename, не заменяет существующий файл
+    os.link(partial_path, path)
+    os.unlink(partial_path)
+
+    await conn.execute(text(f"ALTER TABLE {PARENT_TABLE} DETACH PARTITION {name}"))
+    await conn.execute(text(f"DROP TABLE {name}"))
+    return path
+
+
+async def expired_partitions(
+    conn: AsyncConnection, retention_months: int, now: Optional[datetime] = None
+) -> list[str]:
+    """Секции, целиком старше retention_months полных месяцев"""
+    current = month_start(now or datetime.now(timezone.utc))
+    cutoff = add_months(current, -retention_months)
+    partitions = await list_partitions(conn)
+    return sorted(
+        name for name, month in partitions.items() if add_months(month, 1) <= cutoff
+    )
+
+
+async def prune_processed_events(
+    conn: AsyncConnection, retention_days: int, now: Optional[datetime] = None
+) -> int:
+    """
+    Удаляет ключи идемпотентности старше retention_days частями по
+    PRUNE_BATCH_SIZE, каждая часть — своей транзакцией; возвращает число
+    удаленных. Повтор события старше срока будет применен заново.
+    """
+    cutoff = (now or datetime.now(timezone.utc)) - timedelta(days=retention_days)
+    pruned = 0
+    while True:
+        result = await conn.execute(
+            text(
+                "DELETE FROM processed_events WHERE ctid IN ("
+                "SELECT ctid FROM processed_events "
+                "WHERE processed_at < :cutoff LIMIT :limit)"
+            ),
+            {"cutoff": cutoff, "limit": PRUNE_BATCH_SIZE},
+        )
+        await conn.commit()
+        pruned += result.rowcount
+        if result.rowcount < PRUNE_BATCH_SIZE:
+            return pruned
+
+
+async def expire_awaiting_departures(
+    conn: AsyncConnection, window_days: int, now: Optional[datetime] = None
+) -> int:
+    """
+    Снимает флаг ожидания отгрузки с приемок старше window_days частями по
+    PRUNE_BATCH_SIZE; возвращает число приемок, оставшихся прямыми поставками
+    """
+    cutoff = (now or datetime.now(timezone.utc)) - timedelta(days=window_days)
+    expired = 0
+    while True:
+        result = await conn.execute(
+            text(
+                "UPDATE movements SET awaiting_departure = false "
+                "WHERE (id, recorded_at) IN ("
+                "SELECT id, recorded_at FROM movements "
+                "WHERE awaiting_departure AND recorded_at < :cutoff LIMIT :limit)"
+            ),
+            {"cutoff": cutoff, "limit": PRUNE_BATCH_SIZE},
+        )
+        await conn.commit()
+        expired += result.rowcount
+        if result.rowcount < PRUNE_BATCH_SIZE:
+            return expired
+
+
+async def maintain_partitions(conn: AsyncConnection):
+    """
+    Один проход обслуживания (секции movements, очистка processed_events,
+    истекшие ожидания отгрузок); каждый шаг фиксируется отдельной транзакцией
+    """
+    created = await ensure_partitions(conn, settings.MOVEMENTS_PARTITIONS_AHEAD)
+    created += await partition_default_rows(conn)
+    await conn.commit()
+    if created:
+        logger.info("Created movement partitions: %s", ", ".join(created))
+
+    if settings.PROCESSED_EVENTS_RETENTION_DAYS > 0:
+        pruned = await prune_processed_events(
+            conn, settings.PROCESSED_EVENTS_RETENTION_DAYS
+        )
+        if pruned:
+            logger.info("Pruned %d processed event keys", pruned)
+
+    if settings.MOVEMENT_PAIRING_WINDOW_DAYS > 0:
+        expired = await expire_awaiting_departures(
+            conn, settings.MOVEMENT_PAIRING_WINDOW_DAYS
+        )
+        if expired:
+            logger.info("Expired %d arrivals awaiting departure", expired)
+
+    if settings.MOVEMENTS_RETENTION_MONTHS <= 0:
+        return
+    expired = await expired_partitions(conn, settings.MOVEMENTS_RETENTION_MONTHS)
+    await conn.commit()
+    for name in expired:
+        path = await archive_partition(conn, name, settings.MOVEMENTS_ARCHIVE_DIR)
+        await conn.commit()
+        logger.info("Archived movement partition %s to %s", name, path)
+
+
+async def run_partition_maintenance():
+    """Фоновая задача: периодическое обслуживание секций movements"""
+    while True:
+        try:
+            async with engine.connect() as conn:
+                locked = await conn.scalar(
+                    text("SELECT pg_try_advisory_lock(:id)"),
+                    {"id": MAINTENANCE_LOCK_ID},
+                )
+                await conn.commit()
+                if locked:
+                    try:
+                        await maintain_partitions(conn)
+                    finally:
+                        await conn.rollback()
+                        await conn.execute(
+                            text("SELECT pg_advisory_unlock(:id)"),
+                            {"id": MAINTENANCE_LOCK_ID},
+                        )
+                        await conn.commit()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Partition maintenance failed: %s", e)
+        await asyncio.sleep(settings.PARTITION_MAINTENANCE_INTERVAL_SECONDS)
@@ -1,79 +1,610 @@
+import asyncio
+import random
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from datetime import date, datetime
+
 import redis.asyncio as redis
 from pydantic import BaseModel
 
 from app.config import settings
+from app.metrics import CACHE_REQUESTS
+from app.services.near_cache import near_cache
 import logging
 import json
-from typing import Any, Optional
-from uuid import UUID
+from typing import Any, AsyncIterator, Iterable, Optional
+from uuid import UUID, uuid4
 
 logger = logging.getLogger(__name__)
-redis_client: Optional[redis.Redis] = None
 
+# Отправитель сообщений об инвалидации: свои сообщения под пропускает
+INSTANCE_ID = uuid4().hex
+# Обращения к кэшу по уровням (near — in-process, redis) и результатам
+_NEAR_HITS = CACHE_REQUESTS.labels("near", "hit")
+_NEAR_MISSES = CACHE_REQUESTS.labels("near", "miss")
+_REDIS_HITS = CACHE_REQUESTS.labels("redis", "hit")
+_REDIS_MISSES = CACHE_REQUESTS.labels("redis", "miss")
+_REDIS_ERRORS = CACHE_REQUESTS.labels("redis", "error")
+# Значение не декодировано (например, записано другим codec'ом)
+_DECODE_ERRORS = CACHE_REQUESTS.labels("codec", "error")
+
+# SET значения, если сохраненная версия не новее (версия — в ключе-спутнике)
+SET_IF_NEWER_SCRIPT = """
+local current = tonumber(redis.call('GET', KEYS[2]))
+if current and current > tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[3])
+redis.call('SET', KEYS[2], ARGV[2], 'EX', ARGV[3])
+return 1
+"""
+
+# DEL блокировки, только если она все еще наша
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Отложенные write-through записи: ключ -> (значение, версия)
+_pending_writes: dict[str, tuple[Any, int]] = {}
+_pending_flush: Optional[asyncio.Task] = None
+_flush_tasks: set[asyncio.Task] = set()
+# Отложенные маркеры (SETEX ключ ttl 1): ключ -> TTL
+_pending_markers: dict[str, int] = {}
+_pending_markers_flush: Optional[asyncio.Task] = None
+
+
+def _to_primitive(value: Any) -> Any:
+    """Fallback сериализации для типов, которых не знает codec"""
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json")
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)  # UUID/Decimal
+
+
+class JsonCodec:
+    """Стандартный json (без внешних зависимостей)"""
+
+    def encode(self, value: Any) -> bytes:
+        return json.dumps(value, default=_to_primitive).encode()
+
+    def decode(self, data: bytes) -> Any:
+        return json.loads(data)
+
+    def to_json(self, data: bytes) -> bytes:
+        return data
+
+
+class OrjsonCodec:
+    """orjson: совместим по формату с JsonCodec, в разы быстрее"""
+
+    def __init__(self):
+        import orjson
+
+        self._orjson = orjson
+
+    def encode(self, value: Any) -> bytes:
+        return self._orjson.dumps(value, default=_to_primitive)
+
+    def decode(self, data: bytes) -> Any:
+        return self._orjson.loads(data)
+
+    def to_json(self, data: bytes) -> bytes:
+        return data
+
+
+class MsgpackCodec:
+    """msgpack: компактнее JSON; ответ API требует перекодирования"""
+
+    def __init__(self):
+        import msgpack
+
+        self._msgpack = msgpack
+
+    def encode(self, value: Any) -> bytes:
+        return self._msgpack.packb(value, default=_to_primitive)
+
+    def decode(self, data: bytes) -> Any:
+        return self._msgpack.unpackb(data)
+
+    def to_json(self, data: bytes) -> bytes:
+        return json.dumps(self.decode(data)).encode()
+
+
+CODECS = {"json": JsonCodec, "orjson": OrjsonCodec, "msgpack": MsgpackCodec}
+
+# Codec значений кэша (CACHE_CODEC); смена формата на лету безопасна только
+# между json и orjson — остальные значения читаются как промахи до истечения TTL
+codec = CODECS[settings.CACHE_CODEC]()
+
+
+class CacheClient:
+    """
+    Redis-клиент кэша с явно настроенным пулом соединений.
+
+    Пул блокирующий: при исчерпании соединений запрос ждет освобождения
+    не дольше REDIS_POOL_TIMEOUT вместо того, чтобы открывать новые.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        max_connections: int,
+        pool_timeout: float,
+        socket_timeout: float,
+        socket_connect_timeout: float,
+        health_check_interval: int,
+    ):
+        self.pool = redis.BlockingConnectionPool.from_url(
+            url,
+            max_connections=max_connections,
+            timeout=pool_timeout,
+            socket_timeout=socket_timeout,
+            socket_connect_timeout=socket_connect_timeout,
+            health_check_interval=health_check_interval,
+            decode_responses=False,  # Значения кодируются codec'ом в bytes
+        )
+        self.redis = redis.Redis(connection_pool=self.pool)
+        self.set_if_newer_script = self.redis.register_script(SET_IF_NEWER_SCRIPT)
+        self.release_lock_script = self.redis.register_script(RELEASE_LOCK_SCRIPT)
+
+    @classmethod
+    def from_settings(cls) -> "CacheClient":
+        return cls(
+            settings.redis_url,
+            max_connections=settings.REDIS_MAX_CONNECTIONS,
+            pool_timeout=settings.REDIS_POOL_TIMEOUT,
+            socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=settings.REDIS_SOCKET_CONNECT_TIMEOUT,
+            health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL,
+        )
 
-async def get_redis_client() -> redis.Redis:
-    """Возвращает (инициализирует при первом вызове) Redis клиент."""
-    global redis_client
-    if redis_client is None:
+    async def connect(self):
+        """Проверяет соединение при старте приложения."""
         try:
-            redis_client = redis.from_url(
-                settings.redis_url,
-                encoding="utf-8",
-                decode_responses=True,  # Важно для строк
-            )
-            await redis_client.ping()
+            await self.redis.ping()
             logger.info("Redis connection established.")
         except Exception as e:
-            logger.error(f"Failed to connect to Redis: {e}", exc_info=True)
-            # В реальном приложении можно добавить retry или fallback
+            logger.error("Failed to connect to Redis: %s", e, exc_info=True)
             raise
-    return redis_client
+
+    async def close(self):
+        await self.redis.aclose()
+        await self.pool.aclose()
+        logger.info("Redis connection closed.")
+
+
+cache_client = CacheClient.from_settings()
+
+
+class CacheBatch:
+    """
+    Записи и инвалидации кэша, накопленные за запрос или пачку consumer'а.
+    Отправляются одним pipeline: DEL, затем SETEX, затем версионированные SET.
+    """
+
+    def __init__(self):
+        self.deletes: set[str] = set()
+        self.writes: dict[str, tuple[bytes, int]] = {}
+        self.versioned: dict[str, tuple[Any, int, int]] = {}
+
+    def __len__(self) -> int:
+        return len(self.deletes) + len(self.writes) + len(self.versioned)
+
+    def delete(self, *keys: str):
+        _evict_local(keys)
+        self.deletes.update(keys)
+        for key in keys:
+            self.writes.pop(key, None)
+
+    def set(self, key: str, value: bytes, ttl: int):
+        _evict_local([key])
+        self.writes[key] = (value, ttl)
+        self.deletes.discard(key)
+
+    def set_if_newer(self, key: str, value: Any, version: int, ttl: int):
+        _evict_local([key])
+        current = self.versioned.get(key)
+        if current is None or current[1] < version:
+            self.versioned[key] = (value, version, ttl)
+
+    async def execute(self, client: CacheClient):
+        if not self:
+            return
+        try:
+            async with client.redis.pipeline(transaction=False) as pipe:
+                if self.deletes:
+                    pipe.delete(*self.deletes)
+                for key, (value, ttl) in self.writes.items():
+                    pipe.setex(key, ttl, value)
+                for key, (value, version, ttl) in self.versioned.items():
+                    await client.set_if_newer_script(
+                        keys=[key, get_version_cache_key(key)],
+                        args=[codec.encode(value), version, ttl],
+                        client=pipe,
+                    )
+                _publish_invalidation(
+                    pipe, [*self.deletes, *self.writes, *self.versioned]
+                )
+                await pipe.execute()
+            logger.debug("Cache batch executed: %d operations", len(self))
+        except Exception as e:
+            logger.warning(
+                "Failed to execute cache batch of %d operations: %s", len(self), e
+            )
+
+
+_current_batch: ContextVar[Optional[CacheBatch]] = ContextVar(
+    "cache_batch", default=None
+)
+
+
+@asynccontextmanager
+async def cache_batch() -> AsyncIterator[CacheBatch]:
+    """
+    Копит записи кэша внутри блока и отправляет их одним round trip на выходе.
+    Вложенный блок присоединяется к внешнему.
+    """
+    batch = _current_batch.get()
+    if batch is not None:
+        yield batch
+        return
+    batch = CacheBatch()
+    token = _current_batch.set(batch)
+    try:
+        yield batch
+    finally:
+        _current_batch.reset(token)
+        await batch.execute(cache_client)
+
+
+async def get_cache_batch_dependency() -> AsyncIterator[CacheBatch]:
+    """
+    Функция для использования в FastAPI Depends.
+    Объявляется до зависимости сессии, чтобы выполниться после COMMIT.
+    """
+    async with cache_batch() as batch:
+        yield batch
 
 
 async def set_cache(key: str, value: Any, ttl: int = settings.CACHE_TTL_SECONDS):
     """Сохраняет значение в кэш."""
+    ttl = _jittered_ttl(ttl)
+    batch = _current_batch.get()
+    if batch is not None:
+        batch.set(key, codec.encode(value), ttl)
+        return
+    _evict_local([key])
     try:
-        client = await get_redis_client()
-        # Сериализуем в JSON, если это не простая строка/число
-        if isinstance(value, (dict, list, BaseModel)):
-            value_str = json.dumps(value, default=str)  # default=str для UUID/datetime
-        else:
-            value_str = str(value)
-        await client.setex(key, ttl, value_str)
-        logger.debug(f"Cache SET for key: {key}")
+        async with cache_client.redis.pipeline(transaction=False) as pipe:
+            pipe.setex(key, ttl, codec.encode(value))
+            _publish_invalidation(pipe, [key])
+            await pipe.execute()
+        logger.debug("Cache SET for key: %s", key)
     except Exception as e:
-        logger.warning(f"Failed to set cache for key {key}: {e}")
+        logger.warning("Failed to set cache for key %s: %s", key, e)
 
 
 async def get_cache(key: str) -> Optional[Any]:
-    """Получает значение из кэша."""
-    try:
-        client = await get_redis_client()
-        value = await client.get(key)
-        if value:
-            logger.debug(f"Cache HIT for key: {key}")
-            # Пытаемся десериализовать JSON
-            try:
-                return json.loads(value)
-            except json.JSONDecodeError:
-                return value  # Возвращаем как есть, если не JSON
-        logger.debug(f"Cache MISS for key: {key}")
+    """Получает значение из кэша (сначала in-process, затем Redis)."""
+    return (await get_many_cache([key]))[0]
+
+
+async def get_cache_json(key: str) -> Optional[bytes]:
+    """
+    Получает значение как готовый JSON для ответа API, без декодирования
+    (для JSON-codec'ов байты отдаются как есть).
+    """
+    raw = (await _get_many_raw([key]))[0]
+    if raw is None:
         return None
+    try:
+        return codec.to_json(raw)
     except Exception as e:
-        logger.warning(f"Failed to get cache for key {key}: {e}")
+        logger.warning("Failed to decode cache for key %s: %s", key, e)
         return None
 
 
+async def get_cache_json_with_ttl(key: str) -> tuple[Optional[bytes], Optional[int]]:
+    """
+    Значение как JSON и оставшийся TTL в миллисекундах (GET и PTTL за один
+    round trip). Для попадания в in-process кэш TTL неизвестен (None).
+    """
+    raw = near_cache.get(key) if near_cache else None
+    pttl = None
+    if near_cache:
+        (_NEAR_MISSES if raw is None else _NEAR_HITS).inc()
+    if raw is None:
+        try:
+            async with cache_client.redis.pipeline(transaction=False) as pipe:
+                pipe.get(key)
+                pipe.pttl(key)
+                raw, pttl = await pipe.execute()
+        except Exception as e:
+            _REDIS_ERRORS.inc()
+            logger.warning("Failed to get cache for key %s: %s", key, e)
+            return None, None
+        if not raw:
+            _REDIS_MISSES.inc()
+            return None, None
+        _REDIS_HITS.inc()
+        if near_cache:
+            near_cache.put(key, raw, len(raw))
+    try:
+        return codec.to_json(raw), pttl
+    except Exception as e:
+        _DECODE_ERRORS.inc()
+        logger.warning("Failed to decode cache for key %s: %s", key, e)
+        return None, None
+
+
+async def get_many_cache(keys: list[str]) -> list[Optional[Any]]:
+    """Получает значения пачки ключей (None — промах)."""
+    result = []
+    for key, raw in zip(keys, await _get_many_raw(keys)):
+        try:
+            result.append(codec.decode(raw) if raw is not None else None)
+        except Exception as e:
+            # Формат другого codec'а (например, во время смены CACHE_CODEC)
+            _DECODE_ERRORS.inc()
+            logger.warning("Failed to decode cache for key %s: %s", key, e)
+            result.append(None)
+    return result
+
+
+async def _get_many_raw(keys: list[str]) -> list[Optional[bytes]]:
+    """Закодированные значения: из in-process кэша, промахи — одним MGET."""
+    if not keys:
+        return []
+    result = [near_cache.get(key) if near_cache else None for key in keys]
+    missed = [i for i, value in enumerate(result) if value is None]
+    if near_cache:
+        _NEAR_HITS.inc(len(keys) - len(missed))
+        _NEAR_MISSES.inc(len(missed))
+    if not missed:
+        return result
+
+    try:
+        values = await cache_client.redis.mget([keys[i] for i in missed])
+    except Exception as e:
+        _REDIS_ERRORS.inc(len(missed))
+        logger.warning("Failed to get cache for %d keys: %s", len(missed), e)
+        return result
+
+    for i, value in zip(missed, values):
+        if not value:
+            _REDIS_MISSES.inc()
+            continue
+        _REDIS_HITS.inc()
+        result[i] = value
+        if near_cache:
+            near_cache.put(keys[i], value, len(value))
+    if logger.isEnabledFor(logging.DEBUG):
+        hits = sum(v is not None for v in result)
+        logger.debug("Cache GET: %d/%d hits", hits, len(keys))
+    return result
+
+
+async def set_cache_if_newer(
+    key: str, value: Any, version: int, ttl: int = settings.CACHE_TTL_SECONDS
+) -> bool:
+    """Сохраняет значение, если в кэше нет более новой версии."""
+    return bool(await set_many_cache_if_newer({key: (value, version)}, ttl))
+
+
+async def set_many_cache_if_newer(
+    entries: dict[str, tuple[Any, int]], ttl: int = settings.CACHE_TTL_SECONDS
+) -> int:
+    """
+    Версионированная запись пачки ключей одним pipeline.
+    Возвращает число записанных (внутри cache_batch — поставленных в очередь).
+    """
+    if not entries:
+        return 0
+    batch = _current_batch.get()
+    if batch is not None:
+        for key, (value, version) in entries.items():
+            batch.set_if_newer(key, value, version, _jittered_ttl(ttl))
+        return len(entries)
+    _evict_local(entries)
+    try:
+        async with cache_client.redis.pipeline(transaction=False) as pipe:
+            for key, (value, version) in entries.items():
+                await cache_client.set_if_newer_script(
+                    keys=[key, get_version_cache_key(key)],
+                    args=[codec.encode(value), version, _jittered_ttl(ttl)],
+                    client=pipe,
+                )
+            _publish_invalidation(pipe, entries)
+            written = sum((await pipe.execute())[: len(entries)])
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Cache SET IF NEWER for keys: %s", list(entries))
+        return written
+    except Exception as e:
+        logger.warning("Failed to set cache for keys %s: %s", list(entries), e)
+        return 0
+
+
+def schedule_cache_write_if_newer(key: str, value: Any, version: int):
+    """
+    Ставит версионированную запись в буфер; буфер сбрасывается одним pipeline
+    в отдельной задаче (или вместе с текущим cache_batch).
+    Используется из синхронных after-commit callback'ов.
+    """
+    global _pending_flush
+    batch = _current_batch.get()
+    if batch is not None:
+        batch.set_if_newer(
+            key, value, version, _jittered_ttl(settings.CACHE_TTL_SECONDS)
+        )
+        return
+    current = _pending_writes.get(key)
+    if current is None or current[1] < version:
+        _pending_writes[key] = (value, version)
+    if _pending_flush is None:
+        _pending_flush = asyncio.get_running_loop().create_task(_flush_pending_writes())
+        _flush_tasks.add(_pending_flush)
+        _pending_flush.add_done_callback(_flush_tasks.discard)
+
+
+async def _flush_pending_writes():
+    global _pending_flush
+    entries = dict(_pending_writes)
+    _pending_writes.clear()
+    _pending_flush = None
+    await set_many_cache_if_newer(entries)
+
+
+def schedule_markers(keys: Iterable[str], ttl: int):
+    """
+    Ставит маркеры существования ключей в буфер; буфер сбрасывается одним
+    pipeline в отдельной задаче. Маркеры не кэшируются в near cache и не
+    рассылают инвалидации. Используется из синхронных after-commit callback'ов.
+    """
+    global _pending_markers_flush
+    for key in keys:
+        _pending_markers[key] = ttl
+    if _pending_markers_flush is None and _pending_markers:
+        loop = asyncio.get_running_loop()
+        _pending_markers_flush = loop.create_task(_flush_pending_markers())
+        _flush_tasks.add(_pending_markers_flush)
+        _pending_markers_flush.add_done_callback(_flush_tasks.discard)
+
+
+async def _flush_pending_markers():
+    global _pending_markers_flush
+    markers = dict(_pending_markers)
+    _pending_markers.clear()
+    _pending_markers_flush = None
+    try:
+        async with cache_client.redis.pipeline(transaction=False) as pipe:
+            for key, ttl in markers.items():
+                pipe.setex(key, ttl, b"1")
+            await pipe.execute()
+    except Exception as e:
+        logger.warning("Failed to set %d markers: %s", len(markers), e)
+
+
+async def existing_markers(keys: list[str]) -> set[str]:
+    """Ключи, для которых есть маркер; при недоступном Redis — пустое множество"""
+    if not keys:
+        return set()
+    try:
+        values = await cache_client.redis.mget(keys)
+    except Exception as e:
+        _REDIS_ERRORS.inc(len(keys))
+        logger.warning("Failed to check %d markers: %s", len(keys), e)
+        return set()
+    return {key for key, value in zip(keys, values) if value is not None}
+
+
 async def invalidate_cache(*keys: str):
     """Удаляет ключи из кэша."""
     if not keys:
         return
+    batch = _current_batch.get()
+    if batch is not None:
+        batch.delete(*keys)
+        return
+    _evict_local(keys)
+    try:
+        async with cache_client.redis.pipeline(transaction=False) as pipe:
+            pipe.delete(*keys)
+            _publish_invalidation(pipe, keys)
+            await pipe.execute()
+        logger.debug("Cache INVALIDATED for keys: %s", keys)
+    except Exception as e:
+        logger.warning("Failed to invalidate cache for keys %s: %s", keys, e)
+
+
+async def acquire_lock(key: str, ttl_ms: int) -> Optional[str]:
+    """Берет распределенную блокировку (SET NX PX); возвращает токен или None."""
+    token = uuid4().hex
+    try:
+        if await cache_client.redis.set(key, token, nx=True, px=ttl_ms):
+            return token
+    except Exception as e:
+        logger.warning("Failed to acquire lock %s: %s", key, e)
+    return None
+
+
+async def release_lock(key: str, token: str):
+    """Снимает блокировку, если ее не перехватили после истечения TTL."""
     try:
-        client = await get_redis_client()
-        await client.delete(*keys)
-        logger.debug(f"Cache INVALIDATED for keys: {keys}")
+        await cache_client.release_lock_script(keys=[key], args=[token])
     except Exception as e:
-        logger.warning(f"Failed to invalidate cache for keys {keys}: {e}")
+        logger.warning("Failed to release lock %s: %s", key, e)
+
+
+def cache_stats() -> dict:
+    """Попадания по уровням кэша"""
+    hits, misses = int(_REDIS_HITS.value), int(_REDIS_MISSES.value)
+    total = hits + misses
+    return {
+        "near": near_cache.stats() if near_cache else None,
+        "redis": {
+            "hits": hits,
+            "misses": misses,
+            "errors": int(_REDIS_ERRORS.value),
+            "hit_ratio": round(hits / total, 4) if total else None,
+        },
+    }
+
+
+async def run_invalidation_listener():
+    """
+    Подписка на инвалидации других подов: удаляет ключи из in-process кэша.
+    Pub/sub не гарантирует доставку, поэтому после переподключения
+    in-process кэш очищается целиком.
+    """
+    if near_cache is None:
+        return
+    while True:
+        try:
+            async with cache_client.redis.pubsub() as pubsub:
+                await pubsub.subscribe(settings.NEAR_CACHE_CHANNEL)
+                near_cache.clear()
+                while True:
+                    # Таймаут чтения явный: socket_timeout пула рассчитан на команды
+                    message = await pubsub.get_message(
+                        ignore_subscribe_messages=True, timeout=1.0
+                    )
+                    if message is not None:
+                        _apply_invalidation(message["data"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Cache invalidation listener failed: %s", e)
+            near_cache.clear()
+            await asyncio.sleep(1)
+
+
+def _apply_invalidation(raw: bytes):
+    message = json.loads(raw)
+    if message["origin"] != INSTANCE_ID:
+        near_cache.invalidate(*message["keys"])
+
+
+def _publish_invalidation(pipe, keys: Iterable[str]):
+    keys = list(keys)
+    if near_cache is not None and keys:
+        pipe.publish(
+            settings.NEAR_CACHE_CHANNEL,
+            json.dumps({"origin": INSTANCE_ID, "keys": keys}),
+        )
+
+
+def _jittered_ttl(ttl: int) -> int:
+    # Разброс TTL: ключи, записанные одновременно, не истекают одновременно
+    return ttl + random.randint(0, int(ttl * settings.CACHE_TTL_JITTER))
+
+
+def _evict_local(keys: Iterable[str]):
+    if near_cache is not None:
+        near_cache.invalidate(*keys)
 
 
 # Функции для генерации ключей
@@ -83,3 +614,15 @@ def get_stock_cache_key(warehouse_id: UUID, product_id: UUID) -> str:
 
 def get_movement_cache_key(movement_id: UUID) -> str:
     return f"movement:{movement_id}"
+
+
+def get_processed_event_cache_key(event_key: str) -> str:
+    return f"processed:{event_key}"
+
+
+def get_version_cache_key(key: str) -> str:
+    return f"{key}:version"
+
+
+def get_lock_cache_key(key: str) -> str:
+    return f"{key}:lock"
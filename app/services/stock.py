@@ -0,0 +1,69 @@
+from uuid import UUID
+
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.models import StockItem
+from app.services.redis import (
+    get_many_cache,
+    get_stock_cache_key,
+    set_many_cache_if_newer,
+)
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+async def get_stock_quantities(
+    db: AsyncSession, pairs: list[tuple[UUID, UUID]]
+) -> dict[tuple[UUID, UUID], int]:
+    """
+    Остатки пачки пар склад/товар.
+
+    Попадания берутся одним MGET, промахи — одним SELECT ... IN,
+    после чего кэш дозаполняется одним pipeline (с версиями строк).
+    """
+    pairs = list(dict.fromkeys(pairs))
+    keys = [get_stock_cache_key(*pair) for pair in pairs]
+    quantities: dict[tuple[UUID, UUID], int] = {}
+    misses = []
+    for pair, cached in zip(pairs, await get_many_cache(keys)):
+        if cached is not None:
+            quantities[pair] = cached["quantity"]
+        else:
+            misses.append(pair)
+    if not misses:
+        return quantities
+
+    stmt = select(
+        StockItem.warehouse_id,
+        StockItem.product_id,
+        StockItem.quantity,
+        StockItem.version,
+    ).where(
+        tuple_(StockItem.warehouse_id, StockItem.product_id).in_(
+            [(str(warehouse_id), str(product_id)) for warehouse_id, product_id in misses]
+        )
+    )
+    found = {
+        (warehouse_id, product_id): (quantity, version)
+        for warehouse_id, product_id, quantity, version in await db.execute(stmt)
+    }
+
+    entries = {}
+    for warehouse_id, product_id in misses:
+        quantity, version = found.get((str(warehouse_id), str(product_id)), (0, 0))
+        quantities[(warehouse_id, product_id)] = quantity
+        entries[get_stock_cache_key(warehouse_id, product_id)] = (
+            {
+                "warehouse_id": str(warehouse_id),
+                "product_id": str(product_id),
+                "quantity": quantity,
+            },
+            version,
+        )
+    await set_many_cache_if_newer(entries)
+    logger.debug(
+        "Stock batch: %d hits, %d misses", len(pairs) - len(misses), len(misses)
+    )
+    return quantities
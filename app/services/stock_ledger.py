@@ -0,0 +1,130 @@
+from datetime import datetime
+from typing import NamedTuple
+
+from sqlalchemy import exists, func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.db.models import StockLedgerEntry, StockSnapshot
+
+
+class StockChange(NamedTuple):
+    """Примененное изменение остатка: delta и итог (quantity, version)"""
+
+    warehouse_id: str
+    product_id: str
+    delta: int
+    quantity: int
+    version: int
+
+
+class StockHistoryUnavailable(LookupError):
+    """Момент раньше начала журнала для этой пары склад/товар"""
+
+
+async def record_stock_changes(db: AsyncSession, changes: list[StockChange]):
+    """
+    Пишет изменения в журнал одним INSERT в транзакции самого изменения.
+    Каждая STOCK_SNAPSHOT_INTERVAL-я версия дополнительно фиксируется снимком.
+    """
+    if not changes:
+        return
+    await db.execute(
+        pg_insert(StockLedgerEntry).values(
+            [
+                {
+                    "warehouse_id": str(change.warehouse_id),
+                    "product_id": str(change.product_id),
+                    "version": change.version,
+                    "delta": change.delta,
+                }
+                for change in changes
+            ]
+        )
+    )
+    snapshots = [
+        {
+            "warehouse_id": str(change.warehouse_id),
+            "product_id": str(change.product_id),
+            "version": change.version,
+            "quantity": change.quantity,
+        }
+        for change in changes
+        if change.version % settings.STOCK_SNAPSHOT_INTERVAL == 0
+    ]
+    if snapshots:
+        await db.execute(
+            pg_insert(StockSnapshot).values(snapshots).on_conflict_do_nothing()
+        )
+
+
+async def get_stock_as_of(
+    db: AsyncSession, warehouse_id, product_id, as_of: datetime
+) -> int:
+    """
+    Остаток на момент as_of: ближайший снимок не позже as_of плюс изменения
+    журнала после него — не больше STOCK_SNAPSHOT_INTERVAL записей.
+    """
+    warehouse_id, product_id = str(warehouse_id), str(product_id)
+    stmt = (
+        select(StockSnapshot.version, StockSnapshot.quantity)
+        .where(
+            (StockSnapshot.warehouse_id == warehouse_id)
+            & (StockSnapshot.product_id == product_id)
+            & (StockSnapshot.taken_at <= as_of)
+        )
+        .order_by(StockSnapshot.version.desc())
+        .limit(1)
+    )
+    snapshot = (await db.execute(stmt)).one_or_none()
+    if snapshot is None:
+        await _ensure_history_starts_at_zero(db, warehouse_id, product_id)
+        version, quantity = 0, 0
+    else:
+        version, quantity = snapshot
+
+    stmt = select(func.coalesce(func.sum(StockLedgerEntry.delta), 0)).where(
+        (StockLedgerEntry.warehouse_id == warehouse_id)
+        & (StockLedgerEntry.product_id == product_id)
+        & (StockLedgerEntry.version > version)
+        & (StockLedgerEntry.version <= version + settings.STOCK_SNAPSHOT_INTERVAL)
+        & (StockLedgerEntry.applied_at <= as_of)
+    )
+    return quantity + await db.scalar(stmt)
+
+
+async def _ensure_history_starts_at_zero(
+    db: AsyncSession, warehouse_id: str, product_id: str
+):
+    """
+    Без снимка не позже as_of остаток восстанавливается от нуля, только если
+    журнал ведется с первой версии строки. Остатки, существовавшие до журнала,
+    представлены начальным снимком миграции (его версии нет в журнале):
+    раньше него истории нет, даже если журнал продолжается с версии 1.
+    """
+    pair = (StockSnapshot.warehouse_id == warehouse_id) & (
+        StockSnapshot.product_id == product_id
+    )
+    logged = (
+        (StockLedgerEntry.warehouse_id == warehouse_id)
+        & (StockLedgerEntry.product_id == product_id)
+        & (StockLedgerEntry.version == StockSnapshot.version)
+    )
+    seeded = await db.scalar(
+        select(StockSnapshot.version)
+        .where(pair & ~exists().where(logged))
+        .limit(1)
+    )
+    first_version = await db.scalar(
+        select(func.min(StockLedgerEntry.version)).where(
+            (StockLedgerEntry.warehouse_id == warehouse_id)
+            & (StockLedgerEntry.product_id == product_id)
+        )
+    )
+    if seeded is None and first_version in (None, 1):
+        return  # Журнал полный или остатка этой пары никогда не было
+    raise StockHistoryUnavailable(
+        f"Stock history is not available before the ledger start. "
+        f"Warehouse: {warehouse_id}, Product: {product_id}"
+    )
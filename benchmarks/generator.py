@@ -0,0 +1,157 @@
+"""
+Синтетические CloudEvent-сообщения о перемещениях: пары отгрузка/приемка
+с неравномерной (Zipf) нагрузкой на склады и товары.
+"""
+
+import bisect
+import heapq
+import itertools
+import random
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Iterator, Optional
+
+CLOUD_EVENT_TYPE = "ru.retail.warehouses.movement"
+
+
+@dataclass
+class Catalog:
+    """Склады (id, код WH-XXXX) и товары, между которыми ходят перемещения"""
+
+    warehouses: list[tuple[str, str]]
+    products: list[str]
+
+
+def make_catalog(warehouses: int, products: int, seed: int) -> Catalog:
+    if not 2 <= warehouses <= 10_000:
+        raise ValueError("Warehouses count must be between 2 and 10000")
+    rnd = random.Random(seed)
+    return Catalog(
+        warehouses=[
+            (str(uuid.UUID(int=rnd.getrandbits(128))), f"WH-{index:04d}")
+            for index in range(warehouses)
+        ],
+        products=[str(uuid.UUID(int=rnd.getrandbits(128))) for _ in range(products)],
+    )
+
+
+class ZipfSampler:
+    """Выбор элемента с вероятностью ~ 1 / rank^skew (skew=0 — равномерно)"""
+
+    def __init__(self, items: list, skew: float, rnd: random.Random):
+        self.items = list(items)
+        rnd.shuffle(self.items)  # Горячие элементы — случайные, а не первые
+        self.cumulative = list(
+            itertools.accumulate(1 / rank**skew for rank in range(1, len(items) + 1))
+        )
+        self.rnd = rnd
+
+    def __call__(self):
+        point = self.rnd.random() * self.cumulative[-1]
+        return self.items[bisect.bisect_right(self.cumulative, point)]
+
+
+class EventGenerator:
+    """
+    Поток событий в порядке доставки. Перемещение — отгрузка со склада и
+    приемка на другом складе спустя логнормальное время в пути; часть
+    приемок приходит с недостачей, часть — раньше своей отгрузки.
+    """
+
+    def __init__(
+        self,
+        catalog: Catalog,
+        seed: int,
+        skew: float = 1.1,
+        events_per_second: float = 50.0,
+        shortage_rate: float = 0.05,
+        reorder_rate: float = 0.02,
+        start: Optional[datetime] = None,
+    ):
+        self.rnd = random.Random(seed)
+        self.warehouses = ZipfSampler(catalog.warehouses, skew, self.rnd)
+        self.products = ZipfSampler(catalog.products, skew, self.rnd)
+        self.events_per_second = events_per_second
+        self.shortage_rate = shortage_rate
+        self.reorder_rate = reorder_rate
+        self.clock = start or datetime.now(timezone.utc) - timedelta(days=7)
+
+    def events(self, count: int) -> list[dict]:
+        return list(itertools.islice(self, count))
+
+    def __iter__(self) -> Iterator[dict]:
+        # Куча (время доставки, порядковый номер, сообщение): приемки ждут
+        # своего времени, пока генерируются новые отгрузки
+        pending: list[tuple[datetime, int, dict]] = []
+        sequence = itertools.count()
+        while True:
+            departure_at = self._tick()
+            while pending and pending[0][0] <= departure_at:
+                yield heapq.heappop(pending)[2]
+
+            departure, arrival, arrival_at = self._movement(departure_at)
+            if self.rnd.random() < self.reorder_rate:
+                # Приемка доставлена раньше отгрузки
+                yield arrival
+                yield departure
+            else:
+                yield departure
+                heapq.heappush(pending, (arrival_at, next(sequence), arrival))
+
+    def _tick(self) -> datetime:
+        # Отгрузки — пуассоновский поток; каждая дает два события
+        rate = self.events_per_second / 2
+        self.clock += timedelta(seconds=self.rnd.expovariate(rate))
+        return self.clock
+
+    def _movement(self, departure_at: datetime) -> tuple[dict, dict, datetime]:
+        source = self.warehouses()
+        destination = self.warehouses()
+        while destination == source:
+            destination = self.warehouses()
+        product_id = self.products()
+        movement_id = str(uuid.UUID(int=self.rnd.getrandbits(128)))
+        quantity = max(1, int(self.rnd.lognormvariate(3, 1)))
+        received = quantity
+        if self.rnd.random() < self.shortage_rate:
+            received = self.rnd.randint(max(1, quantity // 2), quantity)
+        # Медиана времени в пути — около 8 часов
+        arrival_at = departure_at + timedelta(hours=self.rnd.lognormvariate(2, 0.7))
+        departure = self._message(
+            "departure", movement_id, source, product_id, quantity, departure_at
+        )
+        arrival = self._message(
+            "arrival", movement_id, destination, product_id, received, arrival_at
+        )
+        return departure, arrival, arrival_at
+
+    def _message(
+        self,
+        event: str,
+        movement_id: str,
+        warehouse: tuple[str, str],
+        product_id: str,
+        quantity: int,
+        moment: datetime,
+    ) -> dict:
+        warehouse_id, code = warehouse
+        return {
+            "id": str(uuid.UUID(int=self.rnd.getrandbits(128))),
+            "source": code,
+            "specversion": "1.0",
+            "type": CLOUD_EVENT_TYPE,
+            "datacontenttype": "application/json",
+            "dataschema": f"{CLOUD_EVENT_TYPE}.v1.0",
+            "time": int(moment.timestamp() * 1000),
+            "subject": f"{code}:{event.upper()}",
+            "destination": "ru.retail.warehouses",
+            "data": {
+                "movement_id": movement_id,
+                "warehouse_id": warehouse_id,
+                "timestamp": moment.isoformat(),
+                "event": event,
+                "product_id": product_id,
+                "quantity": quantity,
+            },
+        }
@@ -0,0 +1,222 @@
+"""
+Сравнение наборов индексов таблицы movements: скорость вставки и задержка
+типовых выборок.
+
+Обе таблицы создаются копией структуры public.movements (LIKE, без индексов
+и внешних ключей) во временной схеме, поэтому нужна БД с примененными
+миграциями. Запуск:
+
+    python -m benchmarks.movement_indexes --rows 200000 --lookups 2000
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, create_async_engine
+
+from app.config import settings
+
+SCHEMA = "bench_movement_indexes"
+
+# (имя, колонки, предикат частичного индекса)
+INDEX_SETS = {
+    # Состояние после миграции 0002: по индексу на каждую колонку, с дублями
+    "baseline": [
+        ("kafka_id", "kafka_movement_id", None),
+        ("product", "product_id", None),
+        ("status", "status", None),
+        ("status_dup", "status", None),
+        ("product_dup", "product_id", None),
+        ("source", "source_warehouse_id", None),
+        ("destination", "destination_warehouse_id", None),
+        ("departure_time", "departure_time", None),
+        ("arrival_time", "arrival_time", None),
+    ],
+    # Текущая схема (миграции 0008 и 0012): keyset-индексы по (recorded_at, id)
+    # и частичные индексы непарных половин
+    "tuned": [
+        ("recorded", "recorded_at, id", None),
+        ("product", "product_id, recorded_at, id", None),
+        ("source", "source_warehouse_id, recorded_at, id", None),
+        ("destination", "destination_warehouse_id, recorded_at, id", None),
+        ("in_transit", "kafka_movement_id", "status = 'IN_TRANSIT'"),
+        ("awaiting_departure", "kafka_movement_id", "awaiting_departure"),
+    ],
+}
+
+LOOKUPS = {
+    "arrival_match": (
+        "SELECT id FROM {table} "
+        "WHERE kafka_movement_id = :key AND status = 'IN_TRANSIT'"
+    ),
+    "departure_match": (
+        "SELECT id FROM {table} WHERE kafka_movement_id = :key AND awaiting_departure"
+    ),
+    # Страница GET /movements с фильтром по складу назначения
+    "destination_history": (
+        "SELECT recorded_at, id FROM {table} "
+        "WHERE destination_warehouse_id = :warehouse_id AND recorded_at >= :since "
+        "ORDER BY recorded_at DESC, id DESC LIMIT 50"
+    ),
+}
+
+INSERT = (
+    "INSERT INTO {table} (id, kafka_movement_id, source_warehouse_id, "
+    "destination_warehouse_id, product_id, quantity, departure_time, arrival_time, "
+    "status, quantity_diff, recorded_at, awaiting_departure) VALUES (:id, "
+    ":kafka_movement_id, :source_warehouse_id, :destination_warehouse_id, "
+    ":product_id, :quantity, :departure_time, :arrival_time, "
+    "CAST(:status AS movementstatus), :quantity_diff, :recorded_at, "
+    ":awaiting_departure)"
+)
+
+
+def generate_rows(count: int, warehouses: list[str], seed: int) -> list[dict]:
+    """
+    Перемещения за последние 90 дней; около 5% еще в пути и около 1% —
+    приемки, ждущие отгрузку
+    """
+    rnd = random.Random(seed)
+    products = [str(uuid.UUID(int=rnd.getrandbits(128))) for _ in range(count // 20)]
+    now = datetime.now(timezone.utc)
+    rows = []
+    for _ in range(count):
+        source, destination = rnd.sample(warehouses, 2)
+        departure = now - timedelta(seconds=rnd.randrange(90 * 86400))
+        quantity = rnd.randint(1, 100)
+        chance = rnd.random()
+        in_transit, awaiting = chance < 0.05, 0.05 <= chance < 0.06
+        arrival = departure + timedelta(hours=rnd.randint(1, 72))
+        rows.append(
+            {
+                "id": str(uuid.UUID(int=rnd.getrandbits(128))),
+                "kafka_movement_id": str(uuid.UUID(int=rnd.getrandbits(128))),
+                "source_warehouse_id": None if awaiting else source,
+                "destination_warehouse_id": None if in_transit else destination,
+                "product_id": rnd.choice(products),
+                "quantity": quantity,
+                "departure_time": None if awaiting else departure,
+                "arrival_time": None if in_transit else arrival,
+                "status": "IN_TRANSIT" if in_transit else "COMPLETED",
+                "quantity_diff": None if in_transit else rnd.randint(0, 2),
+                "recorded_at": arrival if awaiting else departure,
+                "awaiting_departure": awaiting,
+            }
+        )
+    return rows
+
+
+def percentiles(samples: list[float]) -> dict:
+    cuts = statistics.quantiles(samples, n=100)
+    return {
+        "p50_ms": round(cuts[49] * 1000, 3),
+        "p95_ms": round(cuts[94] * 1000, 3),
+        "p99_ms": round(cuts[98] * 1000, 3),
+    }
+
+
+async def run_variant(
+    conn: AsyncConnection, variant: str, rows: list[dict], args
+) -> dict:
+    table = f"{SCHEMA}.movements_{variant}"
+    await conn.execute(
+        text(
+            f"CREATE TABLE {table} "
+            "(LIKE public.movements INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+        )
+    )
+    for name, columns, where in INDEX_SETS[variant]:
+        predicate = f" WHERE {where}" if where else ""
+        await conn.execute(
+            text(f"CREATE INDEX ix_{variant}_{name} ON {table} ({columns}){predicate}")
+        )
+    await conn.commit()
+
+    insert = text(INSERT.format(table=table))
+    started = time.perf_counter()
+    for offset in range(0, len(rows), args.batch):
+        await conn.execute(insert, rows[offset : offset + args.batch])
+        await conn.commit()
+    insert_seconds = time.perf_counter() - started
+    await conn.execute(text(f"ANALYZE {table}"))
+    await conn.commit()
+
+    rnd = random.Random(args.seed)
+    in_transit = [row for row in rows if row["status"] == "IN_TRANSIT"]
+    awaiting = [row for row in rows if row["awaiting_departure"]]
+    completed = [row for row in rows if row["status"] == "COMPLETED"]
+    lookups = {}
+    for name, sql in LOOKUPS.items():
+        stmt = text(sql.format(table=table))
+        samples = []
+        for _ in range(args.lookups):
+            if name == "arrival_match":
+                params = {"key": rnd.choice(in_transit)["kafka_movement_id"]}
+            elif name == "departure_match":
+                params = {"key": rnd.choice(awaiting)["kafka_movement_id"]}
+            else:
+                row = rnd.choice(completed)
+                params = {
+                    "warehouse_id": row["destination_warehouse_id"],
+                    "since": row["recorded_at"],
+                }
+            query_started = time.perf_counter()
+            (await conn.execute(stmt, params)).all()
+            samples.append(time.perf_counter() - query_started)
+        lookups[name] = percentiles(samples)
+    await conn.commit()
+
+    index_bytes = await conn.scalar(text(f"SELECT pg_indexes_size('{table}')"))
+    return {
+        "indexes": len(INDEX_SETS[variant]),
+        "index_mb": round(index_bytes / 1024 / 1024, 1),
+        "insert_rows_per_sec": round(len(rows) / insert_seconds),
+        "lookups": lookups,
+    }
+
+
+async def main(args):
+    engine = create_async_engine(settings.database_url)
+    rnd = random.Random(args.seed)
+    warehouses = [str(uuid.UUID(int=rnd.getrandbits(128))) for _ in range(50)]
+    rows = generate_rows(args.rows, warehouses, args.seed)
+    report = {"rows": args.rows, "batch": args.batch, "variants": {}}
+    try:
+        async with engine.connect() as conn:
+            await conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+            await conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+            await conn.commit()
+            try:
+                for variant in INDEX_SETS:
+                    report["variants"][variant] = await run_variant(
+                        conn, variant, rows, args
+                    )
+            finally:
+                await conn.rollback()
+                await conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+                await conn.commit()
+    finally:
+        await engine.dispose()
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--batch", type=int, default=1000)
+    parser.add_argument("--lookups", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Сохранить отчет в JSON-файл")
+    asyncio.run(main(parser.parse_args()))
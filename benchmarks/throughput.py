@@ -0,0 +1,374 @@
+"""
+Нагрузочный замер путей записи и чтения: обработка событий, вебхуки и
+чтение остатков/перемещений. Для каждого сценария — событий (запросов) в
+секунду, задержка p50/p95/p99 и число обращений к БД на событие.
+
+Схема создается по моделям во временной схеме локального Postgres, кэш —
+локальный Redis из настроек; API вызывается в процессе через ASGI.
+Отчет сохраняется в JSON; с --baseline в него добавляется сравнение
+с прошлым отчетом. Запуск:
+
+    python -m benchmarks.throughput --events 20000 --concurrency 8 \\
+        --output benchmarks/results/$(git rev-parse --short HEAD).json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import AsyncGenerator, Awaitable, Callable, Iterable
+
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy import event, insert, select, text
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
+
+from app.api.v1.schemas import KafkaFullMessage
+from app.config import settings
+from app.db.base import Base
+from app.db.models import Movement, Product, StockItem, Warehouse
+from app.db.session import get_session_dependency
+from app.main import app
+from app.services.kafka_processor import process_movement_event
+from app.services.redis import (
+    cache_client,
+    get_stock_cache_key,
+    get_version_cache_key,
+    invalidate_cache,
+)
+from benchmarks.generator import EventGenerator, ZipfSampler, make_catalog
+from benchmarks.movement_indexes import percentiles
+
+SCHEMA = "bench_throughput"
+# Начальный остаток каждой пары склад/товар: отгрузки не упираются в ноль
+INITIAL_STOCK = 1_000_000
+# Метрики сравнения с прошлым отчетом: (имя, больше — лучше)
+COMPARED_METRICS = [
+    ("events_per_sec", True),
+    ("p50_ms", False),
+    ("p95_ms", False),
+    ("p99_ms", False),
+    ("db_round_trips_per_event", False),
+]
+
+
+class RoundTripCounter:
+    """Считает запросы к БД (executemany — один), BEGIN, COMMIT и ROLLBACK"""
+
+    def __init__(self, engine: AsyncEngine):
+        self.count = 0
+        for name in ("before_cursor_execute", "begin", "commit", "rollback"):
+            event.listen(engine.sync_engine, name, self._increment)
+
+    def _increment(self, *args, **kwargs):
+        self.count += 1
+
+
+async def drive(
+    items: Iterable, worker: Callable[[object], Awaitable[int]], concurrency: int
+) -> tuple[list[float], int, float]:
+    """
+    Выполняет worker для всех items в concurrency параллельных задачах.
+    worker возвращает число неуспешных событий; результат —
+    (задержки в секундах, ошибки, общее время).
+    """
+    items = iter(items)
+    samples: list[float] = []
+    errors = 0
+
+    async def run():
+        nonlocal errors
+        for item in items:
+            started = time.perf_counter()
+            try:
+                errors += await worker(item)
+            except Exception:
+                errors += 1
+            samples.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(run() for _ in range(concurrency)))
+    return samples, errors, time.perf_counter() - started
+
+
+def scenario_report(
+    samples: list[float], errors: int, seconds: float, events: int, round_trips: int
+) -> dict:
+    return {
+        "events": events,
+        "requests": len(samples),
+        "errors": errors,
+        "seconds": round(seconds, 3),
+        "events_per_sec": round(events / seconds, 1),
+        # Квантили считаются минимум по двум замерам
+        **percentiles(samples * 2 if len(samples) == 1 else samples),
+        "db_round_trips_per_event": round(round_trips / events, 2),
+    }
+
+
+def compare(report: dict, baseline: dict) -> dict:
+    """Относительное изменение метрик, %; положительное — улучшение"""
+    changes = {}
+    for name, current in report["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if not previous:
+            continue
+        changes[name] = {}
+        for metric, higher_is_better in COMPARED_METRICS:
+            if not previous.get(metric):
+                continue
+            change = (current[metric] - previous[metric]) / previous[metric] * 100
+            changes[name][metric] = round(change if higher_is_better else -change, 1)
+    return changes
+
+
+async def create_schema(engine: AsyncEngine, catalog):
+    """Схема по моделям, склады, товары и начальные остатки всех пар"""
+    async with engine.begin() as conn:
+        await conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        await conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(
+            insert(Warehouse),
+            [{"id": id_, "code": code} for id_, code in catalog.warehouses],
+        )
+        await conn.execute(insert(Product), [{"id": id_} for id_ in catalog.products])
+        await conn.execute(
+            insert(StockItem),
+            [
+                {
+                    "id": str(uuid.uuid4()),
+                    "warehouse_id": warehouse_id,
+                    "product_id": product_id,
+                    "quantity": INITIAL_STOCK,
+                }
+                for warehouse_id, _ in catalog.warehouses
+                for product_id in catalog.products
+            ],
+        )
+
+    # ID каталога детерминированы: остатки и их версии от прошлого запуска
+    # иначе остались бы в Redis и не дали бы записать новые
+    keys = [
+        get_stock_cache_key(warehouse_id, product_id)
+        for warehouse_id, _ in catalog.warehouses
+        for product_id in catalog.products
+    ]
+    for offset in range(0, len(keys), 1000):
+        chunk = keys[offset : offset + 1000]
+        await invalidate_cache(*chunk, *map(get_version_cache_key, chunk))
+
+
+async def run_process_event(session_factory, messages: list[dict], concurrency: int):
+    """process_movement_event: сессия и COMMIT на каждое событие"""
+    events = [KafkaFullMessage(**message).to_event_data() for message in messages]
+
+    async def worker(event_data: dict) -> int:
+        async with session_factory() as session:
+            await process_movement_event(session, event_data)
+            await session.commit()
+        return 0
+
+    return await drive(events, worker, concurrency), len(events)
+
+
+async def run_webhook(client: AsyncClient, messages: list[dict], concurrency: int):
+    async def worker(message: dict) -> int:
+        response = await client.post("/api/v1/kafka/webhook", json=message)
+        return int(response.status_code != 200)
+
+    return await drive(messages, worker, concurrency), len(messages)
+
+
+async def run_webhook_batch(
+    client: AsyncClient, messages: list[dict], concurrency: int, batch: int
+):
+    chunks = [messages[i : i + batch] for i in range(0, len(messages), batch)]
+
+    async def worker(chunk: list[dict]) -> int:
+        response = await client.post("/api/v1/kafka/webhook:batch", json=chunk)
+        if response.status_code != 200:
+            return len(chunk)
+        return response.json()["failed"]
+
+    return await drive(chunks, worker, concurrency), len(messages)
+
+
+async def run_stock_reads(
+    client: AsyncClient, catalog, reads: int, concurrency: int, seed: int
+):
+    rnd = random.Random(seed)
+    warehouses = ZipfSampler([id_ for id_, _ in catalog.warehouses], 1.1, rnd)
+    products = ZipfSampler(catalog.products, 1.1, rnd)
+    paths = [
+        f"/api/v1/warehouse/{warehouses()}/products/{products()}" for _ in range(reads)
+    ]
+
+    async def worker(path: str) -> int:
+        response = await client.get(path)
+        return int(response.status_code != 200)
+
+    return await drive(paths, worker, concurrency), len(paths)
+
+
+async def run_movement_reads(
+    client: AsyncClient, session_factory, reads: int, concurrency: int, seed: int
+):
+    async with session_factory() as session:
+        ids = (await session.scalars(select(Movement.id).limit(10_000))).all()
+    if not ids:
+        raise RuntimeError("No movements to read: run an ingest scenario first")
+    rnd = random.Random(seed)
+    paths = [f"/api/v1/movements/{rnd.choice(ids)}" for _ in range(reads)]
+
+    async def worker(path: str) -> int:
+        response = await client.get(path)
+        return int(response.status_code != 200)
+
+    return await drive(paths, worker, concurrency), len(paths)
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def main(args):
+    engine = create_async_engine(
+        settings.database_url,
+        pool_size=args.concurrency,
+        max_overflow=0,
+        connect_args={"server_settings": {"search_path": SCHEMA}},
+    )
+    session_factory = async_sessionmaker(
+        engine, expire_on_commit=False, autoflush=False, class_=AsyncSession
+    )
+
+    async def bench_session() -> AsyncGenerator[AsyncSession, None]:
+        async with session_factory() as session:
+            try:
+                yield session
+                await session.commit()
+            except Exception:
+                await session.rollback()
+                raise
+
+    catalog = make_catalog(args.warehouses, args.products, args.seed)
+    # Каждый сценарий записи получает свой поток событий
+    generator = EventGenerator(catalog, args.seed, skew=args.skew)
+    report = {
+        "commit": git_commit(),
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "params": {
+            name: getattr(args, name)
+            for name in (
+                "events",
+                "reads",
+                "concurrency",
+                "batch",
+                "warehouses",
+                "products",
+                "skew",
+                "seed",
+            )
+        },
+        "scenarios": {},
+    }
+
+    await cache_client.connect()
+    app.dependency_overrides[get_session_dependency] = bench_session
+    try:
+        await create_schema(engine, catalog)
+        counter = RoundTripCounter(engine)
+        async with AsyncClient(
+            transport=ASGITransport(app=app), base_url="http://bench"
+        ) as client:
+            scenarios = {
+                "process_event": lambda: run_process_event(
+                    session_factory, generator.events(args.events), args.concurrency
+                ),
+                "webhook": lambda: run_webhook(
+                    client, generator.events(args.events), args.concurrency
+                ),
+                "webhook_batch": lambda: run_webhook_batch(
+                    client, generator.events(args.events), args.concurrency, args.batch
+                ),
+                "stock_read": lambda: run_stock_reads(
+                    client, catalog, args.reads, args.concurrency, args.seed
+                ),
+                "movement_read": lambda: run_movement_reads(
+                    client, session_factory, args.reads, args.concurrency, args.seed
+                ),
+            }
+            for name in args.scenarios or scenarios:
+                counter.count = 0
+                (samples, errors, seconds), events = await scenarios[name]()
+                report["scenarios"][name] = scenario_report(
+                    samples, errors, seconds, events, counter.count
+                )
+    finally:
+        app.dependency_overrides.pop(get_session_dependency, None)
+        await cache_client.close()
+        if not args.keep:
+            async with engine.begin() as conn:
+                await conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        await engine.dispose()
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        report["baseline"] = {
+            "commit": baseline.get("commit"),
+            "changes_pct": compare(report, baseline),
+        }
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--events", type=int, default=20_000)
+    parser.add_argument("--reads", type=int, default=20_000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--batch", type=int, default=500, help="Сообщений в пачке")
+    parser.add_argument("--warehouses", type=int, default=50)
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--skew", type=float, default=1.1, help="Показатель Zipf")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument(
+        "--scenarios",
+        nargs="+",
+        choices=[
+            "process_event",
+            "webhook",
+            "webhook_batch",
+            "stock_read",
+            "movement_read",
+        ],
+        help="Сценарии по порядку (по умолчанию — все)",
+    )
+    parser.add_argument("--keep", action="store_true", help="Не удалять схему")
+    parser.add_argument("--baseline", help="Прошлый отчет для сравнения")
+    parser.add_argument("--output", help="Сохранить отчет в JSON-файл")
+    asyncio.run(main(parser.parse_args()))
@@ -1,6 +1,6 @@
 import pytest_asyncio
 import asyncio
-from httpx import AsyncClient
+from httpx import ASGITransport, AsyncClient
 from typing import AsyncGenerator, Generator
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.pool import NullPool
@@ -57,7 +57,9 @@ async def client(db_session: AsyncSession) -> AsyncGenerator[AsyncClient, None]:
 
     app.dependency_overrides[get_session_dependency] = override_get_session
 
-    async with AsyncClient(app=app, base_url="http://test") as async_client:
+    async with AsyncClient(
+        transport=ASGITransport(app=app), base_url="http://test"
+    ) as async_client:
         yield async_client
 
     # Очистка подмены после теста
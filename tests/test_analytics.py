@@ -0,0 +1,103 @@
+import uuid
+
+import pytest
+from httpx import AsyncClient
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.models import Product
+from app.services.kafka_processor import process_movement_event, process_movement_events
+from app.services.rollups import bucket_index, estimate_quantile, HISTOGRAM_BUCKETS
+from tests.test_kafka_processor import create_warehouse, make_event
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_quantile_estimate_within_bucket_error():
+    histogram = [0] * HISTOGRAM_BUCKETS
+    for seconds in range(1, 1001):
+        histogram[bucket_index(seconds * 60)] += 1
+
+    assert estimate_quantile(histogram, 0.5) == pytest.approx(500 * 60, rel=0.1)
+    assert estimate_quantile(histogram, 0.99) == pytest.approx(990 * 60, rel=0.1)
+
+
+async def test_route_analytics_from_rollups(
+    client: AsyncClient, db_session: AsyncSession
+):
+    # Arrange: два перемещения по маршруту — поштучно и пакетом
+    product_id = str(uuid.uuid4())
+    db_session.add(Product(id=product_id))
+    source_id = await create_warehouse(db_session, {product_id: 100})
+    destination_id = await create_warehouse(db_session)
+    first, second = uuid.uuid4(), uuid.uuid4()
+    for event_data in [
+        make_event("departure", first, source_id, product_id, 10),
+        make_event("arrival", first, destination_id, product_id, 9)
+        | {"timestamp": "2025-02-18T14:12:56+00:00"},
+    ]:
+        await process_movement_event(db_session, event_data)
+    await process_movement_events(
+        db_session,
+        [
+            make_event("departure", second, source_id, product_id, 10),
+            make_event("arrival", second, destination_id, product_id, 10)
+            | {"timestamp": "2025-02-18T18:12:56+00:00"},
+        ],
+    )
+    await db_session.flush()
+
+    # Act
+    response = await client.get(
+        "/api/v1/analytics/routes", params={"source_warehouse_id": source_id}
+    )
+
+    # Assert: перемещения длились 2 и 6 часов, недостача — 1 штука
+    assert response.status_code == 200
+    [route] = response.json()
+    assert route["destination_warehouse_id"] == destination_id
+    assert route["movements_count"] == 2
+    assert route["transit_seconds_avg"] == 4 * 3600
+    assert (route["transit_seconds_min"], route["transit_seconds_max"]) == (
+        2 * 3600,
+        6 * 3600,
+    )
+    assert route["quantity_diff_sum"] == 1
+
+
+async def test_product_analytics_merges_days_and_routes(
+    client: AsyncClient, db_session: AsyncSession
+):
+    # Arrange: товар прибывал на разные склады в разные дни — строки агрегатов
+    # по дням и маршрутам
+    product_id = str(uuid.uuid4())
+    db_session.add(Product(id=product_id))
+    source_id = await create_warehouse(db_session, {product_id: 100})
+    events = []
+    arrivals = ["2025-02-18T13:12:56+00:00"] * 2 + ["2025-02-20T12:12:56+00:00"] * 2
+    for arrived_at in arrivals:
+        movement_id = uuid.uuid4()
+        destination_id = await create_warehouse(db_session)
+        events += [
+            make_event("departure", movement_id, source_id, product_id, 5),
+            make_event("arrival", movement_id, destination_id, product_id, 5)
+            | {"timestamp": arrived_at},
+        ]
+    await process_movement_events(db_session, events)
+    await db_session.flush()
+
+    # Act
+    response = await client.get(
+        "/api/v1/analytics/products", params={"product_id": product_id}
+    )
+
+    # Assert: по два перемещения длились час и двое суток; квантили сходятся,
+    # только если гистограммы обоих дней сложены
+    assert response.status_code == 200
+    [product] = response.json()
+    assert product["movements_count"] == 4
+    assert (product["transit_seconds_min"], product["transit_seconds_max"]) == (
+        3600,
+        48 * 3600,
+    )
+    assert product["transit_seconds_p50"] == pytest.approx(3600, rel=0.1)
+    assert product["transit_seconds_p90"] == pytest.approx(48 * 3600, rel=0.1)
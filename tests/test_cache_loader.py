@@ -0,0 +1,77 @@
+import asyncio
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from app.services.cache_loader import SingleFlight, get_or_load
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_single_flight_coalesces_concurrent_calls():
+    single_flight = SingleFlight()
+    calls = 0
+
+    async def load():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return calls
+
+    results = await asyncio.gather(*(single_flight.do("key", load) for _ in range(10)))
+
+    assert calls == 1
+    assert results == [1] * 10
+    assert not single_flight.in_flight("key")
+
+
+async def test_single_flight_shares_errors():
+    single_flight = SingleFlight()
+
+    async def load():
+        await asyncio.sleep(0.01)
+        raise ConnectionError("db is down")
+
+    results = await asyncio.gather(
+        *(single_flight.do("key", load) for _ in range(3)), return_exceptions=True
+    )
+
+    assert all(isinstance(result, ConnectionError) for result in results)
+
+
+async def test_get_or_load_loads_miss_once():
+    async def select_stock(session):
+        await asyncio.sleep(0.01)
+        return {"quantity": 5}
+
+    loader = AsyncMock(side_effect=select_stock)
+
+    async def slow_miss(key):
+        await asyncio.sleep(0.01)
+        return None, None
+
+    with patch(
+        "app.services.cache_loader.get_cache_json_with_ttl", side_effect=slow_miss
+    ):
+        results = await asyncio.gather(
+            *(get_or_load("stock:a:b", loader, session=None) for _ in range(5))
+        )
+
+    loader.assert_awaited_once_with(None)
+    assert results == [b'{"quantity":5}'] * 5
+
+
+async def test_get_or_load_refreshes_expiring_key_in_background():
+    loader = AsyncMock(return_value={"quantity": 6})
+
+    with patch(
+        "app.services.cache_loader.get_cache_json_with_ttl",
+        return_value=(b'{"quantity":5}', 1000),  # истекает через секунду
+    ), patch("app.services.cache_loader._refresh", new_callable=AsyncMock) as refresh:
+        result = await get_or_load("stock:a:b", loader, session=None)
+        await asyncio.sleep(0)
+
+    # Отдается текущее значение, обновление идет в фоне
+    assert result == b'{"quantity":5}'
+    loader.assert_not_awaited()
+    refresh.assert_awaited_once_with("stock:a:b", loader)
@@ -0,0 +1,44 @@
+import uuid
+from unittest.mock import patch
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.services.id_registry import IdRegistry
+from app.services.kafka_processor import _ensure_product
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_registry_evicts_lru_and_expired_entries():
+    registry = IdRegistry(max_size=2, ttl_seconds=60)
+    registry.add("a", "b")
+    assert registry.known("a")  # "a" становится самым свежим
+    registry.add("c")  # вытесняет "b"
+
+    assert not registry.known("b")
+    assert registry.known("c")
+    with patch("app.services.id_registry.time.monotonic", return_value=1e12):
+        assert not registry.known("a")  # TTL истек
+
+    assert registry.stats() == {"size": 1, "hits": 2, "misses": 2, "hit_ratio": 0.5}
+
+
+async def test_registry_filled_only_after_commit(db_session: AsyncSession):
+    registry = IdRegistry(max_size=10, ttl_seconds=60)
+    rolled_back, committed = uuid.uuid4(), uuid.uuid4()
+
+    with patch("app.services.kafka_processor.product_registry", registry):
+        try:
+            async with db_session.begin_nested():
+                await _ensure_product(db_session, rolled_back)
+                raise ValueError("event rejected")
+        except ValueError:
+            pass
+        await _ensure_product(db_session, committed)
+        assert registry.stats()["size"] == 0
+
+        await db_session.commit()
+
+    assert not registry.known(rolled_back)
+    assert registry.known(committed)
@@ -0,0 +1,389 @@
+import asyncio
+import json
+import uuid
+from contextlib import asynccontextmanager
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from aiokafka import ConsumerRecord, TopicPartition
+from sqlalchemy.exc import IntegrityError
+
+from app.services.kafka_consumer import (
+    Backpressure,
+    KafkaConsumer,
+    PartitionOffsetTracker,
+)
+from app.services.kafka_processor import MovementEventResult
+
+pytestmark = pytest.mark.asyncio
+
+
+def make_record(partition: int, offset: int, payload) -> ConsumerRecord:
+    value = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+    return ConsumerRecord(
+        topic="warehouse_movements",
+        partition=partition,
+        offset=offset,
+        timestamp=0,
+        timestamp_type=0,
+        key=None,
+        value=value,
+        checksum=None,
+        serialized_key_size=0,
+        serialized_value_size=len(value),
+        headers=(),
+    )
+
+
+def make_event(quantity: int = 10) -> dict:
+    return {
+        "movement_id": str(uuid.uuid4()),
+        "warehouse_id": str(uuid.uuid4()),
+        "product_id": str(uuid.uuid4()),
+        "quantity": quantity,
+        "timestamp": "2025-02-18T12:12:56Z",
+        "event": "departure",
+    }
+
+
+@pytest.fixture
+def kafka_consumer() -> KafkaConsumer:
+    with patch("app.services.kafka_consumer.AIOKafkaConsumer") as consumer_cls:
+        consumer_cls.return_value = MagicMock(commit=AsyncMock())
+        return KafkaConsumer(mode="batch")
+
+
+@pytest.fixture
+def mock_session():
+    session = MagicMock()
+    session.commit = AsyncMock()
+
+    @asynccontextmanager
+    async def begin_nested():
+        yield
+
+    session.begin_nested = begin_nested
+
+    @asynccontextmanager
+    async def get_session():
+        yield session
+
+    with patch("app.services.kafka_consumer.get_scoped_session", get_session):
+        yield session
+
+
+async def test_batch_isolates_poison_messages(kafka_consumer, mock_session):
+    # Arrange: валидное, битое и отвергнутое сообщение в двух партициях
+    tp0 = TopicPartition("warehouse_movements", 0)
+    tp1 = TopicPartition("warehouse_movements", 1)
+    batch = {
+        tp0: [make_record(0, 5, make_event()), make_record(0, 6, b"not json")],
+        tp1: [make_record(1, 41, make_event())],
+    }
+    results = [MovementEventResult(), MovementEventResult(error="Insufficient stock")]
+
+    # Act
+    with patch(
+        "app.services.kafka_processor.process_movement_events", return_value=results
+    ) as mock_process:
+        await kafka_consumer._process_batch(batch)
+
+    # Assert: пачка обработана одним вызовом и закоммичена один раз
+    assert len(mock_process.call_args[0][1]) == 2
+    mock_session.commit.assert_awaited_once()
+    kafka_consumer.consumer.commit.assert_awaited_once_with({tp0: 7, tp1: 42})
+
+
+async def test_batch_skips_non_object_json(kafka_consumer, mock_session):
+    # Arrange: валидный JSON, но не объект — не должен останавливать партицию
+    tp0 = TopicPartition("warehouse_movements", 0)
+    batch = {
+        tp0: [
+            make_record(0, offset, payload)
+            for offset, payload in enumerate([b"null", b"123", b"[1]", b'"x"'])
+        ]
+        + [make_record(0, 4, make_event())]
+    }
+
+    # Act
+    with patch(
+        "app.services.kafka_processor.process_movement_events",
+        return_value=[MovementEventResult()],
+    ) as mock_process:
+        await kafka_consumer._process_batch(batch)
+
+    # Assert: применено только валидное событие, offset'ы закоммичены
+    assert len(mock_process.call_args[0][1]) == 1
+    kafka_consumer.consumer.seek.assert_not_called()
+    kafka_consumer.consumer.commit.assert_awaited_once_with({tp0: 5})
+
+
+async def test_batch_falls_back_to_single_events(kafka_consumer, mock_session):
+    # Arrange: пакетная запись падает, одно из событий отвергается поштучно
+    tp0 = TopicPartition("warehouse_movements", 0)
+    rejected = make_event()
+    batch = {tp0: [make_record(0, 5, make_event()), make_record(0, 6, rejected)]}
+
+    async def process(db, event_data):
+        if event_data["movement_id"] == rejected["movement_id"]:
+            raise ValueError("Insufficient stock")
+
+    # Act
+    with patch(
+        "app.services.kafka_processor.process_movement_events",
+        side_effect=IntegrityError("INSERT", {}, Exception("conflict")),
+    ), patch(
+        "app.services.kafka_processor.process_movement_event", side_effect=process
+    ) as mock_process:
+        await kafka_consumer._process_batch(batch)
+
+    # Assert
+    assert mock_process.await_count == 2
+    mock_session.commit.assert_awaited_once()
+    kafka_consumer.consumer.commit.assert_awaited_once_with({tp0: 7})
+
+
+async def test_batch_rewinds_on_transaction_failure(kafka_consumer, mock_session):
+    tp0 = TopicPartition("warehouse_movements", 0)
+    batch = {tp0: [make_record(0, 5, make_event()), make_record(0, 6, make_event())]}
+    mock_session.commit.side_effect = ConnectionError("connection lost")
+
+    with patch("app.services.kafka_processor.process_movement_events"), patch(
+        "app.services.kafka_consumer.RETRY_BACKOFF_SECONDS", 0
+    ):
+        await kafka_consumer._process_batch(batch)
+
+    kafka_consumer.consumer.seek.assert_called_once_with(tp0, 5)
+    kafka_consumer.consumer.commit.assert_not_awaited()
+
+
+
+async def test_batch_skips_failing_record_after_max_retries(
+    kafka_consumer, mock_session
+):
+    # Arrange: пачка падает при каждой попытке из-за одной записи
+    tp0 = TopicPartition("warehouse_movements", 0)
+    batch = {tp0: [make_record(0, 5, make_event()), make_record(0, 6, make_event())]}
+    mock_session.commit.side_effect = [
+        TypeError("bad record"),
+        TypeError("bad record"),
+        TypeError("bad record"),  # первая запись отдельно
+        None,  # вторая запись отдельно
+    ]
+
+    # Act: первая попытка и последняя (KAFKA_MAX_RETRIES = 2)
+    with patch("app.services.kafka_processor.process_movement_events"), patch(
+        "app.services.kafka_consumer.RETRY_BACKOFF_SECONDS", 0
+    ), patch("app.services.kafka_consumer.settings.KAFKA_MAX_RETRIES", 2):
+        await kafka_consumer._process_batch(batch)
+        await kafka_consumer._process_batch(batch)
+
+    # Assert: один откат, затем записи по одной и commit за всю пачку
+    kafka_consumer.consumer.seek.assert_called_once_with(tp0, 5)
+    assert mock_session.commit.await_count == 4
+    kafka_consumer.consumer.commit.assert_awaited_once_with({tp0: 7})
+    assert kafka_consumer._batch_failures == 0
+
+async def test_single_retries_message_after_transaction_failure(mock_session):
+    # Arrange: транзакция первого сообщения партиции падает
+    with patch("app.services.kafka_consumer.AIOKafkaConsumer") as consumer_cls:
+        consumer_cls.return_value = MagicMock(commit=AsyncMock())
+        kafka_consumer = KafkaConsumer(mode="single")
+    tp0, tp1 = (TopicPartition("warehouse_movements", p) for p in (0, 1))
+    fetched = [
+        {
+            tp0: [make_record(0, 5, make_event()), make_record(0, 6, make_event())],
+            tp1: [make_record(1, 9, make_event())],
+        }
+    ]
+    mock_session.commit.side_effect = [ConnectionError("connection lost"), None]
+
+    async def poll():
+        if fetched:
+            return fetched.pop()
+        kafka_consumer._stopping.set()
+        return {}
+
+    # Act
+    with patch("app.services.kafka_consumer.process_movement_event"), patch(
+        "app.services.kafka_consumer.RETRY_BACKOFF_SECONDS", 0
+    ), patch.object(kafka_consumer, "_poll_batch", side_effect=poll):
+        await kafka_consumer._consume_single()
+
+    # Assert: партиция возвращена к сбойному сообщению, следующее
+    # не закоммичено поверх него; другая партиция обработана
+    kafka_consumer.consumer.seek.assert_called_once_with(tp0, 5)
+    kafka_consumer.consumer.commit.assert_awaited_once_with({tp1: 10})
+
+
+
+async def test_single_skips_message_after_max_retries(mock_session):
+    # Arrange: первое сообщение падает при каждой попытке
+    with patch("app.services.kafka_consumer.AIOKafkaConsumer") as consumer_cls:
+        consumer_cls.return_value = MagicMock(commit=AsyncMock())
+        kafka_consumer = KafkaConsumer(mode="single")
+    tp0 = TopicPartition("warehouse_movements", 0)
+    fetched = [
+        {tp0: [make_record(0, 5, make_event()), make_record(0, 6, make_event())]}
+        for _ in range(2)
+    ]
+    mock_session.commit.side_effect = [TypeError("bad record")] * 2 + [None]
+
+    async def poll():
+        if fetched:
+            return fetched.pop()
+        kafka_consumer._stopping.set()
+        return {}
+
+    # Act
+    with patch("app.services.kafka_consumer.process_movement_event"), patch(
+        "app.services.kafka_consumer.RETRY_BACKOFF_SECONDS", 0
+    ), patch("app.services.kafka_consumer.settings.KAFKA_MAX_RETRIES", 2), patch.object(
+        kafka_consumer, "_poll_batch", side_effect=poll
+    ):
+        await kafka_consumer._consume_single()
+
+    # Assert: после второго сбоя сообщение пропущено, следующее применено
+    kafka_consumer.consumer.seek.assert_called_once_with(tp0, 5)
+    commits = kafka_consumer.consumer.commit.await_args_list
+    assert [call.args[0] for call in commits] == [{tp0: 6}, {tp0: 7}]
+
+async def test_offset_tracker_commits_only_contiguous_prefix():
+    tracker = PartitionOffsetTracker()
+    for offset in (10, 11, 12, 13):
+        tracker.track(offset)
+
+    tracker.done(12)
+    assert tracker.watermark is None  # 10 и 11 еще в обработке
+
+    tracker.done(10)
+    assert tracker.watermark == 11
+
+    tracker.done(11)
+    assert tracker.watermark == 13
+    assert tracker.in_flight == 1
+
+
+async def test_parallel_commits_watermarks(kafka_consumer):
+    tp0 = TopicPartition("warehouse_movements", 0)
+    tracker = kafka_consumer.trackers.setdefault(tp0, PartitionOffsetTracker())
+    for offset in (3, 4):
+        tracker.track(offset)
+    tracker.done(3)
+
+    await kafka_consumer._commit_watermarks()
+    await kafka_consumer._commit_watermarks()  # watermark не сдвинулся
+
+    kafka_consumer.consumer.commit.assert_awaited_once_with({tp0: 4})
+
+
+
+async def test_worker_skips_failing_record_after_max_retries(
+    kafka_consumer, mock_session
+):
+    # Arrange: транзакция воркера падает при каждой попытке из-за одной записи
+    tracker = PartitionOffsetTracker()
+    queue = asyncio.Queue()
+    for offset in (3, 4):
+        tracker.track(offset)
+        position = f"warehouse_movements[0]@{offset}"
+        queue.put_nowait((tracker, offset, make_event(), position))
+    mock_session.commit.side_effect = [
+        TypeError("bad record"),
+        TypeError("bad record"),
+        TypeError("bad record"),  # первая запись отдельно
+        None,  # вторая запись отдельно
+    ]
+
+    # Act
+    with patch("app.services.kafka_processor.process_movement_events"), patch(
+        "app.services.kafka_consumer.RETRY_BACKOFF_SECONDS", 0
+    ), patch("app.services.kafka_consumer.settings.KAFKA_MAX_RETRIES", 2):
+        worker = asyncio.create_task(kafka_consumer._worker(queue))
+        await asyncio.wait_for(queue.join(), 5)
+        worker.cancel()
+
+    # Assert: записи завершены, watermark партиции продвинулся
+    assert mock_session.commit.await_count == 4
+    assert tracker.watermark == 5
+
+async def test_revoke_waits_for_queued_records(kafka_consumer):
+    # Arrange: записи отзываемой партиции еще у воркеров
+    kafka_consumer.mode = "parallel"
+    tp0 = TopicPartition("warehouse_movements", 0)
+    tracker = kafka_consumer.trackers.setdefault(tp0, PartitionOffsetTracker())
+    for offset in (3, 4):
+        tracker.track(offset)
+
+    # Act
+    revoke = asyncio.create_task(kafka_consumer._on_partitions_revoked({tp0}))
+    await asyncio.sleep(0)
+    assert not revoke.done()
+    tracker.done(3)
+    tracker.done(4)
+    await asyncio.wait_for(revoke, 1)
+
+    # Assert: закоммичено все обработанное, очереди партиции не применяются
+    kafka_consumer.consumer.commit.assert_awaited_once_with({tp0: 5})
+    assert tracker.revoked
+    assert tp0 not in kafka_consumer.trackers
+
+
+async def test_backpressure_pauses_and_resumes_with_hysteresis(kafka_consumer):
+    # Arrange
+    tp0 = TopicPartition("warehouse_movements", 0)
+    kafka_consumer.consumer.assignment.return_value = {tp0}
+    kafka_consumer.consumer.paused.return_value = {tp0}
+
+    # Act + Assert: пул занят — чтение приостановлено
+    with patch("app.services.kafka_consumer.pool_usage", return_value=0.95):
+        kafka_consumer._apply_backpressure()
+    kafka_consumer.consumer.pause.assert_called_once_with(tp0)
+
+    # Ниже порога, но выше порога возобновления — пауза держится
+    with patch("app.services.kafka_consumer.pool_usage", return_value=0.6):
+        kafka_consumer._apply_backpressure()
+    kafka_consumer.consumer.resume.assert_not_called()
+
+    with patch("app.services.kafka_consumer.pool_usage", return_value=0.3):
+        kafka_consumer._apply_backpressure()
+    kafka_consumer.consumer.resume.assert_called_once_with(tp0)
+
+
+async def test_backpressure_probes_slow_database_after_cooldown():
+    backpressure = Backpressure()
+    backpressure.observe(3.0)  # транзакции дольше KAFKA_PAUSE_DB_LATENCY_MS
+
+    assert backpressure.check(0, 0.0, now=100.0) == "db_latency"
+    assert backpressure.check(0, 0.0, now=101.0) == "db_latency"
+    # После паузы — пробная пачка, затем снова пауза, пока БД медленная
+    assert backpressure.check(0, 0.0, now=106.0) is None
+    assert backpressure.check(0, 0.0, now=106.1) == "db_latency"
+
+
+async def test_shutdown_finishes_batch_in_flight(kafka_consumer, mock_session):
+    # Arrange: остановку запрашивают посреди транзакции пачки
+    tp0 = TopicPartition("warehouse_movements", 0)
+    fetched = [{tp0: [make_record(0, 5, make_event())]}]
+    kafka_consumer.consumer.start = AsyncMock()
+    kafka_consumer.consumer.stop = AsyncMock()
+    kafka_consumer.consumer.getmany = AsyncMock(
+        side_effect=lambda **kwargs: fetched.pop() if fetched else {}
+    )
+
+    async def process(db, events):
+        asyncio.create_task(kafka_consumer.shutdown(timeout=5))
+        await asyncio.sleep(0)
+        return [MovementEventResult()]
+
+    # Act
+    with patch(
+        "app.services.kafka_processor.process_movement_events", side_effect=process
+    ):
+        kafka_consumer.start()
+        await asyncio.wait_for(kafka_consumer._task, 5)
+
+    # Assert: пачка применена и закоммичена, consumer покинул группу
+    mock_session.commit.assert_awaited_once()
+    kafka_consumer.consumer.commit.assert_awaited_once_with({tp0: 6})
+    kafka_consumer.consumer.stop.assert_awaited_once()
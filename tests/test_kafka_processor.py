@@ -1,10 +1,20 @@
+import asyncio
+import itertools
+import random
+
 import pytest
 from unittest.mock import AsyncMock, MagicMock, patch
+from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.services.kafka_processor import (
+    DuplicateEventError,
+    apply_movement_events,
     process_movement_event,
+    process_movement_events,
 )
 from app.db.models import Warehouse, Product, StockItem, Movement, MovementStatus
+from app.services.id_registry import processed_event_registry
+from tests.conftest import TestSessionFactory
 import uuid
 from datetime import datetime
 
@@ -42,25 +52,22 @@ async def test_process_departure_success(mock_db_session: AsyncMock):
         "event": "departure",
     }
 
-    mock_warehouse = Warehouse(id=str(wh_id), code="WH-1234")
-    mock_product = Product(id=str(prod_id))
-    mock_stock = StockItem(
-        id=str(uuid.uuid4()),
-        warehouse_id=str(wh_id),
-        product_id=str(prod_id),
-        quantity=100,
-    )
+    # Приемка этого перемещения еще не приходила
+    mock_db_session.scalars = AsyncMock(return_value=MagicMock(all=lambda: []))
 
-    # Настраиваем моки для get_or_create и get_stock_item
+    # Настраиваем моки для справочников и атомарного списания остатка
     # Используем patch для подмены внутренних вызовов
     with patch(
-        "app.services.kafka_processor._get_or_create_warehouse",
-        return_value=mock_warehouse,
+        "app.services.kafka_processor._ensure_warehouse", return_value=str(wh_id)
     ) as mock_get_wh, patch(
-        "app.services.kafka_processor._get_or_create_product", return_value=mock_product
+        "app.services.kafka_processor._ensure_product", return_value=str(prod_id)
     ) as mock_get_prod, patch(
-        "app.services.kafka_processor._get_stock_item", return_value=mock_stock
-    ) as mock_get_stock:
+        "app.services.kafka_processor._decrease_stock", return_value=(50, 1)
+    ) as mock_decrease_stock, patch(
+        "app.services.kafka_processor._sync_stock_cache"
+    ) as mock_sync_cache, patch(
+        "app.services.kafka_processor._claim_event"
+    ):
 
         # Act
         result_movement = await process_movement_event(mock_db_session, event_data)
@@ -68,29 +75,348 @@ async def test_process_departure_success(mock_db_session: AsyncMock):
         # Assert
         mock_get_wh.assert_called_once_with(mock_db_session, wh_id, "WH-1234")
         mock_get_prod.assert_called_once_with(mock_db_session, prod_id)
-        mock_get_stock.assert_called_once_with(
-            mock_db_session, mock_warehouse.id, mock_product.id
+        # Остаток списывается одним условным UPDATE (100 - 50)
+        mock_decrease_stock.assert_called_once_with(
+            mock_db_session, str(wh_id), str(prod_id), quantity
         )
 
-        # Проверяем, что остаток уменьшился
-        assert mock_stock.quantity == 50  # 100 - 50
-
         # Проверяем, что создался Movement
         mock_db_session.add.assert_called_once()
         added_obj = mock_db_session.add.call_args[0][0]
         assert isinstance(added_obj, Movement)
         assert added_obj.kafka_movement_id == movement_id
-        assert added_obj.source_warehouse_id == mock_warehouse.id
-        assert added_obj.product_id == mock_product.id
+        assert added_obj.source_warehouse_id == str(wh_id)
+        assert added_obj.product_id == str(prod_id)
         assert added_obj.quantity == quantity
         assert added_obj.departure_time == timestamp_dt
         assert added_obj.status == MovementStatus.IN_TRANSIT
 
         mock_db_session.flush.assert_called_once()
+        mock_sync_cache.assert_called_once_with(
+            mock_db_session, str(wh_id), str(prod_id), 50, 1
+        )
         # Проверьте вызов commit/rollback в зависимости от того, где он ожидается (внутри process_movement_event или снаружи)
         # В текущей реализации commit/rollback делаются снаружи (в consumer/webhook)
 
         assert result_movement is added_obj
 
 
+async def test_process_departure_insufficient_stock(db_session: AsyncSession):
+    # Arrange
+    product_id = str(uuid.uuid4())
+    db_session.add(Product(id=product_id))
+    warehouse_id = await create_warehouse(db_session, {product_id: 10})
+    event_data = make_event("departure", uuid.uuid4(), warehouse_id, product_id, 11)
+
+    # Act / Assert: условный UPDATE не затронул строк — остаток не изменился
+    with pytest.raises(ValueError, match="Available: 10, Requested: 11"):
+        await process_movement_event(db_session, event_data)
+
+    quantity = await db_session.scalar(
+        select(StockItem.quantity).where(StockItem.product_id == product_id)
+    )
+    assert quantity == 10
+
+
 # Добавить тесты для arrival, недостаточного количества, невалидных данных и т.д.
+
+
+_warehouse_codes = itertools.count(random.randint(0, 8000))
+
+
+async def create_warehouse(db: AsyncSession, stock: dict[str, int] = None) -> str:
+    """Создает склад с уникальным кодом и начальными остатками"""
+    warehouse_id = str(uuid.uuid4())
+    db.add(Warehouse(id=warehouse_id, code=f"WH-{next(_warehouse_codes):04d}"))
+    await db.flush()
+    for product_id, quantity in (stock or {}).items():
+        db.add(
+            StockItem(
+                warehouse_id=warehouse_id, product_id=product_id, quantity=quantity
+            )
+        )
+    await db.flush()
+    return warehouse_id
+
+
+def make_event(event, movement_id, warehouse_id, product_id, quantity) -> dict:
+    return {
+        "movement_id": str(movement_id),
+        "warehouse_id": str(warehouse_id),
+        "warehouse_code": None,
+        "product_id": str(product_id),
+        "quantity": quantity,
+        "timestamp": "2025-02-18T12:12:56+00:00",
+        "event": event,
+    }
+
+
+async def test_process_movement_events_batch(db_session: AsyncSession):
+    # Arrange
+    product_id = str(uuid.uuid4())
+    db_session.add(Product(id=product_id))
+    source_id = await create_warehouse(db_session, {product_id: 100})
+    destination_id = await create_warehouse(db_session)
+    first, second = uuid.uuid4(), uuid.uuid4()
+    events = [
+        make_event("departure", first, source_id, product_id, 60),
+        make_event("departure", second, source_id, product_id, 50),
+        make_event("arrival", first, destination_id, product_id, 58),
+        make_event("departure", "not-a-uuid", source_id, product_id, 1),
+    ]
+
+    # Act
+    results = await process_movement_events(db_session, events)
+
+    # Assert
+    assert [result.ok for result in results] == [True, False, True, False]
+    assert "Insufficient stock" in results[1].error
+    movement = results[2].movement
+    assert movement is results[0].movement
+    assert movement.status == MovementStatus.COMPLETED
+    assert movement.quantity_diff == 2
+
+    stock = await db_session.execute(
+        select(StockItem.warehouse_id, StockItem.quantity).where(
+            StockItem.product_id == product_id
+        )
+    )
+    assert dict(stock.all()) == {source_id: 40, destination_id: 58}
+
+
+async def test_process_movement_events_matches_sequential(db_session: AsyncSession):
+    async def run(process) -> list:
+        product_id = str(uuid.uuid4())
+        db_session.add(Product(id=product_id))
+        source_id = await create_warehouse(db_session, {product_id: 30})
+        destination_id = await create_warehouse(db_session)
+        movement_ids = [uuid.uuid4() for _ in range(3)]
+        events = [
+            make_event("departure", movement_ids[0], source_id, product_id, 20),
+            make_event("arrival", movement_ids[1], source_id, product_id, 5),
+            make_event("departure", movement_ids[2], source_id, product_id, 20),
+            make_event("arrival", movement_ids[0], source_id, product_id, 20),
+            make_event("arrival", movement_ids[0], destination_id, product_id, 19),
+            make_event("departure", movement_ids[2], source_id, product_id, 15),
+        ]
+        await process(events)
+        stock = await db_session.scalars(
+            select(StockItem.quantity)
+            .where(StockItem.product_id == product_id)
+            .order_by(StockItem.warehouse_id == source_id)
+        )
+        movements = await db_session.execute(
+            select(Movement.status, Movement.quantity, Movement.quantity_diff)
+            .where(Movement.product_id == product_id)
+            .order_by(Movement.quantity)
+        )
+        return [stock.all(), movements.all()]
+
+    async def sequential(events):
+        for event_data in events:
+            try:
+                async with db_session.begin_nested():
+                    await process_movement_event(db_session, event_data)
+            except ValueError:
+                pass
+
+    async def bulk(events):
+        await process_movement_events(db_session, events)
+        await db_session.flush()
+
+    assert await run(sequential) == await run(bulk)
+
+
+async def test_stock_cache_written_through_after_commit(db_session: AsyncSession):
+    # Arrange
+    product_id = str(uuid.uuid4())
+    db_session.add(Product(id=product_id))
+    warehouse_id = await create_warehouse(db_session, {product_id: 10})
+    event_data = make_event("arrival", uuid.uuid4(), warehouse_id, product_id, 5)
+
+    with patch(
+        "app.services.kafka_processor.schedule_cache_write_if_newer"
+    ) as mock_schedule:
+        # Act
+        await process_movement_event(db_session, event_data)
+        mock_schedule.assert_not_called()  # до COMMIT в кэш ничего не пишется
+        await db_session.commit()
+
+    # Assert: в кэш уходит новый остаток вместе с версией строки
+    mock_schedule.assert_called_once_with(
+        f"stock:{warehouse_id}:{product_id}",
+        {"warehouse_id": warehouse_id, "product_id": product_id, "quantity": 15},
+        1,
+    )
+
+
+async def test_replayed_events_are_not_applied_twice(db_session: AsyncSession):
+    # Arrange
+    product_id = str(uuid.uuid4())
+    db_session.add(Product(id=product_id))
+    warehouse_id = await create_warehouse(db_session, {product_id: 10})
+    movement_id = uuid.uuid4()
+    arrival = make_event("arrival", movement_id, warehouse_id, product_id, 5)
+
+    # Act: пачка с повтором внутри, затем повторная доставка пачки и события
+    first = await apply_movement_events(db_session, [arrival, arrival])
+    replay = await apply_movement_events(db_session, [arrival])
+    with pytest.raises(DuplicateEventError):
+        async with db_session.begin_nested():
+            await process_movement_event(db_session, arrival)
+
+    # Assert
+    assert [(r.ok, r.duplicate) for r in first] == [(True, False), (False, True)]
+    assert [(r.ok, r.duplicate) for r in replay] == [(False, True)]
+    quantity = await db_session.scalar(
+        select(StockItem.quantity).where(StockItem.product_id == product_id)
+    )
+    assert quantity == 15
+
+
+async def test_shared_marker_rejects_replay_after_restart(db_session: AsyncSession):
+    # Arrange: in-process реестр пуст (рестарт), маркер события есть в Redis
+    product_id = str(uuid.uuid4())
+    db_session.add(Product(id=product_id))
+    warehouse_id = await create_warehouse(db_session, {product_id: 10})
+    arrival = make_event("arrival", uuid.uuid4(), warehouse_id, product_id, 5)
+    processed_event_registry.clear()
+    marker = f"processed:{arrival['movement_id']}:arrival"
+
+    # Act
+    with patch(
+        "app.services.kafka_processor.existing_markers", return_value={marker}
+    ) as mock_markers:
+        [result] = await apply_movement_events(db_session, [arrival])
+
+    # Assert: дубликат отсечен без изменения остатков
+    mock_markers.assert_awaited_once_with([marker])
+    assert result.duplicate
+    quantity = await db_session.scalar(
+        select(StockItem.quantity).where(StockItem.product_id == product_id)
+    )
+    assert quantity == 10
+
+
+@pytest.mark.parametrize("bulk", [False, True])
+async def test_departure_after_arrival_completes_movement(
+    db_session: AsyncSession, bulk: bool
+):
+    # Arrange: приемка пришла раньше отгрузки
+    product_id = str(uuid.uuid4())
+    db_session.add(Product(id=product_id))
+    source_id = await create_warehouse(db_session, {product_id: 10})
+    destination_id = await create_warehouse(db_session)
+    movement_id = uuid.uuid4()
+    events = [
+        make_event("arrival", movement_id, destination_id, product_id, 4),
+        make_event("departure", movement_id, source_id, product_id, 5),
+    ]
+
+    # Act
+    if bulk:
+        await process_movement_events(db_session, events)
+        await db_session.flush()
+    else:
+        for event_data in events:
+            await process_movement_event(db_session, event_data)
+
+    # Assert: половины связаны в одну запись с расхождением
+    movements = (
+        await db_session.scalars(
+            select(Movement).where(Movement.kafka_movement_id == str(movement_id))
+        )
+    ).all()
+    assert len(movements) == 1
+    movement = movements[0]
+    assert (movement.source_warehouse_id, movement.destination_warehouse_id) == (
+        source_id,
+        destination_id,
+    )
+    assert (movement.status, movement.quantity, movement.quantity_diff) == (
+        MovementStatus.COMPLETED,
+        5,
+        1,
+    )
+    assert movement.awaiting_departure is False
+
+
+@pytest.mark.parametrize("bulk", [False, True])
+async def test_naive_arrival_timestamp_pairs_with_stored_departure(
+    db_session: AsyncSession, bulk: bool
+):
+    # Arrange: отгрузка уже в БД, метка приемки без часового пояса
+    product_id = str(uuid.uuid4())
+    db_session.add(Product(id=product_id))
+    source_id = await create_warehouse(db_session, {product_id: 10})
+    destination_id = await create_warehouse(db_session)
+    movement_id = uuid.uuid4()
+    await process_movement_event(
+        db_session, make_event("departure", movement_id, source_id, product_id, 5)
+    )
+    await db_session.flush()
+    db_session.expire_all()
+    arrival = make_event("arrival", movement_id, destination_id, product_id, 5) | {
+        "timestamp": "2025-02-18T14:12:56"
+    }
+
+    # Act
+    if bulk:
+        [result] = await process_movement_events(db_session, [arrival])
+        assert result.ok
+        await db_session.flush()
+    else:
+        await process_movement_event(db_session, arrival)
+
+    # Assert: метка прочитана как UTC
+    movement = await db_session.scalar(
+        select(Movement).where(Movement.kafka_movement_id == str(movement_id))
+    )
+    assert movement.status == MovementStatus.COMPLETED
+    assert (movement.arrival_time - movement.departure_time).total_seconds() == 7200
+
+
+@pytest.mark.parametrize("bulk", [False, True])
+async def test_concurrent_halves_pair_into_one_movement(bulk: bool):
+    # Arrange: данные закоммичены — половины применяются разными транзакциями
+    product_id = str(uuid.uuid4())
+    async with TestSessionFactory() as db:
+        db.add(Product(id=product_id))
+        source_id = await create_warehouse(db, {product_id: 10})
+        destination_id = await create_warehouse(db)
+        await db.commit()
+    movement_id = uuid.uuid4()
+    departure_applied = asyncio.Event()
+
+    async def apply(event: dict, hold: bool):
+        async with TestSessionFactory() as db:
+            if bulk:
+                await apply_movement_events(db, [event])
+            else:
+                await process_movement_event(db, event)
+            if hold:
+                # Приемка стартует, пока отгрузка еще не закоммичена
+                departure_applied.set()
+                await asyncio.sleep(0.2)
+            await db.commit()
+
+    async def apply_arrival():
+        await departure_applied.wait()
+        event = make_event("arrival", movement_id, destination_id, product_id, 4)
+        await apply(event, hold=False)
+
+    # Act
+    departure = make_event("departure", movement_id, source_id, product_id, 4)
+    await asyncio.gather(apply(departure, hold=True), apply_arrival())
+
+    # Assert
+    async with TestSessionFactory() as db:
+        movements = (
+            await db.scalars(
+                select(Movement).where(Movement.kafka_movement_id == str(movement_id))
+            )
+        ).all()
+    assert len(movements) == 1
+    assert movements[0].status == MovementStatus.COMPLETED
+    assert str(movements[0].source_warehouse_id) == source_id
+    assert str(movements[0].destination_warehouse_id) == destination_id
@@ -0,0 +1,87 @@
+import json
+import uuid
+
+import pytest
+from httpx import AsyncClient
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.models import StockItem
+
+pytestmark = pytest.mark.asyncio
+
+
+def make_message(event: str, warehouse_id, product_id, quantity: int) -> dict:
+    return {
+        "id": str(uuid.uuid4()),
+        "source": f"WH-{warehouse_id.int % 10000:04d}",
+        "data": {
+            "movement_id": str(uuid.uuid4()),
+            "warehouse_id": str(warehouse_id),
+            "product_id": str(product_id),
+            "quantity": quantity,
+            "timestamp": "2025-02-18T12:12:56Z",
+            "event": event,
+        },
+    }
+
+
+async def test_webhook_batch_reports_status_per_message(
+    client: AsyncClient, db_session: AsyncSession
+):
+    # Arrange: приемка, отгрузка сверх остатка и невалидное сообщение
+    warehouse_id, product_id = uuid.uuid4(), uuid.uuid4()
+    messages = [
+        make_message("arrival", warehouse_id, product_id, 10),
+        make_message("departure", warehouse_id, product_id, 11),
+        {"id": str(uuid.uuid4()), "data": {"quantity": -1}},
+        make_message("departure", warehouse_id, product_id, 4),
+    ]
+
+    # Act
+    response = await client.post("/api/v1/kafka/webhook:batch", json=messages)
+
+    # Assert: отказ одного сообщения не мешает остальным
+    assert response.status_code == 200
+    body = response.json()
+    assert [result["status"] for result in body["results"]] == [
+        "processed",
+        "rejected",
+        "invalid",
+        "processed",
+    ]
+    assert "Insufficient stock" in body["results"][1]["error"]
+    assert (body["processed"], body["failed"]) == (2, 2)
+    quantity = await db_session.scalar(
+        select(StockItem.quantity).where(StockItem.product_id == str(product_id))
+    )
+    assert quantity == 6
+
+
+async def test_webhook_batch_accepts_ndjson(client: AsyncClient):
+    warehouse_id = uuid.uuid4()
+    messages = [
+        make_message("arrival", warehouse_id, uuid.uuid4(), 1) for _ in range(3)
+    ]
+    body = "\n".join(json.dumps(message) for message in messages) + "\n{broken\n"
+
+    response = await client.post(
+        "/api/v1/kafka/webhook:batch",
+        content=body.encode(),
+        headers={"content-type": "application/x-ndjson"},
+    )
+
+    results = response.json()["results"]
+    assert [result["status"] for result in results] == ["processed"] * 3 + ["invalid"]
+    assert results[0]["message_id"] == messages[0]["id"]
+
+
+async def test_webhook_batch_reports_redelivered_messages(client: AsyncClient):
+    message = make_message("arrival", uuid.uuid4(), uuid.uuid4(), 1)
+
+    await client.post("/api/v1/kafka/webhook:batch", json=[message])
+    response = await client.post("/api/v1/kafka/webhook:batch", json=[message])
+
+    body = response.json()
+    assert [result["status"] for result in body["results"]] == ["duplicate"]
+    assert (body["processed"], body["duplicates"], body["failed"]) == (0, 1, 0)
@@ -0,0 +1,61 @@
+import logging
+import queue
+
+import orjson
+import pytest
+
+from app.logging_config import (
+    JsonFormatter,
+    SuccessSampler,
+    _NonBlockingQueueHandler,
+    parse_sample_rates,
+)
+from app.metrics import LOG_RECORDS_DROPPED
+
+pytestmark = pytest.mark.asyncio
+
+
+def make_record(level: int, msg: str, *args, **extra) -> logging.LogRecord:
+    record = logging.LogRecord("test", level, __file__, 1, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+
+async def test_json_formatter_keeps_extra_fields():
+    # Arrange
+    record = make_record(
+        logging.INFO, "Processed %s", "arrival", movement_id="m-1", quantity=5
+    )
+
+    # Act
+    payload = orjson.loads(JsonFormatter().format(record))
+
+    # Assert
+    assert payload["message"] == "Processed arrival"
+    assert payload["level"] == "INFO"
+    assert payload["movement_id"] == "m-1"
+    assert payload["quantity"] == 5
+
+
+async def test_sampler_drops_success_but_keeps_warnings():
+    # Arrange
+    sampler = SuccessSampler(0.0)
+
+    # Assert
+    assert not sampler.filter(make_record(logging.INFO, "ok"))
+    assert sampler.filter(make_record(logging.WARNING, "rejected"))
+    assert parse_sample_rates(" a=0.5, b.c=0.01 ,") == {"a": 0.5, "b.c": 0.01}
+
+
+async def test_full_queue_drops_instead_of_blocking():
+    # Arrange
+    handler = _NonBlockingQueueHandler(queue.Queue(maxsize=1))
+    dropped_before = LOG_RECORDS_DROPPED.value
+
+    # Act
+    for _ in range(3):
+        handler.handle(make_record(logging.INFO, "event"))
+
+    # Assert
+    assert handler.queue.qsize() == 1
+    assert LOG_RECORDS_DROPPED.value == dropped_before + 2
@@ -0,0 +1,81 @@
+import uuid
+
+import pytest
+from httpx import AsyncClient
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.models import Product
+from app.metrics import EVENT_PROCESSING_SECONDS
+from app.services.kafka_processor import process_movement_event, process_movement_events
+from tests.test_kafka_processor import create_warehouse, make_event
+
+pytestmark = pytest.mark.asyncio
+
+
+def sample(body: str, prefix: str) -> float:
+    [line] = [line for line in body.splitlines() if line.startswith(prefix + " ")]
+    return float(line.rsplit(" ", 1)[1])
+
+
+async def test_event_processing_histogram(db_session: AsyncSession):
+    # Arrange
+    product_id = str(uuid.uuid4())
+    db_session.add(Product(id=product_id))
+    warehouse_id = await create_warehouse(db_session)
+    arrivals = EVENT_PROCESSING_SECONDS.labels("arrival")
+    count_before = sum(arrivals.counts)
+
+    # Act
+    event = make_event("arrival", uuid.uuid4(), warehouse_id, product_id, 5)
+    await process_movement_event(db_session, event)
+
+    # Assert: наблюдение попало ровно в одну корзину
+    assert sum(arrivals.counts) == count_before + 1
+    assert arrivals.sum > 0
+
+
+async def test_event_processing_histogram_for_batch(db_session: AsyncSession):
+    # Arrange: пачка из двух приемок и невалидного события
+    product_id = str(uuid.uuid4())
+    db_session.add(Product(id=product_id))
+    warehouse_id = await create_warehouse(db_session)
+    arrivals = EVENT_PROCESSING_SECONDS.labels("arrival")
+    invalid = EVENT_PROCESSING_SECONDS.labels("invalid")
+    arrivals_before, invalid_before = sum(arrivals.counts), sum(invalid.counts)
+    events = [
+        make_event("arrival", uuid.uuid4(), warehouse_id, product_id, 5),
+        make_event("arrival", uuid.uuid4(), warehouse_id, product_id, 3),
+        make_event("arrival", uuid.uuid4(), warehouse_id, product_id, -1),
+    ]
+
+    # Act
+    await process_movement_events(db_session, events)
+
+    # Assert: каждое событие пачки учтено по своему типу
+    assert sum(arrivals.counts) == arrivals_before + 2
+    assert sum(invalid.counts) == invalid_before + 1
+
+
+async def test_metrics_endpoint_reports_route_latency(client: AsyncClient):
+    # Arrange: ID в пути не должны порождать отдельные ряды
+    for _ in range(2):
+        path = f"/api/v1/warehouse/{uuid.uuid4()}/products/{uuid.uuid4()}"
+        assert (await client.get(path)).status_code == 200
+
+    # Act
+    response = await client.get("/metrics")
+
+    # Assert
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    labels = (
+        'method="GET",route="/api/v1/warehouse/{warehouse_id}/products/{product_id}",'
+        'status="2xx"'
+    )
+    body = response.text
+    count = sample(body, f"warehouse_http_request_seconds_count{{{labels}}}")
+    assert count >= 2
+    assert sample(
+        body, f'warehouse_http_request_seconds_bucket{{{labels},le="+Inf"}}'
+    ) == count
+    assert "# TYPE warehouse_cache_requests_total counter" in body
@@ -0,0 +1,61 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from httpx import AsyncClient
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.models import Movement, MovementStatus, Product, Warehouse
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_list_movements_keyset_pages(
+    client: AsyncClient, db_session: AsyncSession
+):
+    # Arrange: пять перемещений товара с разницей в час и одно чужое
+    warehouse_id = uuid.uuid4()
+    product_id, other_product_id = str(uuid.uuid4()), str(uuid.uuid4())
+    db_session.add(
+        Warehouse(id=str(warehouse_id), code=f"WH-{warehouse_id.int % 10000:04d}")
+    )
+    db_session.add_all([Product(id=product_id), Product(id=other_product_id)])
+    await db_session.flush()
+    start = datetime(2026, 3, 1, tzinfo=timezone.utc)
+    for hour, product in enumerate([product_id] * 5 + [other_product_id]):
+        db_session.add(
+            Movement(
+                recorded_at=start + timedelta(hours=hour),
+                kafka_movement_id=str(uuid.uuid4()),
+                source_warehouse_id=str(warehouse_id),
+                product_id=product,
+                quantity=hour + 1,
+                departure_time=start + timedelta(hours=hour),
+                status=MovementStatus.IN_TRANSIT,
+            )
+        )
+    await db_session.flush()
+
+    # Act: постранично, только два поля
+    quantities, cursor = [], None
+    for _ in range(3):
+        params = {"product_id": product_id, "fields": "quantity,status", "limit": 2}
+        if cursor:
+            params["after"] = cursor
+        response = await client.get("/api/v1/movements", params=params)
+        assert response.status_code == 200
+        page = response.json()
+        quantities += [item["quantity"] for item in page["items"]]
+        cursor = page["next_cursor"]
+
+    # Assert: от новых к старым, без пропусков и повторов
+    assert quantities == [5, 4, 3, 2, 1]
+    assert cursor is None
+    assert page["items"] == [{"quantity": 1, "status": "in_transit"}]
+
+
+async def test_list_movements_rejects_unknown_field(client: AsyncClient):
+    response = await client.get("/api/v1/movements", params={"fields": "id,secret"})
+
+    assert response.status_code == 400
+    assert "secret" in response.json()["detail"]
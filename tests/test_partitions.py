@@ -0,0 +1,258 @@
+import gzip
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import func, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.models import (
+    Movement,
+    MovementStatus,
+    ProcessedEvent,
+    Product,
+    Warehouse,
+)
+from app.services.partitions import (
+    archive_partition,
+    ensure_partitions,
+    expire_awaiting_departures,
+    expired_partitions,
+    list_partitions,
+    partition_default_rows,
+    prune_processed_events,
+)
+from tests.conftest import test_engine
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_partition_lifecycle(db_session: AsyncSession, tmp_path):
+    # Arrange: перемещение месяца, для которого еще нет секции
+    warehouse_id, product_id, movement_id = (str(uuid.uuid4()) for _ in range(3))
+    db_session.add(Warehouse(id=warehouse_id, code="WH-9999"))
+    db_session.add(Product(id=product_id))
+    await db_session.flush()
+    recorded_at = datetime(2030, 5, 17, tzinfo=timezone.utc)
+    db_session.add(
+        Movement(
+            id=movement_id,
+            recorded_at=recorded_at,
+            kafka_movement_id=str(uuid.uuid4()),
+            source_warehouse_id=warehouse_id,
+            product_id=product_id,
+            quantity=3,
+            departure_time=recorded_at,
+            status=MovementStatus.IN_TRANSIT,
+        )
+    )
+    await db_session.flush()
+    conn = await db_session.connection()
+
+    # Act: секция создается вместе с переносом строки из секции по умолчанию
+    created = await ensure_partitions(conn, 1, now=recorded_at)
+
+    # Assert
+    assert created == ["movements_p203005", "movements_p203006"]
+    partition = await db_session.scalar(
+        select(text("tableoid::regclass::text"))
+        .select_from(Movement)
+        .where(Movement.id == movement_id)
+    )
+    assert partition == "movements_p203005"
+    now = datetime(2030, 8, 1, tzinfo=timezone.utc)
+    assert "movements_p203005" in await expired_partitions(conn, 2, now=now)
+    assert "movements_p203006" not in await expired_partitions(conn, 2, now=now)
+
+    # Act: архивирование выгружает строки и удаляет секцию
+    path = await archive_partition(conn, "movements_p203005", str(tmp_path))
+
+    # Assert
+    with gzip.open(path, "rt") as archive:
+        assert movement_id in archive.read()
+    assert "movements_p203005" not in await list_partitions(conn)
+    remaining = await db_session.scalar(
+        select(func.count()).select_from(Movement).where(Movement.id == movement_id)
+    )
+    assert remaining == 0
+
+
+async def test_rearchiving_month_keeps_previous_archive(
+    db_session: AsyncSession, tmp_path
+):
+    # Arrange: месяц архивируется, затем в него приходит поздняя строка
+    warehouse_id, product_id = str(uuid.uuid4()), str(uuid.uuid4())
+    db_session.add(Warehouse(id=warehouse_id, code="WH-9995"))
+    db_session.add(Product(id=product_id))
+    await db_session.flush()
+    conn = await db_session.connection()
+    recorded_at = datetime(2018, 7, 4, tzinfo=timezone.utc)
+    movement_ids = []
+    paths = []
+    for _ in range(2):
+        movement_id = str(uuid.uuid4())
+        db_session.add(
+            Movement(
+                id=movement_id,
+                recorded_at=recorded_at,
+                kafka_movement_id=str(uuid.uuid4()),
+                destination_warehouse_id=warehouse_id,
+                product_id=product_id,
+                quantity=3,
+                arrival_time=recorded_at,
+                status=MovementStatus.COMPLETED,
+            )
+        )
+        await db_session.flush()
+        movement_ids.append(movement_id)
+
+        # Act
+        assert "movements_p201807" in await partition_default_rows(conn)
+        paths.append(
+            await archive_partition(conn, "movements_p201807", str(tmp_path))
+        )
+
+    # Assert: второй архив не затер первый
+    assert paths[0] != paths[1]
+    for path, movement_id in zip(paths, movement_ids):
+        with gzip.open(path, "rt") as archive:
+            assert movement_id in archive.read()
+
+
+async def test_late_rows_move_out_of_default_partition(db_session: AsyncSession):
+    # Arrange: событие задним числом попало в секцию по умолчанию
+    warehouse_id, product_id, movement_id = (str(uuid.uuid4()) for _ in range(3))
+    db_session.add(Warehouse(id=warehouse_id, code="WH-9996"))
+    db_session.add(Product(id=product_id))
+    await db_session.flush()
+    recorded_at = datetime(2019, 3, 9, tzinfo=timezone.utc)
+    db_session.add(
+        Movement(
+            id=movement_id,
+            recorded_at=recorded_at,
+            kafka_movement_id=str(uuid.uuid4()),
+            destination_warehouse_id=warehouse_id,
+            product_id=product_id,
+            quantity=3,
+            arrival_time=recorded_at,
+            status=MovementStatus.COMPLETED,
+        )
+    )
+    await db_session.flush()
+    conn = await db_session.connection()
+
+    # Act
+    created = await partition_default_rows(conn)
+
+    # Assert: строка в месячной секции, которую архивирует обслуживание
+    assert "movements_p201903" in created
+    partition = await db_session.scalar(
+        select(text("tableoid::regclass::text"))
+        .select_from(Movement)
+        .where(Movement.id == movement_id)
+    )
+    assert partition == "movements_p201903"
+    now = datetime(2030, 1, 1, tzinfo=timezone.utc)
+    assert "movements_p201903" in await expired_partitions(conn, 12, now=now)
+
+
+async def test_prune_processed_events_keeps_recent_keys():
+    # Arrange: ключи старше и моложе срока хранения
+    now = datetime(2030, 5, 17, tzinfo=timezone.utc)
+    old_id, recent_id = str(uuid.uuid4()), str(uuid.uuid4())
+    async with test_engine.connect() as conn:
+        await conn.execute(
+            ProcessedEvent.__table__.insert(),
+            [
+                {
+                    "movement_id": old_id,
+                    "event_type": "arrival",
+                    "processed_at": now - timedelta(days=31),
+                },
+                {
+                    "movement_id": recent_id,
+                    "event_type": "arrival",
+                    "processed_at": now - timedelta(days=29),
+                },
+            ],
+        )
+        await conn.commit()
+
+        # Act
+        pruned = await prune_processed_events(conn, 30, now=now)
+
+        # Assert
+        remaining = set(
+            await conn.scalars(
+                select(ProcessedEvent.movement_id).where(
+                    ProcessedEvent.movement_id.in_([old_id, recent_id])
+                )
+            )
+        )
+        assert pruned >= 1
+        assert remaining == {recent_id}
+        await conn.execute(
+            ProcessedEvent.__table__.delete().where(
+                ProcessedEvent.movement_id == recent_id
+            )
+        )
+        await conn.commit()
+
+
+async def test_expire_awaiting_departures_keeps_recent_arrivals():
+    # Arrange: приемки без отгрузки старше и моложе окна ожидания
+    now = datetime(2030, 5, 17, tzinfo=timezone.utc)
+    warehouse_id, product_id, old_id, recent_id = (
+        str(uuid.uuid4()) for _ in range(4)
+    )
+    async with test_engine.connect() as conn:
+        await conn.execute(
+            Warehouse.__table__.insert(), {"id": warehouse_id, "code": "WH-9997"}
+        )
+        await conn.execute(Product.__table__.insert(), {"id": product_id})
+        await conn.execute(
+            Movement.__table__.insert(),
+            [
+                {
+                    "id": movement_id,
+                    "recorded_at": recorded_at,
+                    "kafka_movement_id": str(uuid.uuid4()),
+                    "destination_warehouse_id": warehouse_id,
+                    "product_id": product_id,
+                    "quantity": 3,
+                    "arrival_time": recorded_at,
+                    "status": MovementStatus.COMPLETED,
+                    "quantity_diff": 0,
+                    "awaiting_departure": True,
+                }
+                for movement_id, recorded_at in (
+                    (old_id, now - timedelta(days=8)),
+                    (recent_id, now - timedelta(days=6)),
+                )
+            ],
+        )
+        await conn.commit()
+
+        # Act
+        expired = await expire_awaiting_departures(conn, 7, now=now)
+
+        # Assert: старая приемка осталась прямой поставкой
+        awaiting = set(
+            await conn.scalars(
+                select(Movement.id).where(
+                    Movement.id.in_([old_id, recent_id]), Movement.awaiting_departure
+                )
+            )
+        )
+        assert expired >= 1
+        assert awaiting == {recent_id}
+        await conn.execute(
+            Movement.__table__.delete().where(Movement.product_id == product_id)
+        )
+        await conn.execute(
+            Product.__table__.delete().where(Product.id == product_id)
+        )
+        await conn.execute(
+            Warehouse.__table__.delete().where(Warehouse.id == warehouse_id)
+        )
+        await conn.commit()
@@ -0,0 +1,57 @@
+import uuid
+from unittest.mock import patch
+
+import pytest
+import pytest_asyncio
+from httpx import AsyncClient
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.models import Product
+from app.db.profiler import (
+    _after_execute,
+    _before_execute,
+    install_sql_profiler,
+    profile_sql,
+)
+from tests.conftest import test_engine
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest_asyncio.fixture
+async def sql_profiling():
+    with patch("app.db.profiler.settings.SQL_PROFILING", True):
+        install_sql_profiler(test_engine)
+        yield
+    event.remove(test_engine.sync_engine, "before_cursor_execute", _before_execute)
+    event.remove(test_engine.sync_engine, "after_cursor_execute", _after_execute)
+
+
+async def test_profile_counts_repeated_statements(
+    sql_profiling, db_session: AsyncSession
+):
+    # Act: один и тот же запрос трижды — типичный N+1
+    with profile_sql("n+1") as profile:
+        for _ in range(3):
+            stmt = select(Product.id).where(Product.id == str(uuid.uuid4()))
+            await db_session.scalar(stmt)
+
+    # Assert
+    report = profile.as_dict()
+    assert report["queries"] >= 3
+    assert report["most_repeated"]["count"] == 3
+    assert report["most_repeated"]["statement"].startswith("SELECT products.id")
+    assert 1 <= len(report["slowest"]) <= 3
+
+
+async def test_response_carries_db_timing_headers(sql_profiling, client: AsyncClient):
+    # Act
+    response = await client.get(
+        f"/api/v1/warehouse/{uuid.uuid4()}/products/{uuid.uuid4()}"
+    )
+
+    # Assert
+    assert response.status_code == 200
+    assert int(response.headers["x-db-queries"]) >= 1
+    assert response.headers["server-timing"].startswith("db;dur=")
@@ -0,0 +1,83 @@
+import json
+import uuid
+from datetime import datetime
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from app.services.near_cache import NearCache
+from app.services.redis import (
+    CODECS,
+    INSTANCE_ID,
+    _apply_invalidation,
+    cache_batch,
+    cache_client,
+    codec,
+    invalidate_cache,
+    schedule_cache_write_if_newer,
+    set_cache,
+)
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_cache_batch_coalesces_operations():
+    with patch.object(cache_client, "redis") as mock_redis, patch(
+        "app.services.redis.CacheBatch.execute", new_callable=AsyncMock
+    ) as mock_execute:
+        # Act: операции внутри блока (в т.ч. вложенного) копятся в одном пакете
+        async with cache_batch() as batch:
+            await invalidate_cache("stock:a", "movement:b")
+            await set_cache("movement:b", {"id": "b"}, ttl=60)
+            async with cache_batch() as nested:
+                schedule_cache_write_if_newer("stock:c", {"quantity": 1}, 2)
+                schedule_cache_write_if_newer("stock:c", {"quantity": 0}, 1)
+            mock_execute.assert_not_awaited()
+
+    # Assert: в Redis ушел один пакет, отдельных команд не было
+    assert nested is batch
+    mock_execute.assert_awaited_once()
+    assert batch.deletes == {"stock:a"}
+    value, ttl = batch.writes["movement:b"]
+    assert value == codec.encode({"id": "b"})
+    assert 60 <= ttl <= 66  # TTL с разбросом CACHE_TTL_JITTER
+    assert batch.versioned["stock:c"][:2] == ({"quantity": 1}, 2)
+    mock_redis.delete.assert_not_called()
+    mock_redis.setex.assert_not_called()
+
+
+async def test_near_cache_bounded_by_entries_and_bytes():
+    cache = NearCache(max_entries=3, max_bytes=10, ttl_seconds=60)
+    cache.put("a", 1, size=4)
+    cache.put("b", 2, size=4)
+    cache.get("a")  # "a" становится самым свежим
+    cache.put("c", 3, size=4)  # 12 байт > 10: вытесняется "b"
+    cache.put("huge", 4, size=11)  # больше лимита целиком — не кэшируется
+
+    assert [cache.get(key) for key in ("a", "b", "c", "huge")] == [1, None, 3, None]
+    assert cache.stats()["bytes"] == 8
+
+
+async def test_invalidation_from_other_pod_evicts_near_cache():
+    cache = NearCache(max_entries=10, max_bytes=1024, ttl_seconds=60)
+    cache.put("stock:a", {"quantity": 1}, size=15)
+    cache.put("stock:b", {"quantity": 2}, size=15)
+
+    with patch("app.services.redis.near_cache", cache):
+        _apply_invalidation(f'{{"origin": "{INSTANCE_ID}", "keys": ["stock:a"]}}')
+        assert cache.get("stock:a") is not None  # собственное сообщение пропущено
+        _apply_invalidation('{"origin": "other-pod", "keys": ["stock:a", "stock:b"]}')
+
+    assert cache.get("stock:a") is None and cache.get("stock:b") is None
+
+
+@pytest.mark.parametrize("name", ["json", "orjson", "msgpack"])
+async def test_codecs_round_trip(name):
+    value = {"id": uuid.uuid4(), "quantity": 3, "at": datetime(2025, 2, 18, 12, 0)}
+    cache_codec = CODECS[name]()
+
+    encoded = cache_codec.encode(value)
+
+    expected = {"id": str(value["id"]), "quantity": 3, "at": "2025-02-18T12:00:00"}
+    assert cache_codec.decode(encoded) == expected
+    assert json.loads(cache_codec.to_json(encoded)) == expected
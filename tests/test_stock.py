@@ -1,7 +1,13 @@
+import json
+from datetime import timedelta
 import pytest
+from unittest.mock import patch
 from httpx import AsyncClient
+from sqlalchemy import func, select
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.db.models import Warehouse, Product, StockItem
+from app.db.models import Warehouse, Product, StockItem, StockSnapshot
+from app.services.kafka_processor import process_movement_event, process_movement_events
+from tests.test_kafka_processor import create_warehouse, make_event
 import uuid
 
 pytestmark = pytest.mark.asyncio
@@ -11,10 +17,12 @@ async def test_get_product_stock_exists(client: AsyncClient, db_session: AsyncSe
     # Arrange: Создаем данные в тестовой БД
     wh_id = uuid.uuid4()
     prod_id = uuid.uuid4()
-    warehouse = Warehouse(id=str(wh_id), code=f"WH-{str(wh_id)[:4]}")
+    warehouse = Warehouse(id=str(wh_id), code=f"WH-{wh_id.int % 10000:04d}")
     product = Product(id=str(prod_id))
     stock = StockItem(warehouse_id=str(wh_id), product_id=str(prod_id), quantity=50)
-    db_session.add_all([warehouse, product, stock])
+    db_session.add_all([warehouse, product])
+    await db_session.flush()
+    db_session.add(stock)
     await db_session.commit()
 
     # Act: Делаем запрос к API
@@ -44,3 +52,180 @@ async def test_get_product_stock_not_exists(
     assert data["warehouse_id"] == str(wh_id)
     assert data["product_id"] == str(prod_id)
     assert data["quantity"] == 0
+
+
+async def test_get_product_stock_read_through(
+    client: AsyncClient, db_session: AsyncSession
+):
+    # Arrange
+    wh_id = uuid.uuid4()
+    prod_id = uuid.uuid4()
+    warehouse = Warehouse(id=str(wh_id), code=f"WH-{wh_id.int % 10000:04d}")
+    product = Product(id=str(prod_id))
+    stock = StockItem(
+        warehouse_id=str(wh_id), product_id=str(prod_id), quantity=7, version=3
+    )
+    db_session.add_all([warehouse, product])
+    await db_session.flush()
+    db_session.add(stock)
+    await db_session.commit()
+
+    # Act
+    with patch(
+        "app.services.cache_loader.get_cache_json_with_ttl",
+        return_value=(None, None),
+    ), patch("app.api.v1.endpoints.stock.set_cache_if_newer") as mock_set:
+        response = await client.get(f"/api/v1/warehouse/{wh_id}/products/{prod_id}")
+
+    # Assert: промах кэша заполняется значением с версией строки из БД
+    assert response.json()["quantity"] == 7
+    mock_set.assert_awaited_once_with(
+        f"stock:{wh_id}:{prod_id}", response.json(), 3
+    )
+
+
+async def test_get_products_stock_batch(client: AsyncClient, db_session: AsyncSession):
+    # Arrange: один остаток уже в кэше, один в БД, одного нет нигде
+    wh_id = uuid.uuid4()
+    cached_id, stored_id, missing_id = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    db_session.add_all(
+        [
+            Warehouse(id=str(wh_id), code=f"WH-{wh_id.int % 10000:04d}"),
+            Product(id=str(stored_id)),
+        ]
+    )
+    await db_session.flush()
+    db_session.add(
+        StockItem(
+            warehouse_id=str(wh_id), product_id=str(stored_id), quantity=5, version=2
+        )
+    )
+    await db_session.commit()
+
+    # Act
+    with patch(
+        "app.services.stock.get_many_cache",
+        return_value=[{"quantity": 3}, None, None],
+    ) as mock_mget, patch("app.services.stock.set_many_cache_if_newer") as mock_set:
+        response = await client.post(
+            f"/api/v1/warehouse/{wh_id}/products:batch",
+            json={"product_ids": [str(cached_id), str(stored_id), str(missing_id)]},
+        )
+
+    # Assert: один MGET, промахи дозаполнены одной пачкой с версиями
+    assert response.status_code == 200
+    assert response.json() == [
+        {"product_id": str(cached_id), "quantity": 3},
+        {"product_id": str(stored_id), "quantity": 5},
+        {"product_id": str(missing_id), "quantity": 0},
+    ]
+    mock_mget.assert_awaited_once()
+    entries = mock_set.await_args[0][0]
+    assert {key: version for key, (_, version) in entries.items()} == {
+        f"stock:{wh_id}:{stored_id}": 2,
+        f"stock:{wh_id}:{missing_id}": 0,
+    }
+
+
+async def test_list_products_stock_pages(client: AsyncClient, db_session: AsyncSession):
+    # Arrange
+    wh_id = uuid.uuid4()
+    product_ids = sorted(str(uuid.uuid4()) for _ in range(3))
+    db_session.add(Warehouse(id=str(wh_id), code=f"WH-{wh_id.int % 10000:04d}"))
+    db_session.add_all([Product(id=product_id) for product_id in product_ids])
+    await db_session.flush()
+    db_session.add_all(
+        [
+            StockItem(warehouse_id=str(wh_id), product_id=product_id, quantity=i)
+            for i, product_id in enumerate(product_ids)
+        ]
+    )
+    await db_session.commit()
+    url = f"/api/v1/warehouse/{wh_id}/products"
+
+    # Act: две страницы по keyset-курсору и полная NDJSON-выгрузка
+    first = (await client.get(url, params={"limit": 2})).json()
+    second = (
+        await client.get(url, params={"limit": 2, "after": first["next_cursor"]})
+    ).json()
+    stream = await client.get(url, params={"format": "ndjson"})
+
+    # Assert
+    assert [item["product_id"] for item in first["items"]] == product_ids[:2]
+    assert first["next_cursor"] == product_ids[1]
+    assert second == {
+        "items": [{"product_id": product_ids[2], "quantity": 2}],
+        "next_cursor": None,
+    }
+    assert stream.headers["content-type"] == "application/x-ndjson"
+    assert [json.loads(line) for line in stream.text.splitlines()] == [
+        {"product_id": product_id, "quantity": i}
+        for i, product_id in enumerate(product_ids)
+    ]
+
+
+async def test_get_product_stock_as_of(client: AsyncClient, db_session: AsyncSession):
+    # Arrange: три изменения остатка, снимок — на каждой второй версии
+    product_id = str(uuid.uuid4())
+    db_session.add(Product(id=product_id))
+    warehouse_id = await create_warehouse(db_session)
+    moments = [await db_session.scalar(select(func.clock_timestamp()))]
+    with patch("app.services.stock_ledger.settings.STOCK_SNAPSHOT_INTERVAL", 2):
+        # Поштучная и пакетная обработка пишут журнал одинаково
+        event = make_event("arrival", uuid.uuid4(), warehouse_id, product_id, 10)
+        await process_movement_event(db_session, event)
+        moments.append(await db_session.scalar(select(func.clock_timestamp())))
+        await process_movement_events(
+            db_session,
+            [make_event("departure", uuid.uuid4(), warehouse_id, product_id, 3)],
+        )
+        moments.append(await db_session.scalar(select(func.clock_timestamp())))
+        event = make_event("arrival", uuid.uuid4(), warehouse_id, product_id, 5)
+        await process_movement_event(db_session, event)
+        moments.append(await db_session.scalar(select(func.clock_timestamp())))
+        await db_session.flush()
+
+        # Act
+        quantities = []
+        for moment in moments:
+            response = await client.get(
+                f"/api/v1/warehouse/{warehouse_id}/products/{product_id}",
+                params={"as_of": moment.isoformat()},
+            )
+            assert response.status_code == 200
+            quantities.append(response.json()["quantity"])
+
+    # Assert
+    assert quantities == [0, 10, 7, 12]
+
+
+async def test_stock_as_of_before_migration_seed_is_unavailable(
+    client: AsyncClient, db_session: AsyncSession
+):
+    # Arrange: остаток существовал до журнала — миграция 0010 засеяла снимок
+    # версии 0, затем пришло одно изменение
+    product_id = str(uuid.uuid4())
+    db_session.add(Product(id=product_id))
+    warehouse_id = await create_warehouse(db_session, {product_id: 50})
+    db_session.add(
+        StockSnapshot(
+            warehouse_id=warehouse_id, product_id=product_id, version=0, quantity=50
+        )
+    )
+    await db_session.flush()
+    event = make_event("arrival", uuid.uuid4(), warehouse_id, product_id, 5)
+    await process_movement_event(db_session, event)
+    await db_session.flush()
+    now = await db_session.scalar(select(func.clock_timestamp()))
+    path = f"/api/v1/warehouse/{warehouse_id}/products/{product_id}"
+
+    # Act
+    before = await client.get(
+        path, params={"as_of": (now - timedelta(days=30)).isoformat()}
+    )
+    after = await client.get(path, params={"as_of": now.isoformat()})
+
+    # Assert: до начального снимка истории нет, после — снимок плюс журнал
+    assert before.status_code == 404
+    assert after.status_code == 200
+    assert after.json()["quantity"] == 55